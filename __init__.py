@@ -1,53 +1,102 @@
 """The Modbus Switch integration."""
 from __future__ import annotations
 
+import asyncio
 import logging
-from datetime import timedelta
+from typing import Any
 import voluptuous as vol
 
-from homeassistant.core import HomeAssistant
+from homeassistant.core import HomeAssistant, ServiceCall
 from homeassistant.helpers import discovery
+from homeassistant.helpers.reload import async_integration_yaml_config
 from homeassistant.helpers.typing import ConfigType
 import homeassistant.helpers.config_validation as cv
+from homeassistant.util.json import save_json
 
 from homeassistant.const import (
+    ATTR_ENTITY_ID,
     CONF_NAME,
     CONF_PORT,
     CONF_DEVICES,
     CONF_ID,
     CONF_DEVICE_ID,
-    CONF_MODE
+    CONF_MODE,
+    CONF_STATE,
 )
 
 from .const import *
-from .device import ModbusPort
+from .decoder import DATA_TYPES, WORD_ORDERS
+from .samples import AGGREGATES
+from .device import CoilEntity, DiscreteInputEntity, HoldingEntity, ModbusPort
+from .scanner import Topology
+from .snapshot import Snapshot
 
 _LOGGER = logging.getLogger(__name__)
 
+# poll interval in seconds
+POLL_INTERVAL = vol.All(cv.positive_int, vol.Range(min=1))
+# response timeout of a slave in ms
+RESPONSE_TIMEOUT = vol.All(cv.positive_int, vol.Range(min=1))
+SLAVE_ID = vol.All(vol.Coerce(int), vol.Range(min=1, max=247))
+# address of a point in its table
+POINT_ID = vol.All(vol.Coerce(int), vol.Range(min=0, max=65535))
+
 COIL_SCHEMA_ENTRY = vol.Schema(
     {
-        vol.Required(CONF_ID): vol.Range(min=0, max=31),
-        vol.Required(CONF_NAME): cv.string
+        vol.Required(CONF_ID): POINT_ID,
+        vol.Required(CONF_NAME): cv.string,
+        vol.Optional(CONF_AUTOUPDATE): POLL_INTERVAL
     }
 )
 
+DISCRETE_INPUT_SCHEMA_ENTRY = COIL_SCHEMA_ENTRY
+
 INPUT_SCHEMA_ENTRY = vol.Schema(
     {
-        vol.Required(CONF_ID): vol.Range(min=1, max=31),
+        vol.Required(CONF_ID): POINT_ID,
         vol.Required(CONF_NAME): cv.string,
-        vol.Required(CONF_MODE): vol.Any("temperature", "voltage")
+        vol.Required(CONF_MODE): vol.Any("temperature", "voltage", "generic"),
+        vol.Optional(CONF_DATA_TYPE): vol.In(DATA_TYPES),
+        vol.Optional(CONF_WORD_ORDER, default="big"): vol.In(WORD_ORDERS),
+        vol.Optional(CONF_SCALE): vol.All(vol.Coerce(float), vol.NotIn([0], msg="scale can't be 0")),
+        vol.Optional(CONF_OFFSET, default=0): vol.Coerce(float),
+        vol.Optional(CONF_DEADBAND, default=0): vol.All(vol.Coerce(float), vol.Range(min=0)),
+        vol.Optional(CONF_RELATIVE_DEADBAND, default=0): vol.All(vol.Coerce(float), vol.Range(min=0, max=100)),
+        vol.Optional(CONF_AUTOUPDATE): POLL_INTERVAL,
+        vol.Optional(CONF_AGGREGATE): vol.In(AGGREGATES),
+        vol.Optional(CONF_AGGREGATE_INTERVAL, default=60): POLL_INTERVAL,
+        vol.Optional(CONF_SAMPLES, default=SAMPLE_BUFFER): vol.All(cv.positive_int, vol.Range(min=1, max=100000)),
+    }
+)
+
+HOLDING_SCHEMA_ENTRY = INPUT_SCHEMA_ENTRY.extend(
+    {
+        vol.Optional(CONF_MODE, default="generic"): vol.Any("temperature", "voltage", "generic"),
+        vol.Optional(CONF_WRITABLE, default=True): cv.boolean,
+        vol.Optional(CONF_MIN): vol.Coerce(float),
+        vol.Optional(CONF_MAX): vol.Coerce(float),
+        vol.Optional(CONF_STEP): vol.All(vol.Coerce(float), vol.Range(min=0, min_included=False)),
     }
 )
 
 DEVICE_SCHEMA_ENTRY = vol.Schema(
     {
         vol.Required(CONF_DEVICE_ID): cv.string,
-        vol.Required(CONF_SLAVE_ID): vol.Range(min=1, max=247),
+        vol.Required(CONF_SLAVE_ID): SLAVE_ID,
+        vol.Optional(CONF_AUTOUPDATE): POLL_INTERVAL,
+        vol.Optional(CONF_READ_GAP): cv.positive_int,
+        vol.Optional(CONF_RESPONSE_TIMEOUT): RESPONSE_TIMEOUT,
         vol.Optional(CONF_COILS): vol.All(
             cv.ensure_list, [COIL_SCHEMA_ENTRY]
         ),
+        vol.Optional(CONF_DISCRETE_INPUTS): vol.All(
+            cv.ensure_list, [DISCRETE_INPUT_SCHEMA_ENTRY]
+        ),
         vol.Optional(CONF_INPUTS): vol.All(
             cv.ensure_list, [INPUT_SCHEMA_ENTRY]
+        ),
+        vol.Optional(CONF_HOLDINGS): vol.All(
+            cv.ensure_list, [HOLDING_SCHEMA_ENTRY]
         )
     }
 )
@@ -56,52 +105,225 @@ MODBUS_PORT_SCHEMA_ENTRY = vol.Schema(
     {
         vol.Required(CONF_NAME): cv.string,
         vol.Required(CONF_PORT): cv.string,
+        vol.Optional(CONF_DRIVER, default=DRIVER_RS485PI): vol.Any(
+            DRIVER_RS485PI, DRIVER_SERIAL, DRIVER_TCP, DRIVER_RTUOVERTCP
+        ),
+        vol.Optional(CONF_CONNECTIONS, default=1): vol.All(cv.positive_int, vol.Range(min=1)),
         vol.Optional(CONF_BAUDRATE, default=9600): cv.positive_int,
         vol.Optional(CONF_STOPBITS, default=1): vol.Any(1, 2),
         vol.Optional(CONF_BYTESIZE, default=8): vol.Any(5, 6, 7, 8),
         vol.Optional(CONF_PARITY, default="N"): vol.Any("E", "O", "N"),
         vol.Optional(CONF_RTSMODE, default="U"): vol.Any("U", "D"),
-        vol.Required(CONF_RTSPIN): cv.positive_int,
+        vol.Optional(CONF_RTSPIN): cv.positive_int,
         vol.Optional(CONF_RTSDELAY, default=100): cv.positive_int,
+        vol.Optional(CONF_WRITE_WINDOW, default=20): cv.positive_int,
+        vol.Optional(CONF_FRAME_GAP): vol.All(vol.Coerce(float), vol.Range(min=0)),
+        vol.Optional(CONF_BROADCAST, default=False): cv.boolean,
+        vol.Optional(CONF_BROADCAST_DELAY): cv.positive_int,
+        vol.Optional(CONF_AUTOUPDATE, default=30): POLL_INTERVAL,
+        vol.Optional(CONF_READ_GAP): cv.positive_int,
+        vol.Optional(CONF_RESPONSE_TIMEOUT): RESPONSE_TIMEOUT,
+        vol.Optional(CONF_DISCOVERY, default=False): cv.boolean,
         vol.Optional(CONF_DEVICES): vol.All(
             cv.ensure_list, [DEVICE_SCHEMA_ENTRY]
         )
     }
 )
 
+
+def _validate_port(config: ConfigType) -> ConfigType:
+    """The rs485pi driver switches the RS485 direction with a GPIO pin, so it needs one."""
+    if config[CONF_DRIVER] == DRIVER_RS485PI and CONF_RTSPIN not in config:
+        raise vol.Invalid(f"{CONF_RTSPIN} is required by the {DRIVER_RS485PI} driver")
+    return config
+
+
+DUMP_DIAGNOSTICS_SCHEMA = vol.Schema(
+    {
+        vol.Optional(CONF_PORT): cv.string,
+    }
+)
+
+
+def _validate_scan_range(data: dict[str, Any]) -> dict[str, Any]:
+    """The slave id range of a scan can't be empty"""
+    if data[CONF_FIRST] > data[CONF_LAST]:
+        raise vol.Invalid(f"{CONF_FIRST} can't be greater than {CONF_LAST}")
+    return data
+
+
+SCAN_SCHEMA = vol.All(
+    vol.Schema(
+        {
+            vol.Required(CONF_PORT): cv.string,
+            vol.Optional(CONF_FIRST, default=1): SLAVE_ID,
+            vol.Optional(CONF_LAST, default=247): SLAVE_ID,
+            vol.Optional(CONF_PROBE_TIMEOUT, default=PROBE_TIMEOUT): RESPONSE_TIMEOUT,
+        }
+    ),
+    _validate_scan_range,
+)
+
+WRITE_COILS_SCHEMA = vol.Schema(
+    {
+        vol.Required(ATTR_ENTITY_ID): cv.entity_ids,
+        vol.Required(CONF_STATE): cv.boolean,
+    }
+)
+
 CONFIG_SCHEMA = vol.Schema(
     {
-        DOMAIN: vol.All(cv.ensure_list, [MODBUS_PORT_SCHEMA_ENTRY])
+        DOMAIN: vol.All(cv.ensure_list, [vol.All(MODBUS_PORT_SCHEMA_ENTRY, _validate_port)])
     },
     extra=vol.ALLOW_EXTRA,
 )
 
 
+def _platform_of(entity: Any) -> str:
+    if isinstance(entity, CoilEntity):
+        return "switch"
+    if isinstance(entity, DiscreteInputEntity):
+        return "binary_sensor"
+    if isinstance(entity, HoldingEntity):
+        return "number"
+    return "sensor"
+
+
+async def _async_add_entities(hass: HomeAssistant, config: ConfigType, entities: list) -> None:
+    """Add the entities of a reload to ha, with the callback of their platform if it is loaded
+    already, otherwise by loading the platform which adds them"""
+    by_platform = {}
+    for entity in entities:
+        by_platform.setdefault(_platform_of(entity), []).append(entity)
+    callbacks = hass.data.get(DATA_ADD_ENTITIES, {})
+    for platform, platform_entities in by_platform.items():
+        if platform in callbacks:
+            callbacks[platform](platform_entities)
+        else:
+            await discovery.async_load_platform(hass, platform, DOMAIN, {DOMAIN: ""}, config)
+
+
 async def async_setup(hass: HomeAssistant, config: ConfigType) -> bool:
     if DOMAIN not in config:
         return True
 
+    # the last known state of the ports is restored before the entities are added
+    snapshot = Snapshot(hass)
+    await snapshot.async_load()
+    topology = Topology(hass)
+    await topology.async_load()
+
     ports = []
     for port_config in config[DOMAIN]:
-        ports.append(ModbusPort(hass, port_config))
+        ports.append(ModbusPort(hass, port_config, snapshot=snapshot, topology=topology))
     hass.data[DOMAIN] = ports
 
     has_coil = False
-    has_input = False
+    has_discrete = False
+    has_number = False
     for port in ports:
         for dev in port.devices:
             if not has_coil and len(dev.coils) > 0:
                 has_coil = True
-            if not has_input and len(dev.inputs) > 0:
-                has_input = True
+            if not has_discrete and len(dev.discrete_inputs) > 0:
+                has_discrete = True
+            if not has_number and any(holding.writable for holding in dev.holdings.values()):
+                has_number = True
     if has_coil:
         _LOGGER.info("Load switch platform for add coil entities")
         await discovery.async_load_platform(hass, "switch", DOMAIN, {DOMAIN: ""}, config)
-    if has_input:
-        _LOGGER.info("Load sensor platform for add input entities")
+    if has_discrete:
+        _LOGGER.info("Load binary sensor platform for add discrete input entities")
+        await discovery.async_load_platform(hass, "binary_sensor", DOMAIN, {DOMAIN: ""}, config)
+    if has_number:
+        _LOGGER.info("Load number platform for add holding register entities")
+        await discovery.async_load_platform(hass, "number", DOMAIN, {DOMAIN: ""}, config)
+    # every port has diagnostic sensors besides the input entities
+    if ports:
+        _LOGGER.info("Load sensor platform for add input and diagnostic entities")
         await discovery.async_load_platform(hass, "sensor", DOMAIN, {DOMAIN: ""}, config)
 
+    async def async_dump_diagnostics(call: ServiceCall) -> None:
+        """Write the diagnostics of the ports, or of the given port, into the config directory"""
+        name = call.data.get(CONF_PORT)
+        dump = [port.diagnostics() for port in hass.data[DOMAIN] if name is None or port.name == name]
+        path = hass.config.path(DIAGNOSTICS_FILE)
+        await hass.async_add_executor_job(save_json, path, dump)
+        _LOGGER.info(f"Diagnostics of {len(dump)} ports written to {path}")
+
+    hass.services.async_register(DOMAIN, SERVICE_DUMP_DIAGNOSTICS, async_dump_diagnostics,
+                                 schema=DUMP_DIAGNOSTICS_SCHEMA)
+
+    async def async_scan(call: ServiceCall) -> None:
+        """Sweep the bus of a port for slaves, the found topology is logged and cached"""
+        for port in hass.data[DOMAIN]:
+            if port.name == call.data[CONF_PORT]:
+                await port.async_scan(call.data[CONF_FIRST], call.data[CONF_LAST], call.data[CONF_PROBE_TIMEOUT])
+                return
+        _LOGGER.error(f"No port {call.data[CONF_PORT]} to scan")
+
+    hass.services.async_register(DOMAIN, SERVICE_SCAN, async_scan, schema=SCAN_SCHEMA)
+
+    async def async_write_coils(call: ServiceCall) -> None:
+        """Switch a group of coils with as few frames as possible, the ports are written concurrently"""
+        entity_ids = set(call.data[ATTR_ENTITY_ID])
+        writes = []
+        for port in hass.data[DOMAIN]:
+            coils = [coil for dev in port.devices for coil in dev.coils.values() if coil.entity_id in entity_ids]
+            if coils:
+                writes.append(port.async_write_coils(coils, call.data[CONF_STATE]))
+        await asyncio.gather(*writes)
+
+    hass.services.async_register(DOMAIN, SERVICE_WRITE_COILS, async_write_coils, schema=WRITE_COILS_SCHEMA)
+
+    async def async_reload(call: ServiceCall) -> None:
+        """Apply the changed yaml config. A port with the same connection settings stays connected
+        and only its changed devices are replaced, the other ports are started again."""
+        reloaded = await async_integration_yaml_config(hass, DOMAIN)
+        if reloaded is None:
+            _LOGGER.error("Reload failed, the config is invalid")
+            return
+        running = {port.name: port for port in hass.data[DOMAIN]}
+        ports = []
+        started = []
+        added = []
+        removed = []
+        for port_config in reloaded.get(DOMAIN, []):
+            port = running.pop(port_config[CONF_NAME], None)
+            if port is not None and port.same_connection(port_config):
+                port_added, port_removed = port.reconfigure(port_config)
+                added.extend(port_added)
+                removed.extend(port_removed)
+                ports.append(port)
+                continue
+            if port is not None:
+                _LOGGER.info(f"{port} connection settings changed, reconnecting")
+                await port.async_close()
+                snapshot.remove(port)
+                removed.extend(port.entities)
+            port = ModbusPort(hass, port_config, snapshot=snapshot, topology=topology)
+            added.extend(port.entities)
+            ports.append(port)
+            started.append(port)
+        for port in running.values():
+            _LOGGER.info(f"{port} removed")
+            await port.async_close()
+            snapshot.remove(port)
+            removed.extend(port.entities)
+        hass.data[DOMAIN] = ports
+
+        for entity in removed:
+            if entity.hass:
+                await entity.async_remove()
+        await _async_add_entities(hass, config, added)
+        for port in started:
+            port.async_start()
+        _LOGGER.info(f"Reloaded: {len(added)} entities added, {len(removed)} removed, {len(started)} ports started")
+
+    hass.services.async_register(DOMAIN, SERVICE_RELOAD, async_reload)
+
+    # the ports connect and poll in the background, the setup time doesn't grow with the ports
     for port in ports:
-        await port.async_enable_auto_update(timedelta(seconds=30), True)
+        port.async_start()
 
     return True
@@ -0,0 +1 @@
+"""Benchmarks of the integration on simulated slaves, run with python -m <package>.benchmark"""
@@ -0,0 +1,182 @@
+"""Benchmark of the poll cycle, the write latency and the bus throughput of a ModbusPort on
+simulated slaves. Every topology is a port with the given count of slaves, each of them with
+8 coils and 2 input registers. The results are printed as JSON, one object per topology."""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import platform
+import random
+import statistics
+import time
+import tracemalloc
+from typing import Any
+
+from homeassistant.core import HomeAssistant
+
+from .. import MODBUS_PORT_SCHEMA_ENTRY
+from ..const import DRIVER_SERIAL
+from ..device import ModbusPort
+from ..simulator import SimulatedSlave
+from .driver import ScriptedDriver
+
+
+def _devices(slaves: int) -> list[dict[str, Any]]:
+    return [
+        {
+            "device_id": f"bench_{slave_id}",
+            "slave_id": slave_id,
+            "coils": [{"id": coil, "name": f"coil_{slave_id}_{coil}"} for coil in range(8)],
+            "inputs": [
+                {"id": 1, "name": f"temp_{slave_id}", "mode": "temperature", "value": 215},
+                {"id": 4, "name": f"vin_{slave_id}", "mode": "voltage", "value": 120},
+            ],
+        }
+        for slave_id in range(1, slaves + 1)
+    ]
+
+
+def _device_config(device: dict[str, Any]) -> dict[str, Any]:
+    """Device config of the integration without the simulation keys"""
+    inputs = [{key: value for key, value in entry.items() if key != "value"} for entry in device["inputs"]]
+    return {**device, "inputs": inputs}
+
+
+def _percentile(values: list[float], percent: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+
+async def _measure_allocations(port: ModbusPort, cycles: int) -> tuple[list[int], list[int]]:
+    """Peak and retained bytes of the poll cycles, traced on all threads including the I/O thread.
+    Run apart from the timed cycles, tracing slows the allocations down."""
+    peaks = []
+    retained = []
+    tracemalloc.start()
+    try:
+        for _ in range(cycles):
+            before, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            await port._async_update_state()
+            after, peak = tracemalloc.get_traced_memory()
+            peaks.append(peak - before)
+            retained.append(after - before)
+    finally:
+        tracemalloc.stop()
+    return peaks, retained
+
+
+async def _run_topology(hass: HomeAssistant, slaves: int, baudrate: int, cycles: int, writes: int,
+                        latency: float) -> dict[str, Any]:
+    devices = _devices(slaves)
+    config = MODBUS_PORT_SCHEMA_ENTRY({
+        "name": f"bench{slaves}",
+        "port": "simulated",
+        "driver": DRIVER_SERIAL,
+        "baudrate": baudrate,
+        "devices": [_device_config(device) for device in devices],
+    })
+    for device in devices:
+        device["latency"] = latency
+    driver = ScriptedDriver({device["slave_id"]: SimulatedSlave(device, seed=0) for device in devices}, baudrate)
+    port = ModbusPort(hass, config, driver)
+    try:
+        # poll cycles on an idle bus
+        durations = []
+        await port.async_connect()
+        await port._async_update_state()
+        for _ in range(cycles):
+            start = time.perf_counter()
+            await port._async_update_state()
+            durations.append(time.perf_counter() - start)
+        peaks, retained = await _measure_allocations(port, cycles)
+
+        # writes while the port polls continuously
+        coils = [coil for device in port.devices for coil in device.coils.values()]
+        rng = random.Random(0)
+        polling = True
+
+        async def poll_forever() -> None:
+            while polling:
+                await port._async_update_state()
+
+        transactions = driver.transactions
+        sent_bytes = driver.bytes
+        start = time.perf_counter()
+        poller = asyncio.ensure_future(poll_forever())
+        latencies = []
+        for _ in range(writes):
+            await asyncio.sleep(rng.uniform(0, 0.2))
+            coil = rng.choice(coils)
+            write_start = time.perf_counter()
+            await port.async_write_coil(coil, rng.random() < 0.5)
+            latencies.append(time.perf_counter() - write_start)
+        polling = False
+        await poller
+        elapsed = time.perf_counter() - start
+    finally:
+        port.stop()
+
+    return {
+        "slaves": slaves,
+        "baudrate": baudrate,
+        "coils": len(coils),
+        "plan_frames": port.plan_frames,
+        "plan_bytes": port.plan_bytes,
+        "cycle_ms": {
+            "mean": statistics.mean(durations) * 1000,
+            "p50": _percentile(durations, 50) * 1000,
+            "p99": _percentile(durations, 99) * 1000,
+        },
+        "write_latency_ms": {
+            "p50": _percentile(latencies, 50) * 1000,
+            "p99": _percentile(latencies, 99) * 1000,
+        },
+        "transactions_per_s": (driver.transactions - transactions) / elapsed,
+        "bytes_per_s": (driver.bytes - sent_bytes) / elapsed,
+        "allocated_bytes_per_cycle": {
+            "peak": statistics.mean(peaks),
+            "retained": statistics.mean(retained),
+        },
+    }
+
+
+async def _main(args: argparse.Namespace) -> list[dict[str, Any]]:
+    hass = HomeAssistant()
+    results = []
+    for baudrate in args.baudrates:
+        for slaves in args.slaves:
+            result = await _run_topology(hass, slaves, baudrate, args.cycles, args.writes, args.latency)
+            print(json.dumps(result), flush=True)
+            results.append(result)
+    return results
+
+
+def _int_list(value: str) -> list[int]:
+    return [int(item) for item in value.split(",")]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--slaves", type=_int_list, default=[1, 4, 16, 64], help="slave counts, comma separated")
+    parser.add_argument("--baudrates", type=_int_list, default=[9600, 115200], help="baud rates, comma separated")
+    parser.add_argument("--cycles", type=int, default=5, help="measured poll cycles per topology")
+    parser.add_argument("--writes", type=int, default=20, help="measured coil writes per topology")
+    parser.add_argument("--latency", type=float, default=5, help="response latency of the slaves in ms")
+    parser.add_argument("--output", help="write the results with the environment to this JSON file")
+    args = parser.parse_args()
+
+    results = asyncio.run(_main(args))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump({
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "results": results,
+            }, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
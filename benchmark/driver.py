@@ -0,0 +1,69 @@
+"""Scripted driver of the benchmarks: answers from simulated slaves and spends the time a real
+RTU bus would need for the transaction."""
+from __future__ import annotations
+
+import time
+from typing import Any
+
+from ..exceptions import ModbusTimeoutError
+from ..modbus_pdu import MODBUS_BROADCAST_ADDRESS, REQUESTS, check_response
+from ..simulator import SimulatedSlave
+
+# bytes of a RTU frame around the PDU: slave address and crc
+RTU_OVERHEAD = 3
+
+
+class ScriptedDriver:
+    """Driver with the interface of ModbusCore on simulated slaves. A transaction takes the
+    transmission time of the request and the response at the baud rate, plus the latency of
+    the slave."""
+
+    def __init__(self, slaves: dict[int, SimulatedSlave], baudrate: int, response_timeout: float = 0.5):
+        self.slaves = slaves
+        self.baudrate = baudrate
+        self.response_timeout = response_timeout
+        self.slave = MODBUS_BROADCAST_ADDRESS
+        self.transactions = 0
+        self.bytes = 0
+
+    def _wire_time(self, size: int) -> float:
+        return size * 11 / self.baudrate
+
+    def connect(self):
+        pass
+
+    def close(self):
+        pass
+
+    def set_slave(self, slave):
+        self.slave = slave
+
+    def get_response_timeout(self):
+        return self.response_timeout
+
+    def set_response_timeout(self, seconds):
+        self.response_timeout = seconds
+
+    def _call(self, name: str, *args: Any) -> Any:
+        function, payload, decode = REQUESTS[name](*args)
+        self.transactions += 1
+        request_size = len(payload) + 1 + RTU_OVERHEAD
+        self.bytes += request_size
+        if self.slave == MODBUS_BROADCAST_ADDRESS:
+            time.sleep(self._wire_time(request_size))
+            for slave in self.slaves.values():
+                slave.handle(function, payload)
+            return decode(b"")
+        slave = self.slaves.get(self.slave)
+        if slave is None or slave.drop():
+            time.sleep(self._wire_time(request_size) + self.response_timeout)
+            raise ModbusTimeoutError("Connection timed out")
+        response = slave.handle(function, payload)
+        self.bytes += len(response) + RTU_OVERHEAD
+        time.sleep(self._wire_time(request_size + len(response) + RTU_OVERHEAD) + slave.latency)
+        return decode(check_response(function, response))
+
+    def __getattr__(self, name: str) -> Any:
+        if name not in REQUESTS:
+            raise AttributeError(name)
+        return lambda *args: self._call(name, *args)
@@ -0,0 +1,30 @@
+from __future__ import annotations
+
+import logging
+
+from .const import DATA_ADD_ENTITIES, DOMAIN
+
+_LOGGER = logging.getLogger(__name__)
+
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers.entity_platform import AddEntitiesCallback
+from homeassistant.helpers.typing import ConfigType, DiscoveryInfoType
+
+
+async def async_setup_platform(hass: HomeAssistant, config: ConfigType,
+                               async_add_entities: AddEntitiesCallback,
+                               discovery_info: DiscoveryInfoType = None) -> None:
+
+    if not discovery_info:
+        return
+    # entities added by a reload of the config are added with the callback of the platform
+    hass.data.setdefault(DATA_ADD_ENTITIES, {})["binary_sensor"] = async_add_entities
+
+    discrete_inputs = []
+    for port in hass.data[DOMAIN]:
+        for device in port.devices:
+            discrete_inputs.extend(device.discrete_inputs.values())
+
+    if len(discrete_inputs) > 0:
+        async_add_entities(discrete_inputs)
+        _LOGGER.info(f"Discrete input binary sensors added: {discrete_inputs}")
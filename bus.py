@@ -0,0 +1,392 @@
+from __future__ import annotations
+
+import asyncio
+import itertools
+import logging
+import queue
+import threading
+import time
+from typing import Any, Callable, Collection
+
+from homeassistant.core import HomeAssistant
+
+from .const import PRIORITY_WRITE
+from .exceptions import ModbusConnectionError, ModbusException, ModbusExceptionResponse, SlaveUnavailable
+from .health import SlaveHealth
+from .metrics import BusMetrics
+from .modbus_pdu import MODBUS_BROADCAST_ADDRESS
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class _Job:
+    """A blocking call waiting for the I/O thread. The done callback is called on the I/O thread
+    with the result or the raised exception.
+
+    A job is either a function call, or a modbus request given as (slave, driver method name, args).
+    Requests can be sent together by drivers supporting pipelining."""
+
+    def __init__(self, func: Callable | None, args: tuple, deadline: float | None,
+                 done: Callable[[Any, Exception | None], None], request: tuple | None = None,
+                 cancelled: Callable[[], bool] | None = None, tracked: bool = True):
+        self.func = func
+        self.args = args
+        self.deadline = deadline
+        self.done = done
+        self.request = request
+        # whether the caller stopped waiting for the job, a cancelled job is dropped before the start
+        self.cancelled = cancelled
+        # whether the request is recorded in the metrics of the bus and the health of its slave
+        self.tracked = tracked
+
+    def __str__(self):
+        return self.func.__name__ if self.request is None else f"{self.request[1]}@{self.request[0]}"
+
+    def expired(self) -> bool:
+        """Fail the job if its deadline passed before the start."""
+        if self.cancelled is not None and self.cancelled():
+            return True
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            self.done(None, TimeoutError(f"deadline of {self} exceeded before start"))
+            return True
+        return False
+
+    def run(self) -> None:
+        """Run a function call job, the requests are run by the bus"""
+        if self.expired():
+            return
+        try:
+            result = self.func(*self.args)
+        except Exception as err:  # pylint: disable=broad-except
+            self.done(None, err)
+        else:
+            self.done(result, None)
+
+
+def rtu_frame_gap(baudrate: int, bytesize: int, parity: str, stopbits: int) -> float:
+    """Silent interval between modbus RTU frames in seconds: 3.5 character times, but at least
+    1.75 ms as the specification recommends for baud rates above 19200."""
+    char_bits = 1 + bytesize + (0 if parity == "N" else 1) + stopbits
+    if baudrate > 19200:
+        return 0.00175
+    return 3.5 * char_bits / baudrate
+
+
+def _set_future(future: asyncio.Future, result: Any, err: Exception | None) -> None:
+    if future.done():
+        return
+    if err is not None:
+        future.set_exception(err)
+    else:
+        future.set_result(result)
+
+
+class ModbusBus:
+    """Dedicated I/O thread of a modbus port, owns the driver of the port. All blocking driver calls
+    of the port run here one after another, so the port doesn't need the shared executor of Home
+    Assistant and the calls can't be concurrent. If the driver supports pipelining, the waiting
+    requests are sent together.
+
+    Jobs are scheduled by priority class (see PRIORITY_* constants), in order of arrival within a
+    class. A job which is not started before its deadline fails with TimeoutError, and a job whose
+    caller was cancelled is dropped, or aborted by the driver if it is running. A started request is
+    bounded by its deadline too: the response timeout given to the driver is cut to the time left.
+    Every modbus request is recorded in the metrics of the bus and in the health of its slave, the
+    requests of a slave in backoff fail with SlaveUnavailable without using the bus (see
+    SlaveHealth). The untracked requests, like the scan probes of unconfigured slaves, are left out
+    of both.
+
+    The I/O thread owns the bus: a frame is sent only after the previous transaction finished, or
+    was abandoned by the driver on a timeout or a corrupted response, and after the turnaround: the
+    frame gap, or the broadcast delay after a broadcast. The input left over from an abandoned
+    transaction is flushed before the next frame, so a late response can't be taken as the response
+    of the next request."""
+
+    def __init__(self, hass: HomeAssistant, name: str, driver: Any = None, frame_gap: float = 0,
+                 metrics: BusMetrics | None = None, broadcast_delay: float = 0):
+        self._hass = hass
+        self.name = name
+        self.driver = driver
+        self.metrics = metrics if metrics is not None else BusMetrics()
+        # requests fail until the driver is connected, see connect
+        self.connected = False
+        self.health: dict[int, SlaveHealth] = {}
+        # response timeouts of the slaves in seconds, the others use the default of the driver
+        self.response_timeouts: dict[int, float] = {}
+        self._default_response_timeout = None
+        self._response_timeout = None
+        # silent interval needed by the bus between the end of a frame and the next request
+        self.frame_gap = frame_gap
+        # turnaround delay after a broadcast, the slaves process it before the next request
+        self.broadcast_delay = broadcast_delay
+        self._turnaround = frame_gap
+        self._last_frame_end = 0.0
+        # the last transaction ended without a complete response, see _record
+        self._abandoned = False
+        self._queue = queue.PriorityQueue()
+        self._sequence = itertools.count()
+        self._thread = None
+        # the request jobs in flight, these can be aborted from the event loop, see abort
+        self._running: list[_Job] = []
+        self._running_lock = threading.Lock()
+
+    def __str__(self):
+        return f"<ModbusBus {self.name}>"
+
+    def start(self) -> None:
+        """Start the I/O thread"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=f"modbus_sw-{self.name}", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the I/O thread after the already queued jobs are done"""
+        if self._thread is not None:
+            self._queue.put((float("inf"), next(self._sequence), None))
+            self._thread = None
+
+    def connect(self, create_driver: Callable[[], Any]) -> None:
+        """Create the driver if there is none yet and connect it. Blocking, run it on the I/O thread
+        with async_call, so loading the native libraries doesn't block the event loop either."""
+        if self.driver is None:
+            self.driver = create_driver()
+        self.driver.connect()
+        self._default_response_timeout = self._response_timeout = self.driver.get_response_timeout()
+        self.connected = True
+
+    def disconnect(self) -> None:
+        """Close the driver, the requests fail until the next connect. Blocking, run it on the
+        I/O thread with async_call."""
+        self.connected = False
+        if self.driver is not None:
+            self.driver.close()
+
+    def abort(self, cancelled_only: bool = False) -> None:
+        """Abort the running transaction, if the driver can. With cancelled_only, only if all of
+        its callers were cancelled. Can be called from any thread."""
+        abort = getattr(self.driver, "abort", None)
+        if abort is None:
+            return
+        # the lock keeps the jobs running until the abort is sent, a late abort is dropped by the
+        # driver at the start of the next transaction
+        with self._running_lock:
+            if not self._running:
+                return
+            if cancelled_only and not all(job.cancelled is not None and job.cancelled() for job in self._running):
+                return
+            _LOGGER.debug("%s aborts %s", self, ", ".join(str(job) for job in self._running))
+            abort()
+
+    def _set_running(self, jobs: list[_Job]) -> None:
+        with self._running_lock:
+            self._running = jobs
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            job = item[2]
+            if job is None:
+                break
+            # wait only for the rest of the turnaround, an idle bus can be used at once
+            wait = self._last_frame_end + self._turnaround - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            if job.request is not None:
+                self._turnaround = self.frame_gap
+                if self._abandoned:
+                    self._flush()
+            start = time.monotonic()
+            if job.request is None:
+                job.run()
+            elif getattr(self.driver, "pipeline_depth", 1) > 1:
+                self._run_pipelined(job)
+            else:
+                self._run_request(job)
+            self._last_frame_end = time.monotonic()
+            self.metrics.busy_time += self._last_frame_end - start
+        _LOGGER.debug("%s stopped", self)
+
+    def _run_pipelined(self, job: _Job) -> None:
+        """Send the waiting requests together, as many as the driver can have in flight."""
+        jobs = [job]
+        while len(jobs) < self.driver.pipeline_depth:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item[2] is None or item[2].request is None:
+                # keeps its place, the key of the queue item is unchanged
+                self._queue.put(item)
+                break
+            jobs.append(item[2])
+        jobs = [job for job in jobs if self._ready(job)]
+        if not jobs:
+            return
+        self._set_response_timeout(self._response_timeout_of(jobs))
+        start = time.monotonic()
+        self._set_running(jobs)
+        try:
+            results = self.driver.execute_many([job.request for job in jobs])
+        except Exception as err:  # pylint: disable=broad-except
+            results = [err] * len(jobs)
+        finally:
+            self._set_running([])
+        # the requests were in flight together, each of them waited for the whole batch
+        latency = time.monotonic() - start
+        for job, result in zip(jobs, results):
+            if isinstance(result, Exception):
+                self._record(job, latency, result)
+                job.done(None, result)
+            else:
+                self._record(job, latency, None)
+                job.done(result, None)
+
+    def _run_request(self, job: _Job) -> None:
+        if not self._ready(job):
+            return
+        slave, name, args = job.request
+        self._set_response_timeout(self._response_timeout_of([job]))
+        start = time.monotonic()
+        self._set_running([job])
+        try:
+            self.driver.set_slave(slave)
+            result = getattr(self.driver, name)(*args)
+        except Exception as err:  # pylint: disable=broad-except
+            self._set_running([])
+            self._record(job, time.monotonic() - start, err)
+            job.done(None, err)
+        else:
+            self._set_running([])
+            self._record(job, time.monotonic() - start, None)
+            job.done(result, None)
+
+    def _slave_health(self, slave: int) -> SlaveHealth:
+        health = self.health.get(slave)
+        if health is None:
+            health = self.health[slave] = SlaveHealth(slave)
+        return health
+
+    def _ready(self, job: _Job) -> bool:
+        """Check the deadline of a request job and the health of its slave before the start."""
+        if job.cancelled is not None and job.cancelled():
+            return False
+        if job.expired():
+            if job.tracked:
+                self.metrics.record_expired(job.request[0])
+            return False
+        if not self.connected:
+            job.done(None, ModbusConnectionError(f"{self} is not connected"))
+            return False
+        if job.tracked and not self._slave_health(job.request[0]).allow():
+            job.done(None, SlaveUnavailable(f"Slave {job.request[0]} is unavailable"))
+            return False
+        return True
+
+    def _record(self, job: _Job, latency: float, err: Exception | None) -> None:
+        if job.tracked:
+            self.metrics.record(job.request, latency, err)
+            # a broadcast has no response, so it tells nothing about the health of the slaves
+            if job.request[0] != MODBUS_BROADCAST_ADDRESS:
+                self._slave_health(job.request[0]).record(err)
+        if job.request[0] == MODBUS_BROADCAST_ADDRESS:
+            self._turnaround = max(self.frame_gap, self.broadcast_delay)
+        # a complete response (even an exception response) or no frame sent leaves the line clean
+        if isinstance(err, ModbusException) and not isinstance(
+                err, (ModbusExceptionResponse, ModbusConnectionError, SlaveUnavailable)):
+            self._abandoned = True
+
+    def _flush(self) -> None:
+        """Drop the rest of an abandoned transaction, if the driver can"""
+        self._abandoned = False
+        flush = getattr(self.driver, "flush", None)
+        if flush is not None:
+            try:
+                flush()
+            except Exception as err:  # pylint: disable=broad-except
+                _LOGGER.debug("%s flush failed: %s", self, err)
+
+    def _slave_response_timeout(self, slave: int) -> float:
+        return self.response_timeouts.get(slave, self._default_response_timeout)
+
+    def _response_timeout_of(self, jobs: list[_Job]) -> float:
+        """Response timeout of a transaction of the jobs: the longest one of their slaves, cut to
+        the time left until the last deadline of the jobs"""
+        timeout = max(self._slave_response_timeout(job.request[0]) for job in jobs)
+        deadlines = [job.deadline for job in jobs]
+        if None not in deadlines:
+            timeout = max(0.001, min(timeout, max(deadlines) - time.monotonic()))
+        return timeout
+
+    def _set_response_timeout(self, seconds: float) -> None:
+        # the driver is called only if the timeout changes, most of the slaves use the same one
+        if seconds != self._response_timeout:
+            self.driver.set_response_timeout(seconds)
+            self._response_timeout = seconds
+
+    def _put(self, priority: int, job: _Job) -> None:
+        self._queue.put((priority, next(self._sequence), job))
+
+    @staticmethod
+    def _deadline(timeout: float | None) -> float | None:
+        return None if timeout is None else time.monotonic() + timeout
+
+    async def async_call(self, func: Callable, *args: Any, priority: int = PRIORITY_WRITE,
+                         timeout: float | None = None) -> Any:
+        """Run a blocking function on the I/O thread and wait for its result."""
+        loop = self._hass.loop
+        future = loop.create_future()
+
+        def done(result: Any, err: Exception | None) -> None:
+            loop.call_soon_threadsafe(_set_future, future, result, err)
+
+        self._put(priority, _Job(func, args, self._deadline(timeout), done, cancelled=future.cancelled))
+        return await future
+
+    async def async_request(self, slave: int, name: str, *args: Any, priority: int = PRIORITY_WRITE,
+                            timeout: float | None = None, tracked: bool = True) -> Any:
+        """Send a modbus request, given by the name of the driver method, and wait for its result.
+        An untracked request is left out of the metrics and the slave health."""
+        loop = self._hass.loop
+        future = loop.create_future()
+
+        def done(result: Any, err: Exception | None) -> None:
+            loop.call_soon_threadsafe(_set_future, future, result, err)
+
+        self._put(priority, _Job(None, (), self._deadline(timeout), done, (slave, name, args), future.cancelled,
+                                 tracked))
+        future.add_done_callback(self._abort_cancelled)
+        return await future
+
+    async def async_cycle(self, requests: list[tuple[int, str, tuple]], priority: int,
+                          timeout: float | None = None, untracked: Collection[int] = ()) -> list[Any]:
+        """Send a batch of (slave, driver method name, args) modbus requests as separate jobs, so
+        jobs with higher priority can run between them. The results (or the raised exceptions)
+        are passed back in the order of the requests with one callback when the last one is done.
+        The requests to the untracked slaves are left out of the metrics and the slave health."""
+        if not requests:
+            return []
+        loop = self._hass.loop
+        future = loop.create_future()
+        results = [None] * len(requests)
+        remaining = [len(requests)]
+        deadline = self._deadline(timeout)
+
+        def make_done(index: int) -> Callable[[Any, Exception | None], None]:
+            def done(result: Any, err: Exception | None) -> None:
+                # the jobs of a cycle are done one by one on the I/O thread only
+                results[index] = err if err is not None else result
+                remaining[0] -= 1
+                if not remaining[0]:
+                    loop.call_soon_threadsafe(_set_future, future, results, None)
+            return done
+
+        for index, request in enumerate(requests):
+            self._put(priority, _Job(None, (), deadline, make_done(index), request, future.cancelled,
+                                     request[0] not in untracked))
+        future.add_done_callback(self._abort_cancelled)
+        return await future
+
+    def _abort_cancelled(self, future: asyncio.Future) -> None:
+        """Abort the running request of a cancelled caller, instead of waiting for its timeout"""
+        if future.cancelled():
+            self.abort(cancelled_only=True)
@@ -15,3 +15,88 @@ CONF_RTSDELAY: Final = "rtsdelay"
 CONF_SLAVE_ID: Final = "slave_id"
 CONF_COILS: Final = "coils"
 CONF_INPUTS: Final = "inputs"
+CONF_DISCRETE_INPUTS: Final = "discrete_inputs"
+CONF_HOLDINGS: Final = "holdings"
+CONF_WRITABLE: Final = "writable"
+CONF_MIN: Final = "min"
+CONF_MAX: Final = "max"
+CONF_STEP: Final = "step"
+CONF_AGGREGATE: Final = "aggregate"
+CONF_AGGREGATE_INTERVAL: Final = "aggregate_interval"
+CONF_SAMPLES: Final = "samples"
+CONF_WRITE_WINDOW: Final = "write_window"
+CONF_AUTOUPDATE: Final = "autoupdate"
+CONF_FRAME_GAP: Final = "frame_gap"
+CONF_BROADCAST: Final = "broadcast"
+CONF_BROADCAST_DELAY: Final = "broadcast_delay"
+CONF_READ_GAP: Final = "read_gap"
+CONF_DRIVER: Final = "driver"
+CONF_CONNECTIONS: Final = "connections"
+CONF_DATA_TYPE: Final = "data_type"
+CONF_WORD_ORDER: Final = "word_order"
+CONF_SCALE: Final = "scale"
+CONF_OFFSET: Final = "offset"
+CONF_DEADBAND: Final = "deadband"
+CONF_RELATIVE_DEADBAND: Final = "relative_deadband"
+CONF_RESPONSE_TIMEOUT: Final = "response_timeout"
+CONF_DISCOVERY: Final = "discovery"
+CONF_FIRST: Final = "first"
+CONF_LAST: Final = "last"
+CONF_PROBE_TIMEOUT: Final = "probe_timeout"
+
+# modbus drivers of a port: libmodbus with the rs485pi extension, the pure python serial RTU,
+# modbus TCP and RTU frames over TCP. The port of a TCP driver is given as host:port.
+DRIVER_RS485PI: Final = "rs485pi"
+DRIVER_SERIAL: Final = "serial"
+DRIVER_TCP: Final = "tcp"
+DRIVER_RTUOVERTCP: Final = "rtuovertcp"
+
+# transaction priority classes of the modbus bus, lower value goes first
+PRIORITY_WRITE: Final = 0
+PRIORITY_READBACK: Final = 1
+PRIORITY_POLL: Final = 2
+# the first poll of the blocks with a state restored from the snapshot
+PRIORITY_RESTORED: Final = 3
+# the probes of the bus discovery
+PRIORITY_SCAN: Final = 4
+
+# timeouts of the transactions in seconds, a transaction not started in time is dropped
+WRITE_TIMEOUT: Final = 5
+POLL_TIMEOUT: Final = 10
+
+# poll groups due within this time in seconds are read in the same poll cycle
+POLL_SLACK: Final = 0.2
+
+# default size of the sample buffer of a point with aggregation, e.g. 10 minutes polled every second
+SAMPLE_BUFFER: Final = 600
+
+# interval of the metrics sample in seconds, the diagnostic sensors are updated with it
+METRICS_INTERVAL: Final = 60
+
+SERVICE_DUMP_DIAGNOSTICS: Final = "dump_diagnostics"
+SERVICE_SCAN: Final = "scan"
+SERVICE_WRITE_COILS: Final = "write_coils"
+SERVICE_RELOAD: Final = "reload"
+# the add entities callbacks of the loaded platforms by platform, for the entities added by a reload
+DATA_ADD_ENTITIES: Final = f"{DOMAIN}_add_entities"
+# file of the diagnostics dump in the config directory
+DIAGNOSTICS_FILE: Final = "modbus_sw_diagnostics.json"
+
+# a slave is put into backoff after this count of consecutive transactions without a valid
+# response, and probed then with a backoff time doubling from the initial to the max time in seconds
+FAILURE_THRESHOLD: Final = 3
+BACKOFF_INITIAL: Final = 5
+BACKOFF_MAX: Final = 300
+
+# delay of the next connection attempt of a port in seconds
+CONNECT_RETRY: Final = 30
+
+# delay of the snapshot save after a state change in seconds, the changes within it are saved once
+SNAPSHOT_DELAY: Final = 10
+
+# response timeout of the probes of the unconfigured slaves in the bus discovery in ms
+PROBE_TIMEOUT: Final = 50
+
+# turnaround delay after a broadcast on a serial line in ms, the slaves process a broadcast
+# without a response, so the next frame waits for them
+BROADCAST_DELAY: Final = 100
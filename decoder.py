@@ -0,0 +1,164 @@
+"""Typed decoding of register blocks. The values of all points of a block are decoded with one
+struct call over the whole block, instead of converting the registers one by one."""
+from __future__ import annotations
+
+import struct
+import sys
+from array import array
+from dataclasses import dataclass
+from decimal import Decimal
+from typing import Any, Final
+
+
+@dataclass
+class _DataType:
+    """Attributes of a register data type"""
+    format: str
+    size: int
+    signed: bool
+
+
+# Data types of the register points, size is in registers
+DATA_TYPES: Final = {
+    "int16": _DataType(format="h", size=1, signed=True),
+    "uint16": _DataType(format="H", size=1, signed=False),
+    "int32": _DataType(format="i", size=2, signed=True),
+    "uint32": _DataType(format="I", size=2, signed=False),
+    "float32": _DataType(format="f", size=2, signed=True),
+}
+
+# word orders of the 32 bit data types: high word first or low word first
+WORD_ORDERS: Final = ("big", "little")
+
+# how a point is taken from the unpacked values of a block
+_PLAIN = 0
+_SWAPPED = 1
+_SEPARATE = 2
+# the two words of a 32 bit point
+_WORDS = struct.Struct(">HH")
+
+
+def _decimals(number: float) -> int:
+    """Count of decimals of a number as written in the config, e.g. 2 for 0.25"""
+    return max(0, -Decimal(str(number)).normalize().as_tuple().exponent)
+
+
+def precision(scale: float, offset: float = 0) -> int:
+    """Count of decimals of an integer register value after scaling with scale and offset, the
+    rounding to them drops the float noise only"""
+    return max(_decimals(scale), _decimals(offset))
+
+
+def _combine(data_type: _DataType, high: int, low: int) -> float:
+    """Value of a 32 bit data type from its words"""
+    if data_type.format == "f":
+        return struct.unpack(">f", struct.pack(">HH", high, low))[0]
+    value = (high << 16) | low
+    if data_type.signed and value & 0x80000000:
+        value -= 0x100000000
+    return value
+
+
+def value_range(data_type: _DataType, scale: float, offset: float) -> tuple[float, float]:
+    """Lowest and highest value of a point after scaling"""
+    if data_type.format == "f":
+        low, high = -3.4e38, 3.4e38
+    else:
+        bits = 16 * data_type.size
+        low, high = (-(1 << (bits - 1)), (1 << (bits - 1)) - 1) if data_type.signed else (0, (1 << bits) - 1)
+    return tuple(sorted((low * scale + offset, high * scale + offset)))
+
+
+def encode(point: Any, value: float) -> list[int]:
+    """Registers of a point value, the inverse of the decoding. Raises ValueError if the value
+    doesn't fit the data type of the point."""
+    data_type = DATA_TYPES[point.data_type]
+    raw = (value - point.offset) / point.scale
+    if data_type.format != "f":
+        raw = round(raw)
+    try:
+        words = list(struct.unpack(f">{data_type.size}H", struct.pack(f">{data_type.format}", raw)))
+    except struct.error as err:
+        raise ValueError(f"{value} is out of the range of {point.data_type}") from err
+    if data_type.size == 2 and point.word_order == "little":
+        words.reverse()
+    return words
+
+
+class BlockDecoder:
+    """Decoder of the register points in a read block. The points are given by their address,
+    each of them has data_type, word_order, scale and offset attributes."""
+
+    def __init__(self, start: int, count: int, points: dict[int, Any]):
+        self._fields = []
+        fmt = ">"
+        position = 0
+        for addr in sorted(points):
+            point = points[addr]
+            data_type = DATA_TYPES[point.data_type]
+            offset = (addr - start) * 2
+            swapped = data_type.size == 2 and point.word_order == "little"
+            if offset < position:
+                # overlapping points can't be in one format, this one is decoded on its own
+                self._fields.append((point, data_type, _SEPARATE, offset))
+                continue
+            if offset > position:
+                fmt += f"{offset - position}x"
+            fmt += "HH" if swapped else data_type.format
+            self._fields.append((point, data_type, _SWAPPED if swapped else _PLAIN, offset))
+            position = offset + data_type.size * 2
+        self._struct = struct.Struct(fmt)
+        # formats of the points on their own, to decode some of the points only
+        self._formats = [
+            struct.Struct(f">{data_type.format}") if kind == _PLAIN else None
+            for point, data_type, kind, _ in self._fields
+        ]
+        # the scaled integers are rounded to the decimals of the scale, floats are kept as they are
+        self._precisions = [
+            None if data_type.format == "f" else precision(point.scale, point.offset)
+            for point, data_type, _, _ in self._fields
+        ]
+        # the registers of a block are in the native byte order, the decoding needs them big endian
+        self._raw = array("H", bytes(count * 2))
+
+    def __len__(self):
+        return len(self._fields)
+
+    def decode(self, registers: array, indices: list[int] | None = None) -> list[tuple[Any, float]]:
+        """Decode the points from the registers of the block, returns (point, value) pairs. Only
+        the points with the given indices in address order are decoded, if given."""
+        raw = self._raw
+        raw[:] = registers
+        if sys.byteorder == "little":
+            raw.byteswap()
+        if indices is not None:
+            return [self._decode_field(raw, index) for index in indices]
+        unpacked = iter(self._struct.unpack_from(raw))
+        values = []
+        for (point, data_type, kind, offset), digits in zip(self._fields, self._precisions):
+            if kind == _PLAIN:
+                value = next(unpacked)
+            elif kind == _SWAPPED:
+                low = next(unpacked)
+                value = _combine(data_type, next(unpacked), low)
+            elif data_type.size == 2 and point.word_order == "little":
+                low, high = struct.unpack_from(">HH", raw, offset)
+                value = _combine(data_type, high, low)
+            else:
+                value = struct.unpack_from(f">{data_type.format}", raw, offset)[0]
+            value = value * point.scale + point.offset
+            values.append((point, value if digits is None else round(value, digits)))
+        return values
+
+    def _decode_field(self, raw: array, index: int) -> tuple[Any, float]:
+        point, data_type, kind, offset = self._fields[index]
+        if kind == _PLAIN:
+            value = self._formats[index].unpack_from(raw, offset)[0]
+        elif data_type.size == 2 and point.word_order == "little":
+            low, high = _WORDS.unpack_from(raw, offset)
+            value = _combine(data_type, high, low)
+        else:
+            value = struct.unpack_from(f">{data_type.format}", raw, offset)[0]
+        value = value * point.scale + point.offset
+        digits = self._precisions[index]
+        return point, value if digits is None else round(value, digits)
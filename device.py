@@ -1,18 +1,21 @@
 from __future__ import annotations
 
+from array import array
 from dataclasses import dataclass
+from datetime import timedelta
 import logging
 import asyncio
-from async_timeout import timeout
+import time
 from typing import Any
 
 from homeassistant.components import sensor
-from homeassistant.core import HomeAssistant
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.event import async_track_time_interval
 from homeassistant.helpers.typing import ConfigType, StateType
 from homeassistant.components.switch import SwitchEntity
 from homeassistant.components.sensor import SensorEntity
-from homeassistant.helpers.event import async_track_time_interval
-from datetime import timedelta
+from homeassistant.components.binary_sensor import BinarySensorEntity
+from homeassistant.components.number import NumberEntity
 
 from homeassistant.const import (
     CONF_NAME,
@@ -27,7 +30,22 @@ from homeassistant.const import (
 
 from .const import *
 
-from .modbus_rs485pi import ModbusRtu
+from .bus import ModbusBus, rtu_frame_gap
+from .decoder import DATA_TYPES, encode, precision, value_range
+from .exceptions import ILLEGAL_FUNCTION, ModbusExceptionResponse, SlaveUnavailable
+from .modbus_pdu import MODBUS_BROADCAST_ADDRESS
+from .metrics import (
+    PORT_METRICS,
+    RTU_FRAMING,
+    SLAVE_METRICS,
+    TCP_FRAMING,
+    BusMetrics,
+    MetricEntity,
+    UtilizationEntity,
+)
+from .readplan import TABLES, ReadBlock, plan_cost, plan_device
+from .samples import SampleBuffer
+from .scanner import BusScanner
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -38,6 +56,8 @@ class _SensorAttributes:
     unit: str
     device_class: str
     state_class: str
+    data_type: str
+    scale: float
 
 # Sensor attributes by the sensor mode
 SENSOR_ATTRS: Final = {
@@ -45,12 +65,23 @@ SENSOR_ATTRS: Final = {
     "temperature": _SensorAttributes(
         unit=TEMP_CELSIUS,
         device_class=sensor.DEVICE_CLASS_TEMPERATURE,
-        state_class=sensor.STATE_CLASS_MEASUREMENT),
+        state_class=sensor.STATE_CLASS_MEASUREMENT,
+        data_type="int16",
+        scale=0.1),
     # voltage sensor (eg. vda, vin)
     "voltage": _SensorAttributes(
         unit=ELECTRIC_POTENTIAL_VOLT,
         device_class=sensor.DEVICE_CLASS_VOLTAGE,
-        state_class=sensor.STATE_CLASS_MEASUREMENT),
+        state_class=sensor.STATE_CLASS_MEASUREMENT,
+        data_type="uint16",
+        scale=0.1),
+    # any other value, without unit (eg. a setpoint or a counter)
+    "generic": _SensorAttributes(
+        unit=None,
+        device_class=None,
+        state_class=sensor.STATE_CLASS_MEASUREMENT,
+        data_type="uint16",
+        scale=1),
 }
 
 
@@ -58,9 +89,17 @@ class ModbusPort:
     """Represents a hardware based modbus RS485 port. Contains the configured devices.
     This object performs all modbus related calls for the devices under the port."""
 
-    def __init__(self, hass: HomeAssistant, config: ConfigType):
+    def __init__(self, hass: HomeAssistant, config: ConfigType, driver: Any = None, snapshot: Any = None,
+                 topology: Any = None):
         self._hass = hass
+        self.config = config
         self.name = config.get(CONF_NAME)
+        # default poll interval of the devices in seconds
+        self.autoupdate = config.get(CONF_AUTOUPDATE)
+        # unused addresses allowed between the points of a read, None for the table default
+        self.read_gap = config.get(CONF_READ_GAP)
+        # default response timeout of the slaves in ms, None for the default of the driver
+        self.response_timeout = config.get(CONF_RESPONSE_TIMEOUT)
 
         # configure devices
         self.devices = []
@@ -68,113 +107,646 @@ class ModbusPort:
             for device_config in config.get(CONF_DEVICES):
                 self.devices.append(ModbusDevice(self, device_config))
 
-        # lock for modbus port calls, because these can't be concurrent
-        self._lock = asyncio.Lock()
-        self._auto_update_remover = None
-        self._delay = 30 / 1000
-
-        self._driver = ModbusRtu(
-            config.get(CONF_PORT),
-            config.get(CONF_BAUDRATE),
-            config.get(CONF_PARITY),
-            config.get(CONF_BYTESIZE),
-            config.get(CONF_STOPBITS),
-            config.get(CONF_RTSMODE),
-            config.get(CONF_RTSPIN),
-            config.get(CONF_RTSDELAY)
-        )
-        self._driver.connect()
+        # the points of a device are read in as few transactions as possible, see readplan
+        self._read_blocks = []
+        self._update_plan()
+        self._poll_handle = None
+        self._stopped = False
+
+        # coil writes arriving within the write window are sent together, merged by slave
+        self._write_window = config.get(CONF_WRITE_WINDOW) / 1000
+        self._pending_writes = {}
+        # the group writes may be broadcast without a scanned topology, see _broadcast_allowed
+        self._broadcast = config.get(CONF_BROADCAST)
+        self._flush_writes_handle = None
+
+        # a driver can be given for testing, e.g. a simulated one. Otherwise the driver is created
+        # by the connect on the I/O thread, it may load a native library.
+        self.driver_name = config.get(CONF_DRIVER)
+        self._create_driver = (lambda: driver) if driver is not None else (lambda: _create_driver(config))
+        self._start_task = None
+
+        # the silent interval between frames is computed from the line settings, if not configured
+        if config.get(CONF_FRAME_GAP) is not None:
+            frame_gap = config.get(CONF_FRAME_GAP) / 1000
+        elif self.driver_name in (DRIVER_TCP, DRIVER_RTUOVERTCP):
+            frame_gap = 0
+        else:
+            frame_gap = rtu_frame_gap(config.get(CONF_BAUDRATE), config.get(CONF_BYTESIZE),
+                                      config.get(CONF_PARITY), config.get(CONF_STOPBITS))
+
+        # transaction metrics of the port, shown by diagnostic sensors of the port and its slaves
+        self.metrics = BusMetrics(TCP_FRAMING if self.driver_name == DRIVER_TCP else RTU_FRAMING)
+        self.metric_entities = [UtilizationEntity(self)]
+        self.metric_entities.extend(MetricEntity(self, key) for key in PORT_METRICS)
+        for device in self.devices:
+            self.metrics.slave(device.slave_id)
+            self.metric_entities.extend(MetricEntity(self, key, device.slave_id) for key in SLAVE_METRICS)
+        self._remove_metrics_listener = None
+
+        # all modbus calls of the port run on its own I/O thread, because these can't be concurrent
+        self._bus = ModbusBus(hass, self.name, None, frame_gap, self.metrics, _broadcast_delay(config))
+        self._update_response_timeouts()
+        self._bus.start()
+
+        # the slaves found by the bus discovery, cached in the topology
+        self._discovery = config.get(CONF_DISCOVERY)
+        self._topology = topology
+        self.topology = topology.slaves(self.name) if topology is not None else None
+
+        # the last known state is restored before the first poll and saved on change
+        self._snapshot = snapshot
+        if snapshot is not None:
+            snapshot.ports.append(self)
+            self.restore(snapshot.data.get(self.name))
 
     def __str__(self):
         return f"<ModbusPort {self.name}>"
 
-    def _read_coil(self, coil: CoilEntity) -> bool:
-        """Read state of coil with modbus call"""
-        self._driver.set_slave(coil.device.slave_id)
-        return bool(self._driver.read_bits(coil.id, 1)[0])
-
-    def _write_coil(self, coil: CoilEntity, value: bool) -> None:
-        """Write state of coil with modbus call"""
-        self._driver.set_slave(coil.device.slave_id)
-        self._driver.write_bit(coil.id, 1 if value else 0)
+    @property
+    def entities(self) -> list:
+        """The point entities of the devices and the diagnostic entities of the port"""
+        return [entity for device in self.devices for entity in device.entities] + self.metric_entities
+
+    def _update_plan(self) -> None:
+        """Collect the read blocks of the devices, the blocks of a device are built with it"""
+        self._read_blocks = [block for device in self.devices for block in device.blocks]
+        self.plan_frames, self.plan_bytes = plan_cost(self._read_blocks)
+        _LOGGER.info(f"{self} read plan: {self.plan_frames} frames, {self.plan_bytes} bytes on the bus")
+
+    def _update_response_timeouts(self) -> None:
+        self._bus.response_timeouts.clear()
+        for device in self.devices:
+            if device.response_timeout is not None:
+                self._bus.response_timeouts[device.slave_id] = device.response_timeout / 1000
+
+    def same_connection(self, config: ConfigType) -> bool:
+        """Whether the port can be reconfigured with the config without a new connection"""
+        return all(config.get(key) == self.config.get(key) for key in CONNECTION_KEYS)
+
+    def reconfigure(self, config: ConfigType) -> tuple[list, list]:
+        """Apply a changed config with the same connection settings, see same_connection. Only the
+        changed devices are replaced and planned again, the entities of their unchanged points are
+        kept. The bus stays connected and the poll goes on. Returns the added and the removed
+        entities, these are added to and removed from ha by the caller."""
+        defaults = (CONF_AUTOUPDATE, CONF_READ_GAP, CONF_RESPONSE_TIMEOUT)
+        defaults_changed = any(config.get(key) != self.config.get(key) for key in defaults)
+        self.config = config
+        self.autoupdate = config.get(CONF_AUTOUPDATE)
+        self.read_gap = config.get(CONF_READ_GAP)
+        self.response_timeout = config.get(CONF_RESPONSE_TIMEOUT)
+        self._write_window = config.get(CONF_WRITE_WINDOW) / 1000
+        self._broadcast = config.get(CONF_BROADCAST)
+        self._bus.broadcast_delay = _broadcast_delay(config)
+        self._discovery = config.get(CONF_DISCOVERY)
+
+        added = []
+        removed = []
+        replanned = []
+        previous = {device.slave_id: device for device in self.devices}
+        self.devices = []
+        for device_config in config.get(CONF_DEVICES) or []:
+            old = previous.pop(device_config[CONF_SLAVE_ID], None)
+            if old is not None and old.config == device_config and not defaults_changed:
+                self.devices.append(old)
+                continue
+            device = ModbusDevice(self, device_config)
+            if old is None:
+                added.extend(device.entities)
+                self.metrics.slave(device.slave_id)
+                metric_entities = [MetricEntity(self, key, device.slave_id) for key in SLAVE_METRICS]
+                self.metric_entities.extend(metric_entities)
+                added.extend(metric_entities)
+            else:
+                device_added, device_removed = device.adopt(old)
+                added.extend(device_added)
+                removed.extend(device_removed)
+            self.devices.append(device)
+            if old is None or device.blocks is not old.blocks:
+                replanned.append(device)
+        for old in previous.values():
+            removed.extend(old.entities)
+            metric_entities = [entity for entity in self.metric_entities if entity.slave_id == old.slave_id]
+            self.metric_entities = [entity for entity in self.metric_entities if entity.slave_id != old.slave_id]
+            removed.extend(metric_entities)
+
+        self._update_plan()
+        self._update_response_timeouts()
+        # the new blocks are read soon, the schedule of the other blocks is kept
+        now = self._hass.loop.time()
+        for device in replanned:
+            for block in device.blocks:
+                block.next_due = now
+        if self._poll_handle is not None:
+            self._poll_handle.cancel()
+            self._schedule_poll()
+        _LOGGER.info(f"{self} reconfigured: {len(replanned)} devices planned again, "
+                     f"{len(added)} entities added, {len(removed)} removed")
+        return added, removed
 
     async def async_read_coil(self, coil: CoilEntity) -> bool:
         """Read state of coil entity"""
-        async with self._lock:
-            return await self.hass.async_add_executor_job(
-                self._read_coil, coil
-            )
+        result = await self._bus.async_request(coil.device.slave_id, "read_bits", coil.id, 1,
+                                               priority=PRIORITY_READBACK, timeout=WRITE_TIMEOUT)
+        return bool(result[0])
 
     async def async_write_coil(self, coil: CoilEntity, value: bool) -> None:
-        """Write state of coil entity"""
-        async with self._lock:
-            await self._hass.async_add_executor_job(
-                self._write_coil, coil, value
-            )
-
-    def _update_device_coils(self, device: ModbusDevice) -> None:
-        """Update device coil state with modbus call."""
-        if len(device.coils) > 0:
-            start = min(device.coils.keys())
-            count = max(device.coils.keys()) + 1 - start
-            _LOGGER.info(f"update coils of {device} from:{start} count:{count}")
-            self._driver.set_slave(device.slave_id)
-            result = self._driver.read_bits(start, count)
-            for i, val in enumerate(result):
-                if (start + i) in device.coils:
-                    _LOGGER.info(f"{i}:{val}")
-                    device.coils[start + i].set_is_on(bool(val))
-
-    def _update_device_inputs(self, device: ModbusDevice) -> None:
-        """Update device input state with modbus call."""
-        if len(device.inputs) > 0:
-            start = min(device.inputs.keys())
-            count = max(device.inputs.keys()) + 1 - start
-            _LOGGER.info(f"update inputs of {device} from:{start} count:{count}")
-            self._driver.set_slave(device.slave_id)
-            result = self._driver.read_input_registers(start, count)
-            _LOGGER.info(f"read_input_registers:{result}")
-            for i, val in enumerate(result):
-                if (start + i) in device.inputs:
-                    _LOGGER.info(f"{i}:{val}")
-                    device.inputs[start + i].set_value(bool(val))
-
-    async def _async_update_state(self, event_time: timedelta = None) -> None:
-        """Update all device state"""
-        async with self._lock:
-            async with timeout(10):
-                for device in self.devices:
-                    if len(device.coils):
-                        await self._hass.async_add_executor_job(self._update_device_coils, device)
-                    if len(device.inputs):
-                        await self._hass.async_add_executor_job(self._update_device_inputs, device)
-                    if self._delay:
-                        await asyncio.sleep(30 / 1000)
-
-    async def async_enable_auto_update(self, interval: timedelta, call_update: bool = False):
-        """Enable auto update function for all devices in port."""
-        self._auto_update_remover = async_track_time_interval(
-            self._hass, self._async_update_state, interval)
+        """Write state of coil entity. The write is delayed by the write window of the port and sent
+        together with the other writes of the same slave. Returns when the frame is acknowledged."""
+        future = self._hass.loop.create_future()
+        writes = self._pending_writes.setdefault(coil.device.slave_id, {})
+        # a newer write of the same coil overrides the older one, both callers wait for the same frame
+        futures = writes[coil.id][1] if coil.id in writes else []
+        futures.append(future)
+        writes[coil.id] = (1 if value else 0, futures)
+        if self._flush_writes_handle is None:
+            self._flush_writes_handle = self._hass.loop.call_later(self._write_window, self._flush_writes)
+        await future
+
+    async def async_write_coils(self, coils: list[CoilEntity], value: bool) -> None:
+        """Write the same state to a group of coils of the port, e.g. for a scene. The group is
+        sent as broadcast frames if it is safe, see _broadcast_allowed, otherwise with one frame
+        per contiguous coil range of each slave. The states are set without waiting for a read,
+        the next poll of the coils confirms or corrects them."""
+        targets = {}
+        for coil in coils:
+            targets.setdefault(coil.device.slave_id, {})[coil.id] = 1 if value else 0
+        if self._broadcast_allowed(targets):
+            writes = {MODBUS_BROADCAST_ADDRESS: next(iter(targets.values()))}
+        else:
+            writes = targets
+        requests = []
+        for slave_id, slave_writes in writes.items():
+            for start, values in _contiguous_ranges(slave_writes):
+                name, *args = _write_request(start, values)
+                requests.append((slave_id, name, tuple(args)))
+        results = await self._bus.async_cycle(requests, PRIORITY_WRITE, WRITE_TIMEOUT)
+        failed = {request[0]: result for request, result in zip(requests, results)
+                  if isinstance(result, Exception)}
+        if MODBUS_BROADCAST_ADDRESS in writes:
+            _LOGGER.debug(f"{self} {len(coils)} coils of {len(targets)} slaves written "
+                          f"with {len(requests)} broadcast frames")
+            # a broadcast is not acknowledged, only the sending can fail
+            failed = {slave_id: failed[MODBUS_BROADCAST_ADDRESS] for slave_id in targets} if failed else {}
+
+        for coil in coils:
+            if coil.device.slave_id not in failed and coil.set_is_on(value) and coil.hass:
+                coil.async_write_ha_state()
+        for block in self._read_blocks:
+            if block.table == CONF_COILS and block.device.slave_id in targets:
+                block.invalidate()
+        if failed:
+            self._update_availability({device for device in self.devices if device.slave_id in failed})
+            raise next(iter(failed.values()))
+
+    def _broadcast_allowed(self, targets: dict[int, dict[int, int]]) -> bool:
+        """A broadcast reaches every slave of the bus, also the ones left out of the config. So it is
+        used only if the same coils are written on all the configured slaves with coils, and no
+        other slave found by the discovery has these coils. Without a scanned topology the other
+        slaves are unknown, only a port with the broadcast option broadcasts then."""
+        if len(targets) < 2:
+            return False
+        addresses = set(next(iter(targets.values())))
+        if any(set(writes) != addresses for writes in targets.values()):
+            return False
+        if {device.slave_id for device in self.devices if device.coils} != set(targets):
+            return False
+        if self.topology is None:
+            return self._broadcast
+        for slave_id, slave in self.topology.items():
+            if slave_id not in targets and slave.get("present") and slave.get(CONF_COILS, 0) > min(addresses):
+                return False
+        return True
+
+    async def async_write_holding(self, holding: HoldingEntity, value: float) -> None:
+        """Write the value of a holding register entity. The register block of the entity is read
+        back in the same transaction (FC23), so the state is set from the confirmed registers. A
+        slave without FC23 is written with FC16 and its block is read back after."""
+        device = holding.device
+        block = next(block for block in self._read_blocks
+                     if block.device is device and block.table == CONF_HOLDINGS and holding in block.entities)
+        registers = encode(holding, value)
+        if device.write_and_read:
+            try:
+                result = await self._bus.async_request(
+                    device.slave_id, "write_and_read_registers", holding.id, registers, block.start, block.count,
+                    priority=PRIORITY_WRITE, timeout=WRITE_TIMEOUT)
+            except ModbusExceptionResponse as err:
+                if err.code != ILLEGAL_FUNCTION:
+                    raise
+                _LOGGER.info(f"{device} doesn't support write and read, holding registers are written with FC16")
+                device.write_and_read = False
+            else:
+                block.buffer[:] = array("H", result)
+                self._apply_poll_results([block], [None])
+                return
+        await self._bus.async_request(device.slave_id, "write_registers", holding.id, registers,
+                                      priority=PRIORITY_WRITE, timeout=WRITE_TIMEOUT)
+        block.invalidate()
+        await self._async_poll([block], PRIORITY_READBACK)
+
+    @callback
+    def _flush_writes(self) -> None:
+        """Send the pending coil writes, one frame per contiguous coil range of a slave."""
+        self._flush_writes_handle = None
+        pending, self._pending_writes = self._pending_writes, {}
+        for slave_id, writes in pending.items():
+            for start, items in _contiguous_ranges(writes):
+                values = [value for value, _ in items]
+                futures = [future for _, item_futures in items for future in item_futures]
+                self._hass.async_create_task(self._async_write_frame(slave_id, start, values, futures))
+
+    async def _async_write_frame(self, slave_id: int, start: int, values: list[int],
+                                 futures: list[asyncio.Future]) -> None:
+        """Write a coil range with one modbus call and resolve the futures of its callers."""
+        request = _write_request(start, values)
+        try:
+            await self._bus.async_request(slave_id, *request, priority=PRIORITY_WRITE, timeout=WRITE_TIMEOUT)
+        except Exception as err:  # pylint: disable=broad-except
+            self._update_availability({device for device in self.devices if device.slave_id == slave_id})
+            for future in futures:
+                if not future.done():
+                    future.set_exception(err)
+        else:
+            # the next read of the coils is applied, even if the read values are the same as before
+            for block in self._read_blocks:
+                if block.device.slave_id == slave_id and block.table == CONF_COILS:
+                    block.invalidate()
+            for future in futures:
+                if not future.done():
+                    future.set_result(None)
+
+    def _apply_poll_results(self, blocks: list[ReadBlock], results: list) -> None:
+        """Set the entity states from the result of a poll cycle, the read values are in the
+        buffers of the blocks. Only the points changed since the last read are set, and the ha
+        state of the changed entities is written at once at the end."""
+        changed = []
+        save = False
+        for block, result in zip(blocks, results):
+            if isinstance(result, SlaveUnavailable):
+                continue
+            if isinstance(result, Exception):
+                _LOGGER.warning("Update of %s failed: %s", block, result)
+                continue
+            block.device.known = True
+            block.valid = True
+            if block.sampled:
+                self._sample(block, changed)
+            # a restored state is confirmed by the first read, even if it is the same
+            confirmed = block.restored
+            block.restored = False
+            changes = block.changes(confirmed)
+            if not changes:
+                continue
+            save = True
+            for point, value in changes:
+                if point.samples is not None:
+                    continue
+                if TABLES[block.table].bits:
+                    updated = point.set_is_on(value)
+                else:
+                    updated = point.set_value(value, confirmed)
+                if updated or confirmed:
+                    point.restored = False
+                    changed.append(point)
+        # update ha state if the entity is initialized
+        for entity in changed:
+            if entity.hass:
+                entity.async_write_ha_state()
+        if changed:
+            _LOGGER.debug("%s state of %d entities updated", self, len(changed))
+        if save and self._snapshot is not None:
+            self._snapshot.schedule_save()
+        self._update_availability({block.device for block in blocks})
+
+    @staticmethod
+    def _sample(block: ReadBlock, changed: list) -> None:
+        """Add the read values of the sampled points to their sample buffers. The aggregate of
+        the samples is set as the state once per aggregation interval of a point."""
+        now = time.time()
+        for point, value in block.sampled_values():
+            point.samples.add(now, value)
+            if now < point.next_publish:
+                continue
+            point.next_publish = now + point.aggregate_interval
+            value = point.samples.aggregate(point.aggregate, now - point.aggregate_interval)
+            if point.data_type != "float32":
+                value = round(value, precision(point.scale, point.offset))
+            if point.set_value(value, point.restored) or point.restored:
+                point.restored = False
+                changed.append(point)
+
+    def _update_availability(self, devices: set[ModbusDevice]) -> None:
+        """Follow the health of the slaves by the bus, the entities of a slave in backoff are unavailable."""
+        for device in devices:
+            health = self._bus.health.get(device.slave_id)
+            available = device.known and (health is None or health.available)
+            if available != device.available:
+                device.set_available(available)
+
+    async def _async_poll(self, blocks: list[ReadBlock], priority: int = PRIORITY_POLL) -> None:
+        """Read the blocks in one cycle. The reads are queued with poll priority, so writes
+        arriving during the cycle are sent on the next free bus slot."""
+        blocks = [block for block in blocks if not block.polling]
+        if not blocks:
+            return
+        for block in blocks:
+            block.polling = True
+        try:
+            requests = [block.request for block in blocks]
+            results = await self._bus.async_cycle(requests, priority, POLL_TIMEOUT)
+        finally:
+            for block in blocks:
+                block.polling = False
+        self._apply_poll_results(blocks, results)
+
+    async def _async_update_state(self) -> None:
+        """Update all device state. The blocks with a restored state are read after the others."""
+        restored = [block for block in self._read_blocks if block.restored]
+        if not restored:
+            await self._async_poll(self._read_blocks)
+            return
+        unknown = [block for block in self._read_blocks if not block.restored]
+        await asyncio.gather(self._async_poll(unknown), self._async_poll(restored, PRIORITY_RESTORED))
+
+    def restore(self, data: dict[str, str] | None) -> None:
+        """Set the entity states from the snapshot of the port. The restored entities are marked
+        as restored until the first poll confirms their state."""
+        if not data:
+            return
+        devices = set()
+        for block in self._read_blocks:
+            if block.key not in data or not block.restore(data[block.key]):
+                continue
+            devices.add(block.device)
+            for point, value in block.values():
+                if TABLES[block.table].bits:
+                    point.set_is_on(value)
+                else:
+                    point.set_value(value, True)
+                point.restored = True
+        for device in devices:
+            device.known = True
+        self._update_availability(devices)
+        _LOGGER.info(f"{self} state of {len(devices)} devices restored")
+
+    def snapshot(self) -> dict[str, str]:
+        """Snapshot of the read blocks with a known state"""
+        return {block.key: block.snapshot() for block in self._read_blocks if block.valid}
+
+    @callback
+    def _schedule_poll(self) -> None:
+        """Start the timer of the next due read block."""
+        if self._read_blocks and not self._stopped:
+            delay = min(block.next_due for block in self._read_blocks) - self._hass.loop.time()
+            self._poll_handle = self._hass.loop.call_later(max(delay, 0), self._poll_due)
+
+    @callback
+    def _poll_due(self) -> None:
+        """Poll the blocks which are due, blocks due within POLL_SLACK are read in the same cycle."""
+        self._poll_handle = None
+        now = self._hass.loop.time()
+        due = []
+        for block in self._read_blocks:
+            if block.next_due <= now + POLL_SLACK:
+                due.append(block)
+                block.next_due += block.interval
+                if block.next_due <= now:
+                    block.next_due = now + block.interval
+        self._hass.async_create_task(self._async_poll(due))
+        self._schedule_poll()
+
+    @callback
+    def async_start(self) -> None:
+        """Connect the port and start the auto update in the background, so the setup doesn't wait
+        for the bus. The entities are unavailable until the first poll of their device."""
+        self._start_task = self._hass.async_create_task(self._async_start())
 
         # remove auto updater callback
         async def async_stop_listen_task(event):
             _LOGGER.info(f"Remove {self} autoupdater")
-            self._auto_update_remover()
+            self.stop()
 
         # and register it
         self._hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, async_stop_listen_task)
 
+    async def _async_start(self) -> None:
+        await self.async_connect()
+        await self.async_enable_auto_update(True)
+        # the discovery runs after the first poll, with lower priority than the polls
+        if self._discovery:
+            if self.topology is None:
+                await self.async_scan()
+            else:
+                await self.async_verify_topology()
+        self._start_task = None
+
+    async def async_scan(self, first: int = 1, last: int = 247, probe_timeout: int = PROBE_TIMEOUT) -> None:
+        """Sweep a range of the slave ids of the bus, measure the tables of the found slaves and cache
+        the topology. The slaves of the range replace the cached ones of the range only. The probe
+        timeout is in ms."""
+        scanner = BusScanner(self._bus, {device.slave_id for device in self.devices}, probe_timeout / 1000)
+        found = await scanner.async_scan(list(range(first, last + 1)))
+        topology = {slave_id: slave for slave_id, slave in (self.topology or {}).items()
+                    if not first <= slave_id <= last}
+        topology.update(found)
+        self.topology = dict(sorted(topology.items()))
+        for slave_id, slave in found.items():
+            tables = ", ".join(f"{slave[table]} {table}" for table in TABLES)
+            _LOGGER.info(f"{self} slave {slave_id}: {tables}")
+        if self._topology is not None:
+            await self._topology.async_save(self.name, self.topology)
+
+    async def async_verify_topology(self) -> None:
+        """Probe the slaves of the cached topology, instead of a full scan"""
+        scanner = BusScanner(self._bus, {device.slave_id for device in self.devices}, PROBE_TIMEOUT / 1000)
+        self.topology = await scanner.async_verify(self.topology)
+        if self._topology is not None:
+            await self._topology.async_save(self.name, self.topology)
+
+    async def async_connect(self) -> None:
+        """Connect the driver on the I/O thread of the port, retried until it succeeds"""
+        while True:
+            try:
+                await self._bus.async_call(self._bus.connect, self._create_driver)
+            except Exception as err:  # pylint: disable=broad-except
+                _LOGGER.error(f"{self} connection failed, retry in {CONNECT_RETRY} s: {err}")
+                await asyncio.sleep(CONNECT_RETRY)
+            else:
+                _LOGGER.info(f"{self} connected")
+                return
+
+    async def async_enable_auto_update(self, call_update: bool = False):
+        """Enable auto update function for all devices in port. The blocks with the same interval
+        are spread evenly across the interval, instead of reading all of them at once."""
+        now = self._hass.loop.time()
+        by_interval = {}
+        for block in self._read_blocks:
+            by_interval.setdefault(block.interval, []).append(block)
+        for interval, blocks in by_interval.items():
+            for i, block in enumerate(blocks):
+                block.next_due = now + interval * (i + 1) / len(blocks)
+        self._schedule_poll()
+        self._remove_metrics_listener = async_track_time_interval(
+            self._hass, self._sample_metrics, timedelta(seconds=METRICS_INTERVAL))
+
         # call update after registration if needed
         if call_update:
             await self._async_update_state()
 
 
+    @callback
+    def _sample_metrics(self, now=None) -> None:
+        """Sample the metrics of the port and update the diagnostic sensors"""
+        self.metrics.sample()
+        for entity in self.metric_entities:
+            if entity.hass:
+                entity.async_write_ha_state()
+
+    def diagnostics(self) -> dict[str, Any]:
+        """Diagnostics dump of the port: settings, read plan, metrics, topology and samples"""
+        return {
+            "name": self.name,
+            "driver": self.driver_name,
+            "frame_gap": self._bus.frame_gap,
+            "broadcast_delay": self._bus.broadcast_delay,
+            "write_window": self._write_window,
+            "read_plan": {
+                "frames": self.plan_frames,
+                "bytes": self.plan_bytes,
+                "blocks": [str(block) for block in self._read_blocks],
+            },
+            "metrics": self.metrics.as_dict(),
+            "topology": self.topology,
+            "samples": {
+                point.entity_id or point.unique_id: point.samples.as_list()
+                for block in self._read_blocks for point in block.entities if point.samples is not None
+            },
+        }
+
+    async def async_close(self) -> None:
+        """Stop the port and close its connection, e.g. before a port of the same name replaces it"""
+        # the disconnect doesn't wait for the timeout of a running request
+        self._bus.abort()
+        await self._bus.async_call(self._bus.disconnect)
+        self.stop()
+
+    @callback
+    def stop(self) -> None:
+        """Stop the auto update and the I/O thread of the port"""
+        if self._start_task is not None:
+            self._start_task.cancel()
+            self._start_task = None
+        if self._poll_handle is not None:
+            self._poll_handle.cancel()
+            self._poll_handle = None
+        if self._remove_metrics_listener is not None:
+            self._remove_metrics_listener()
+            self._remove_metrics_listener = None
+        # the read blocks are kept for the snapshot written at shutdown
+        self._stopped = True
+        self._bus.stop()
+
+
+# settings of a port which need a new connection when changed
+CONNECTION_KEYS: Final = (
+    CONF_PORT,
+    CONF_DRIVER,
+    CONF_CONNECTIONS,
+    CONF_BAUDRATE,
+    CONF_STOPBITS,
+    CONF_BYTESIZE,
+    CONF_PARITY,
+    CONF_RTSMODE,
+    CONF_RTSPIN,
+    CONF_RTSDELAY,
+    CONF_FRAME_GAP,
+)
+
+
+def _broadcast_delay(config: ConfigType) -> float:
+    """Turnaround delay after a broadcast in seconds. The slaves behind a TCP gateway are answered
+    by the gateway, so there is no delay by default."""
+    if config.get(CONF_BROADCAST_DELAY) is not None:
+        return config.get(CONF_BROADCAST_DELAY) / 1000
+    if config.get(CONF_DRIVER) in (DRIVER_TCP, DRIVER_RTUOVERTCP):
+        return 0
+    return BROADCAST_DELAY / 1000
+
+
+def _create_driver(config: ConfigType):
+    """Create the modbus driver of the port. The drivers are imported on demand, so the native
+    libraries are only loaded if a port uses them."""
+    if config.get(CONF_DRIVER) in (DRIVER_TCP, DRIVER_RTUOVERTCP):
+        from .modbus_tcp import MODBUS_TCP_PORT, ModbusTcp
+        host, _, port = config.get(CONF_PORT).rpartition(":")
+        if not host:
+            host, port = port, MODBUS_TCP_PORT
+        return ModbusTcp(
+            host,
+            int(port),
+            config.get(CONF_CONNECTIONS),
+            config.get(CONF_DRIVER) == DRIVER_RTUOVERTCP
+        )
+
+    if config.get(CONF_DRIVER) == DRIVER_SERIAL:
+        from .modbus_serial import ModbusSerialRtu
+        return ModbusSerialRtu(
+            config.get(CONF_PORT),
+            config.get(CONF_BAUDRATE),
+            config.get(CONF_PARITY),
+            config.get(CONF_BYTESIZE),
+            config.get(CONF_STOPBITS)
+        )
+
+    from .modbus_rs485pi import ModbusRtu
+    return ModbusRtu(
+        config.get(CONF_PORT),
+        config.get(CONF_BAUDRATE),
+        config.get(CONF_PARITY),
+        config.get(CONF_BYTESIZE),
+        config.get(CONF_STOPBITS),
+        config.get(CONF_RTSMODE),
+        config.get(CONF_RTSPIN),
+        config.get(CONF_RTSDELAY)
+    )
+
+
+def _write_request(start: int, values: list[int]) -> tuple:
+    """The modbus request writing a coil range, without the slave"""
+    if len(values) == 1:
+        return "write_bit", start, values[0]
+    return "write_bits", start, len(values), values
+
+
+def _contiguous_ranges(items: dict[int, Any]) -> list[tuple[int, list[Any]]]:
+    """Split the items keyed by address into runs of contiguous addresses."""
+    ranges = []
+    for addr in sorted(items):
+        if ranges and ranges[-1][0] + len(ranges[-1][1]) == addr:
+            ranges[-1][1].append(items[addr])
+        else:
+            ranges.append((addr, [items[addr]]))
+    return ranges
+
+
 class ModbusDevice:
-    """Represents a device in a modbus port with slave id. The device can contains coils and sensors."""
+    """Represents a device in a modbus port with slave id. The device can contain coils, discrete
+    inputs, input registers and holding registers."""
 
     def __init__(self, port: ModbusPort, config: ConfigType):
         self.port = port
+        self.config = config
         self.slave_id = config.get(CONF_SLAVE_ID)
+        self.autoupdate = config.get(CONF_AUTOUPDATE, port.autoupdate)
+        self.read_gap = config.get(CONF_READ_GAP, port.read_gap)
+        self.response_timeout = config.get(CONF_RESPONSE_TIMEOUT, port.response_timeout)
+        # False until the state is known, from a poll or from the snapshot, and while the slave
+        # is in backoff, see SlaveHealth
+        self.known = False
+        self.available = False
+        # holding registers are written with write and read (FC23), until the slave rejects it
+        self.write_and_read = True
 
         # configure coils
         self.coils = {}
@@ -183,6 +755,13 @@ class ModbusDevice:
                 entity = CoilEntity(self, coil_config)
                 self.coils[entity.id] = entity
 
+        # configure binary sensors
+        self.discrete_inputs = {}
+        if CONF_DISCRETE_INPUTS in config.keys():
+            for discrete_config in config.get(CONF_DISCRETE_INPUTS):
+                entity = DiscreteInputEntity(self, discrete_config)
+                self.discrete_inputs[entity.id] = entity
+
         # configure sensors
         self.inputs = {}
         if CONF_INPUTS in config.keys():
@@ -190,21 +769,144 @@ class ModbusDevice:
                 entity = InputEntity(self, input_config)
                 self.inputs[entity.id] = entity
 
+        # configure holding registers, numbers if writable, otherwise sensors
+        self.holdings = {}
+        if CONF_HOLDINGS in config.keys():
+            for holding_config in config.get(CONF_HOLDINGS):
+                if holding_config.get(CONF_WRITABLE):
+                    entity = HoldingEntity(self, holding_config)
+                else:
+                    entity = InputEntity(self, holding_config, CONF_HOLDINGS)
+                self.holdings[entity.id] = entity
+
+        self.blocks = self.read_plan()
+
+    @property
+    def tables(self) -> dict[str, dict[int, Any]]:
+        """The point entities of the device by table and address"""
+        return {
+            CONF_COILS: self.coils,
+            CONF_DISCRETE_INPUTS: self.discrete_inputs,
+            CONF_INPUTS: self.inputs,
+            CONF_HOLDINGS: self.holdings,
+        }
+
+    @property
+    def entities(self) -> list[PointEntity]:
+        return [entity for points in self.tables.values() for entity in points.values()]
+
+    def set_available(self, available: bool) -> None:
+        """Set the availability of the device entities and write their ha state"""
+        self.available = available
+        _LOGGER.info(f"{self} is {'available' if available else 'unavailable'}")
+        for entity in self.entities:
+            if entity.hass:
+                entity.async_write_ha_state()
+
+    def read_plan(self) -> list[ReadBlock]:
+        """Build the read blocks of the device"""
+        blocks = plan_device(self, self.tables, self.read_gap)
+        for block in blocks:
+            block.sampled = tuple(index for index, point in enumerate(block.entities) if point.samples is not None)
+        return blocks
+
+    def adopt(self, old: ModbusDevice) -> tuple[list, list]:
+        """Take over the state of the replaced device of the slave and the entities of its unchanged
+        points, a renamed point keeps its entity too. The read blocks are kept as well, if the
+        points are the same. Returns the added and the removed entities."""
+        self.known = old.known
+        self.available = old.available
+        self.write_and_read = old.write_and_read
+        added = []
+        removed = []
+        for table, points in self.tables.items():
+            old_points = dict(old.tables[table])
+            for addr, entity in list(points.items()):
+                previous = old_points.pop(addr, None)
+                if previous is None or not previous.same_point(entity):
+                    if previous is not None:
+                        removed.append(previous)
+                    added.append(entity)
+                    continue
+                previous.device = self
+                if previous._attr_name != entity._attr_name:
+                    previous.rename(entity._attr_name)
+                points[addr] = previous
+            removed.extend(old_points.values())
+        if not added and not removed and self.read_gap == old.read_gap:
+            # the same points are read the same way, the blocks are kept with their buffers
+            for block in old.blocks:
+                block.device = self
+            self.blocks = old.blocks
+        else:
+            self.blocks = self.read_plan()
+        return added, removed
+
     def __str__(self):
         return f"<ModbusDevice {self.port.name}:{self.slave_id}>"
 
 
-class CoilEntity(SwitchEntity):
-    """Represents a coil in the device as simple switch entity."""
+class PointEntity:
+    """Base of the entities of a device table point. The state is set by the poll of the port."""
 
-    def __init__(self, device: ModbusDevice, config: ConfigType):
+    # recent samples of a point with aggregation, see RegisterEntity
+    samples = None
+
+    def __init__(self, device: ModbusDevice, config: ConfigType, kind: str):
         self.device = device
+        self.config = config
         self.id = config.get(CONF_ID)
+        self.autoupdate = config.get(CONF_AUTOUPDATE, device.autoupdate)
         self._attr_name = config.get(CONF_NAME)
-        self._attr_is_on = False
-        self._attr_unique_id = f"{DOMAIN}-{self.device.port.name}-{self.device.slave_id}-coil{self.id}"
+        self.restored = False
+        self._attr_unique_id = f"{DOMAIN}-{self.device.port.name}-{self.device.slave_id}-{kind}{self.id}"
         self._attr_should_poll = False
 
+    @property
+    def available(self) -> bool:
+        return self.device.available
+
+    @property
+    def extra_state_attributes(self) -> dict[str, Any] | None:
+        # the state is restored from the snapshot and not confirmed by a poll yet
+        return {"restored": True} if self.restored else None
+
+    async def async_added_to_hass(self) -> None:
+        self.async_on_remove(self.async_write_ha_state)
+
+    def same_point(self, other: PointEntity) -> bool:
+        """Whether the other entity is the same point with the same settings, except the name"""
+        return (type(other) is type(self) and other.autoupdate == self.autoupdate
+                and {**other.config, CONF_NAME: None} == {**self.config, CONF_NAME: None})
+
+    def rename(self, name: str) -> None:
+        self._attr_name = name
+        if self.hass:
+            self.async_write_ha_state()
+
+
+class BitEntity(PointEntity):
+    """Base of the coil and discrete input entities"""
+
+    def __init__(self, device: ModbusDevice, config: ConfigType, kind: str):
+        super().__init__(device, config, kind)
+        self._attr_is_on = False
+
+    def set_is_on(self, value: bool) -> bool:
+        """Set the state without calling modbus. Called by the update state from ModbusPort,
+        which writes the ha state of the changed entities. Returns True if the state changed."""
+        if value != self._attr_is_on:
+            self._attr_is_on = value
+            return True
+        return False
+
+
+class CoilEntity(BitEntity, SwitchEntity):
+    """Represents a coil in the device as simple switch entity."""
+
+    def __init__(self, device: ModbusDevice, config: ConfigType):
+        super().__init__(device, config, "coil")
+
     async def async_turn_on(self, **kwargs: Any) -> None:
         await self.device.port.async_write_coil(self, True)
         self._attr_is_on = True
@@ -215,45 +917,84 @@ class CoilEntity(SwitchEntity):
         self._attr_is_on = False
         self.async_write_ha_state()
 
-    def set_is_on(self, value: bool):
-        """Set the state without calling modbus. Called by the update state from ModbusPort"""
-        if value != self._attr_is_on:
-            self._attr_is_on = value
-            # update ha state if device is initialized
-            if self.hass:
-                self.async_write_ha_state()
-                _LOGGER.info(f"{self} state updated")
 
-    async def async_added_to_hass(self) -> None:
-        self.async_on_remove(self.async_write_ha_state)
+class DiscreteInputEntity(BitEntity, BinarySensorEntity):
+    """Represents a discrete input in the device as binary sensor entity."""
 
+    def __init__(self, device: ModbusDevice, config: ConfigType):
+        super().__init__(device, config, "discrete")
 
-class InputEntity(SensorEntity):
-    """Represents an input in the device as sensor entity."""
 
-    def __init__(self, device: ModbusDevice, config: ConfigType):
-        self.device = device
-        self.id = config.get(CONF_ID)
-        self._attr_name = config.get(CONF_NAME)
-        self._attr_value = float(0)
-        self._attr_unique_id = f"{DOMAIN}-{self.device.port.name}-{self.device.slave_id}-input{self.id}"
-        self._attr_should_poll = False
+class RegisterEntity(PointEntity):
+    """Base of the register entities: the decoding of the value and the deadband of its changes"""
 
+    writable = False
+
+    def __init__(self, device: ModbusDevice, config: ConfigType, kind: str):
+        super().__init__(device, config, kind)
         sensor_attrs = SENSOR_ATTRS.get(config.get(CONF_MODE))
         self._attr_native_unit_of_measurement = sensor_attrs.unit
         self._attr_state_class = sensor_attrs.state_class
         self._attr_native_value = float(0)
 
-    def set_value(self, int_value: int):
-        """Set the state value without calling modbus. Called by the update state from ModbusPort"""
-        value = float(int_value)
-        _LOGGER.info(f"{self} value measured: {value}")
-        if value != self._attr_native_value:
-            self._attr_native_value = value
-            # update ha state if device is initialized
-            if self.hass:
-                self.async_write_ha_state()
-                _LOGGER.info(f"{self} state updated")
+        # decoding of the register value, the defaults are given by the sensor mode
+        self.data_type = config.get(CONF_DATA_TYPE, sensor_attrs.data_type)
+        self.word_order = config.get(CONF_WORD_ORDER)
+        self.scale = config.get(CONF_SCALE, sensor_attrs.scale)
+        self.offset = config.get(CONF_OFFSET)
+        # smallest change published to ha: absolute and in percent of the current value
+        self.deadband = config.get(CONF_DEADBAND)
+        self.relative_deadband = config.get(CONF_RELATIVE_DEADBAND)
+
+        # a point with aggregation keeps every read value in its sample buffer, and its state is
+        # the aggregate of the samples, set once per aggregation interval
+        self.aggregate = config.get(CONF_AGGREGATE)
+        self.aggregate_interval = config.get(CONF_AGGREGATE_INTERVAL)
+        if self.aggregate is not None:
+            self.samples = SampleBuffer(config.get(CONF_SAMPLES))
+            if config.get(CONF_SAMPLES) < self.aggregate_interval / self.autoupdate:
+                _LOGGER.warning(f"The {CONF_SAMPLES} of {self._attr_name} don't cover its {CONF_AGGREGATE_INTERVAL}, "
+                                f"the aggregate is taken of the last {config.get(CONF_SAMPLES)} samples only")
+        self.next_publish = 0.0
+
+    def set_value(self, value: float, force: bool = False) -> bool:
+        """Set the state value without calling modbus. Called by the update state from ModbusPort,
+        which writes the ha state of the changed entities. Changes within the deadband of the
+        current value are dropped, unless forced. Returns True if the state changed."""
+        current = self._attr_native_value
+        if value == current:
+            return False
+        delta = abs(value - current)
+        if not force and (delta < self.deadband or delta < abs(current) * self.relative_deadband / 100):
+            return False
+        self._attr_native_value = value
+        return True
+
+
+class InputEntity(RegisterEntity, SensorEntity):
+    """Represents an input register, or a read only holding register, in the device as sensor entity."""
+
+    def __init__(self, device: ModbusDevice, config: ConfigType, table: str = CONF_INPUTS):
+        super().__init__(device, config, "input" if table == CONF_INPUTS else "holding")
+
+
+class HoldingEntity(RegisterEntity, NumberEntity):
+    """Represents a writable holding register in the device as number entity. A set value is
+    written and read back in one transaction, see ModbusPort.async_write_holding."""
+
+    writable = True
 
-    async def async_added_to_hass(self) -> None:
-        self.async_on_remove(self.async_write_ha_state)
+    def __init__(self, device: ModbusDevice, config: ConfigType):
+        super().__init__(device, config, "holding")
+        self._attr_unit_of_measurement = self._attr_native_unit_of_measurement
+        low, high = value_range(DATA_TYPES[self.data_type], self.scale, self.offset)
+        self._attr_min_value = config.get(CONF_MIN, low)
+        self._attr_max_value = config.get(CONF_MAX, high)
+        self._attr_step = config.get(CONF_STEP, abs(self.scale) if self.data_type != "float32" else 0.1)
+
+    @property
+    def value(self) -> float:
+        return self._attr_native_value
+
+    async def async_set_value(self, value: float) -> None:
+        await self.device.port.async_write_holding(self, value)
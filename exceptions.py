@@ -0,0 +1,51 @@
+"""Exceptions of the modbus drivers."""
+from __future__ import annotations
+
+# texts of the modbus exception codes
+EXCEPTION_CODES = {
+    1: "Illegal function",
+    2: "Illegal data address",
+    3: "Illegal data value",
+    4: "Slave device or server failure",
+    5: "Acknowledge",
+    6: "Slave device or server is busy",
+    7: "Negative acknowledge",
+    8: "Memory parity error",
+    10: "Gateway path unavailable",
+    11: "Target device failed to respond",
+}
+
+# exception code of a function not supported by the slave
+ILLEGAL_FUNCTION = 1
+
+
+class ModbusException(Exception):
+    pass
+
+
+class ModbusTimeoutError(ModbusException, TimeoutError):
+    """The slave didn't respond within the response timeout"""
+
+
+class ModbusCrcError(ModbusException):
+    """The response frame was corrupted"""
+
+
+class ModbusExceptionResponse(ModbusException):
+    """The slave responded with a modbus exception code"""
+
+    def __init__(self, code: int):
+        super().__init__(EXCEPTION_CODES.get(code, f"Exception response {code}"))
+        self.code = code
+
+
+class ModbusAborted(ModbusException):
+    """The transaction was aborted from another thread, e.g. its caller was cancelled"""
+
+
+class ModbusConnectionError(ModbusException):
+    """The port or the connection to the server can't be used"""
+
+
+class SlaveUnavailable(ModbusException):
+    """The slave is in backoff after repeated failures, the request was not sent"""
@@ -0,0 +1,64 @@
+"""Health of the slaves on a modbus bus. A slave failing to respond repeatedly is put into backoff:
+its requests fail at once without using the bus, except a probe request now and then. The backoff
+time doubles with every failed probe, and the first successful response ends the backoff."""
+from __future__ import annotations
+
+import logging
+import time
+
+from .const import *
+from .exceptions import ModbusAborted, ModbusExceptionResponse
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class SlaveHealth:
+    """Circuit breaker of a slave, used by the I/O thread of the bus only"""
+
+    __slots__ = ("slave_id", "failures", "backoff", "next_probe")
+
+    def __init__(self, slave_id: int):
+        self.slave_id = slave_id
+        # consecutive transactions without a valid response
+        self.failures = 0
+        # current backoff time in seconds, 0 while the slave is healthy
+        self.backoff = 0.0
+        self.next_probe = 0.0
+
+    @property
+    def available(self) -> bool:
+        return not self.backoff
+
+    def allow(self) -> bool:
+        """Whether a request can be sent to the slave: always while it is healthy, otherwise only
+        as a probe when the backoff time passed. Only one probe is sent per backoff time."""
+        if not self.backoff:
+            return True
+        now = time.monotonic()
+        if now < self.next_probe:
+            return False
+        self.next_probe = now + self.backoff
+        return True
+
+    def record(self, err: Exception | None) -> None:
+        """Record the result of a transaction with the slave. Only a valid response counts as alive,
+        including the modbus exception responses. An aborted transaction tells nothing, any other
+        error (timeout, corrupted or foreign frame, lost connection) is a failure."""
+        if isinstance(err, ModbusAborted):
+            return
+        if err is None or isinstance(err, ModbusExceptionResponse):
+            if self.backoff:
+                _LOGGER.info("Slave %d responds again", self.slave_id)
+            self.failures = 0
+            self.backoff = 0.0
+            return
+        self.failures += 1
+        if self.backoff:
+            self.backoff = min(self.backoff * 2, BACKOFF_MAX)
+        elif self.failures >= FAILURE_THRESHOLD:
+            self.backoff = BACKOFF_INITIAL
+            _LOGGER.warning("Slave %d failed %d times, probing it every %d s from now on",
+                            self.slave_id, self.failures, self.backoff)
+        else:
+            return
+        self.next_probe = time.monotonic() + self.backoff
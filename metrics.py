@@ -0,0 +1,268 @@
+"""Transaction metrics of a modbus bus and the diagnostic sensors showing them. The metrics are
+recorded by the I/O thread of the bus for every modbus request, so the recording is kept to a
+few counter increments: the statistics are computed when the metrics are sampled."""
+from __future__ import annotations
+
+from bisect import bisect_left
+from dataclasses import dataclass
+import time
+from typing import Any, Callable
+
+from homeassistant.components import sensor
+from homeassistant.components.sensor import SensorEntity
+from homeassistant.const import ENTITY_CATEGORY_DIAGNOSTIC, PERCENTAGE, TIME_MILLISECONDS
+from homeassistant.util import dt as dt_util
+
+from .const import *
+from .exceptions import ModbusCrcError, ModbusExceptionResponse
+from .modbus_pdu import MODBUS_BROADCAST_ADDRESS, PDU_SIZES
+
+# upper bounds of the latency histogram buckets in seconds, the last bucket holds the slower ones
+# and counts as the last bound in the percentiles
+LATENCY_BUCKETS: Final = (0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0)
+
+# bytes of the framing around the PDU: slave address and crc, or the MBAP header of modbus TCP
+RTU_FRAMING: Final = 3
+TCP_FRAMING: Final = 7
+
+
+def error_kind(err: Exception) -> str:
+    """Name of the SlaveMetrics counter of a failed transaction"""
+    if isinstance(err, TimeoutError):
+        return "timeouts"
+    if isinstance(err, ModbusCrcError):
+        return "crc_errors"
+    if isinstance(err, ModbusExceptionResponse):
+        return "exception_responses"
+    return "errors"
+
+
+def _percentile(histogram: list[int], percent: float) -> float | None:
+    """Upper bound of the histogram bucket holding the percentile in seconds, None if empty"""
+    count = sum(histogram)
+    if not count:
+        return None
+    rank = count * percent / 100
+    seen = 0
+    for index, bucket in enumerate(histogram):
+        seen += bucket
+        if seen >= rank:
+            break
+    return LATENCY_BUCKETS[min(index, len(LATENCY_BUCKETS) - 1)]
+
+
+class SlaveMetrics:
+    """Counters of the transactions with a slave. These are written by the I/O thread of the bus
+    and read on the event loop without locking, a reader may see a transaction half recorded."""
+
+    __slots__ = (
+        "transactions", "timeouts", "crc_errors", "exception_responses", "errors", "expired", "bytes",
+        "latency", "histogram", "last_success", "latency_p50", "latency_p99", "_sampled",
+    )
+
+    def __init__(self):
+        self.transactions = 0
+        self.timeouts = 0
+        self.crc_errors = 0
+        self.exception_responses = 0
+        self.errors = 0
+        # requests dropped because their deadline passed before they were sent
+        self.expired = 0
+        # estimated bytes on the wire, failed transactions count the request only
+        self.bytes = 0
+        # total latency of the transactions in seconds
+        self.latency = 0.0
+        self.histogram = [0] * (len(LATENCY_BUCKETS) + 1)
+        # wall clock time of the last successful transaction
+        self.last_success = None
+        # latency percentiles of the last sample window in seconds
+        self.latency_p50 = None
+        self.latency_p99 = None
+        self._sampled = list(self.histogram)
+
+    @property
+    def failures(self) -> int:
+        return self.timeouts + self.crc_errors + self.exception_responses + self.errors
+
+    def record(self, latency: float, size: int, err: Exception | None) -> None:
+        self.transactions += 1
+        self.bytes += size
+        self.latency += latency
+        self.histogram[bisect_left(LATENCY_BUCKETS, latency)] += 1
+        if err is None:
+            self.last_success = time.time()
+        else:
+            kind = error_kind(err)
+            setattr(self, kind, getattr(self, kind) + 1)
+
+    def sample(self) -> None:
+        """Compute the latency percentiles of the transactions since the previous sample"""
+        histogram = list(self.histogram)
+        window = [count - sampled for count, sampled in zip(histogram, self._sampled)]
+        self._sampled = histogram
+        self.latency_p50 = _percentile(window, 50)
+        self.latency_p99 = _percentile(window, 99)
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "transactions": self.transactions,
+            "timeouts": self.timeouts,
+            "crc_errors": self.crc_errors,
+            "exception_responses": self.exception_responses,
+            "errors": self.errors,
+            "expired": self.expired,
+            "bytes": self.bytes,
+            "latency_mean": self.latency / self.transactions if self.transactions else None,
+            "latency_p50": self.latency_p50,
+            "latency_p99": self.latency_p99,
+            "latency_histogram": dict(zip([*LATENCY_BUCKETS, "inf"], self.histogram)),
+            "last_success": self.last_success,
+        }
+
+
+class BusMetrics:
+    """Metrics of the transactions on a modbus bus, in total and by slave"""
+
+    def __init__(self, framing: int = RTU_FRAMING):
+        self.framing = framing
+        self.total = SlaveMetrics()
+        self.slaves: dict[int, SlaveMetrics] = {}
+        # time the I/O thread spent with transactions in seconds
+        self.busy_time = 0.0
+        # percent of the last sample window the bus was busy
+        self.utilization = 0.0
+        self._sampled_time = time.monotonic()
+        self._sampled_busy_time = 0.0
+
+    def slave(self, slave_id: int) -> SlaveMetrics:
+        metrics = self.slaves.get(slave_id)
+        if metrics is None:
+            metrics = self.slaves[slave_id] = SlaveMetrics()
+        return metrics
+
+    def record(self, request: tuple[int, str, tuple], latency: float, err: Exception | None) -> None:
+        """Record a transaction given as (slave, driver method name, args), called by the I/O thread"""
+        slave_id, name, args = request
+        request_size, response_size = PDU_SIZES[name](*args)
+        if err is None and slave_id != MODBUS_BROADCAST_ADDRESS:
+            size = request_size + response_size + 2 * self.framing
+        else:
+            size = request_size + self.framing
+        self.total.record(latency, size, err)
+        self.slave(slave_id).record(latency, size, err)
+
+    def record_expired(self, slave_id: int) -> None:
+        """Record a request dropped at its deadline without using the bus, called by the I/O thread"""
+        self.total.expired += 1
+        self.slave(slave_id).expired += 1
+
+    def sample(self) -> None:
+        """Compute the statistics of the window since the previous sample"""
+        now = time.monotonic()
+        busy_time = self.busy_time
+        if now > self._sampled_time:
+            self.utilization = min(100.0, (busy_time - self._sampled_busy_time) / (now - self._sampled_time) * 100)
+        self._sampled_time = now
+        self._sampled_busy_time = busy_time
+        self.total.sample()
+        for metrics in list(self.slaves.values()):
+            metrics.sample()
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "utilization": self.utilization,
+            "busy_time": self.busy_time,
+            "total": self.total.as_dict(),
+            "slaves": {slave_id: metrics.as_dict() for slave_id, metrics in sorted(self.slaves.items())},
+        }
+
+
+def _milliseconds(seconds: float | None) -> float | None:
+    return None if seconds is None else round(seconds * 1000, 1)
+
+
+def _timestamp(value: float | None):
+    return None if value is None else dt_util.utc_from_timestamp(value)
+
+
+@dataclass
+class _MetricAttributes:
+    """Attributes of a diagnostic sensor, the value is read from the SlaveMetrics"""
+    name: str
+    unit: str | None
+    device_class: str | None
+    state_class: str | None
+    value: Callable[[SlaveMetrics], Any]
+
+# Diagnostic sensors of a port and of each slave, by the metric key
+METRIC_ATTRS: Final = {
+    "transactions": _MetricAttributes(
+        "transactions", None, None, sensor.STATE_CLASS_TOTAL_INCREASING, lambda m: m.transactions),
+    "failures": _MetricAttributes(
+        "failures", None, None, sensor.STATE_CLASS_TOTAL_INCREASING, lambda m: m.failures),
+    "timeouts": _MetricAttributes(
+        "timeouts", None, None, sensor.STATE_CLASS_TOTAL_INCREASING, lambda m: m.timeouts),
+    "crc_errors": _MetricAttributes(
+        "CRC errors", None, None, sensor.STATE_CLASS_TOTAL_INCREASING, lambda m: m.crc_errors),
+    "exception_responses": _MetricAttributes(
+        "exception responses", None, None, sensor.STATE_CLASS_TOTAL_INCREASING, lambda m: m.exception_responses),
+    "expired": _MetricAttributes(
+        "expired requests", None, None, sensor.STATE_CLASS_TOTAL_INCREASING, lambda m: m.expired),
+    "bytes": _MetricAttributes(
+        "bytes", "B", None, sensor.STATE_CLASS_TOTAL_INCREASING, lambda m: m.bytes),
+    "latency_p50": _MetricAttributes(
+        "latency p50", TIME_MILLISECONDS, None, sensor.STATE_CLASS_MEASUREMENT, lambda m: _milliseconds(m.latency_p50)),
+    "latency_p99": _MetricAttributes(
+        "latency p99", TIME_MILLISECONDS, None, sensor.STATE_CLASS_MEASUREMENT, lambda m: _milliseconds(m.latency_p99)),
+    "last_success": _MetricAttributes(
+        "last success", None, sensor.DEVICE_CLASS_TIMESTAMP, None, lambda m: _timestamp(m.last_success)),
+}
+
+PORT_METRICS: Final = ("transactions", "failures", "timeouts", "crc_errors", "exception_responses", "expired",
+                       "bytes", "latency_p50", "latency_p99")
+SLAVE_METRICS: Final = ("failures", "latency_p99", "last_success")
+
+
+class MetricEntity(SensorEntity):
+    """Diagnostic sensor of a port or a slave metric. The state is written when the port samples
+    its metrics, not on every transaction."""
+
+    def __init__(self, port: Any, key: str, slave_id: int | None = None):
+        self.port = port
+        self.slave_id = slave_id
+        attrs = METRIC_ATTRS[key]
+        self._value = attrs.value
+        if slave_id is None:
+            self._attr_name = f"{port.name} {attrs.name}"
+            self._attr_unique_id = f"{DOMAIN}-{port.name}-metric-{key}"
+        else:
+            self._attr_name = f"{port.name} slave {slave_id} {attrs.name}"
+            self._attr_unique_id = f"{DOMAIN}-{port.name}-{slave_id}-metric-{key}"
+        self._attr_native_unit_of_measurement = attrs.unit
+        self._attr_device_class = attrs.device_class
+        self._attr_state_class = attrs.state_class
+        self._attr_entity_category = ENTITY_CATEGORY_DIAGNOSTIC
+        self._attr_should_poll = False
+
+    @property
+    def native_value(self):
+        metrics = self.port.metrics
+        return self._value(metrics.total if self.slave_id is None else metrics.slave(self.slave_id))
+
+
+class UtilizationEntity(SensorEntity):
+    """Diagnostic sensor of the bus utilization of a port in the last sample window"""
+
+    def __init__(self, port: Any):
+        self.port = port
+        self.slave_id = None
+        self._attr_name = f"{port.name} bus utilization"
+        self._attr_unique_id = f"{DOMAIN}-{port.name}-metric-utilization"
+        self._attr_native_unit_of_measurement = PERCENTAGE
+        self._attr_state_class = sensor.STATE_CLASS_MEASUREMENT
+        self._attr_entity_category = ENTITY_CATEGORY_DIAGNOSTIC
+        self._attr_should_poll = False
+
+    @property
+    def native_value(self):
+        return round(self.port.metrics.utilization, 1)
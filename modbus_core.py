@@ -5,8 +5,18 @@
 
 from __future__ import division
 
+import errno
+
 from cffi import FFI
 
+from .exceptions import (
+    ModbusConnectionError,
+    ModbusCrcError,
+    ModbusException,
+    ModbusExceptionResponse,
+    ModbusTimeoutError,
+)
+
 ffi = FFI()
 ffi.cdef(
     """
@@ -16,6 +26,7 @@ ffi.cdef(
     void modbus_get_response_timeout(modbus_t *ctx, uint32_t *to_sec, uint32_t *to_usec);
     void modbus_set_response_timeout(modbus_t *ctx, uint32_t to_sec, uint32_t to_usec);
     void modbus_close(modbus_t *ctx);
+    int modbus_flush(modbus_t *ctx);
     const char *modbus_strerror(int errnum);
 
     int modbus_read_bits(modbus_t *ctx, int addr, int nb, uint8_t *dest);
@@ -35,7 +46,44 @@ ffi.cdef(
     modbus_t* modbus_new_rtu(const char *device, int baud, char parity, int data_bit, int stop_bit);
 """
 )
-libmodbus = ffi.dlopen("modbus")
+
+
+class LazyLibrary(object):
+    """Shared library loaded on the first use instead of at import, so importing the driver
+    is cheap. The looked up functions are cached on the instance."""
+
+    def __init__(self, ffi, name):
+        self._ffi = ffi
+        self._name = name
+        self._lib = None
+
+    def __getattr__(self, attr):
+        if self._lib is None:
+            self._lib = self._ffi.dlopen(self._name)
+        value = getattr(self._lib, attr)
+        setattr(self, attr, value)
+        return value
+
+
+libmodbus = LazyLibrary(ffi, "modbus")
+
+# base of the libmodbus error numbers, the modbus exception codes are added to it
+MODBUS_ENOBASE = 112345678
+EMBBADCRC = MODBUS_ENOBASE + 12
+
+
+def _error(errnum):
+    """Typed exception of a libmodbus error number"""
+    message = ffi.string(libmodbus.modbus_strerror(errnum)).decode(errors="replace")
+    if errnum == errno.ETIMEDOUT:
+        return ModbusTimeoutError(message)
+    if errnum == EMBBADCRC:
+        return ModbusCrcError(message)
+    if MODBUS_ENOBASE < errnum < EMBBADCRC:
+        return ModbusExceptionResponse(errnum - MODBUS_ENOBASE)
+    if errnum < MODBUS_ENOBASE:
+        return ModbusConnectionError(message)
+    return ModbusException(message)
 
 
 def get_float(data):
@@ -54,15 +102,17 @@ def cast_to_int32(data):
     return int(ffi.cast("int32_t", data))
 
 
-class ModbusException(Exception):
-    pass
+def _buffer(ctype, dest):
+    # a view of the memory of the buffer, the data is not copied
+    return dest if isinstance(dest, ffi.CData) else ffi.from_buffer(ctype, dest, require_writable=True)
 
 
 class ModbusCore(object):
     def _run(self, func, *args):
         rc = func(self.ctx, *args)
         if rc == -1:
-            raise Exception(ffi.string(libmodbus.modbus_strerror(ffi.errno)))
+            raise _error(ffi.errno)
+        return rc
 
     def connect(self):
         return self._run(libmodbus.modbus_connect)
@@ -84,6 +134,10 @@ class ModbusCore(object):
     def close(self):
         libmodbus.modbus_close(self.ctx)
 
+    def flush(self):
+        """Drop the unread input, e.g. the late response of a timed out request"""
+        return self._run(libmodbus.modbus_flush)
+
     def read_bits(self, addr, nb):
         dest = ffi.new("uint8_t[]", nb)
         self._run(libmodbus.modbus_read_bits, addr, nb, dest)
@@ -104,6 +158,22 @@ class ModbusCore(object):
         self._run(libmodbus.modbus_read_input_registers, addr, nb, dest)
         return dest
 
+    # The _into variants fill a buffer of the caller instead of allocating a new array on every call
+    # and return the count of read items. The buffer is a cffi array of the proper type or any
+    # writable buffer: bytearray for the bits and array("H") for the registers.
+
+    def read_bits_into(self, addr, nb, dest):
+        return self._run(libmodbus.modbus_read_bits, addr, nb, _buffer("uint8_t[]", dest))
+
+    def read_input_bits_into(self, addr, nb, dest):
+        return self._run(libmodbus.modbus_read_input_bits, addr, nb, _buffer("uint8_t[]", dest))
+
+    def read_registers_into(self, addr, nb, dest):
+        return self._run(libmodbus.modbus_read_registers, addr, nb, _buffer("uint16_t[]", dest))
+
+    def read_input_registers_into(self, addr, nb, dest):
+        return self._run(libmodbus.modbus_read_input_registers, addr, nb, _buffer("uint16_t[]", dest))
+
     def write_bit(self, addr, status):
         # int
         self._run(libmodbus.modbus_write_bit, addr, status)
@@ -0,0 +1,289 @@
+"""Modbus PDU encoding of the pure python drivers. The requests are described by the name of the
+ModbusCore method and its arguments, so a batch of them can be sent by a driver at once."""
+from __future__ import annotations
+
+import os
+import select
+import struct
+import sys
+import time
+from array import array
+from typing import Any, Callable
+
+from .exceptions import ModbusAborted, ModbusException, ModbusExceptionResponse, ModbusTimeoutError
+
+MODBUS_BROADCAST_ADDRESS = 0
+
+# function codes
+READ_COILS = 0x01
+READ_DISCRETE_INPUTS = 0x02
+READ_HOLDING_REGISTERS = 0x03
+READ_INPUT_REGISTERS = 0x04
+WRITE_SINGLE_COIL = 0x05
+WRITE_SINGLE_REGISTER = 0x06
+WRITE_MULTIPLE_COILS = 0x0F
+WRITE_MULTIPLE_REGISTERS = 0x10
+WRITE_AND_READ_REGISTERS = 0x17
+
+
+def pack_bits(values) -> bytes:
+    """Pack bit values into bytes, LSB first"""
+    packed = bytearray((len(values) + 7) // 8)
+    for i, value in enumerate(values):
+        if value:
+            packed[i >> 3] |= 1 << (i & 7)
+    return bytes(packed)
+
+
+def unpack_bits(data: bytes, count: int) -> list[int]:
+    """Unpack count bit values from bytes, LSB first"""
+    return [(data[i >> 3] >> (i & 7)) & 1 for i in range(count)]
+
+
+def _decode_bits(nb: int) -> Callable[[bytes], list[int]]:
+    def decode(data: bytes) -> list[int]:
+        if not data or data[0] != (nb + 7) // 8:
+            raise ModbusException("Invalid data length")
+        return unpack_bits(data[1:], nb)
+    return decode
+
+
+def _decode_registers(nb: int) -> Callable[[bytes], list[int]]:
+    def decode(data: bytes) -> list[int]:
+        if not data or data[0] != nb * 2:
+            raise ModbusException("Invalid data length")
+        return list(struct.unpack_from(f">{nb}H", data, 1))
+    return decode
+
+
+def _decode_bits_into(nb: int, dest) -> Callable[[bytes], int]:
+    def decode(data: bytes) -> int:
+        if not data or data[0] != (nb + 7) // 8:
+            raise ModbusException("Invalid data length")
+        for i in range(nb):
+            dest[i] = (data[1 + (i >> 3)] >> (i & 7)) & 1
+        return nb
+    return decode
+
+
+def _decode_registers_into(nb: int, dest) -> Callable[[bytes], int]:
+    def decode(data: bytes) -> int:
+        if not data or data[0] != nb * 2:
+            raise ModbusException("Invalid data length")
+        if isinstance(dest, array) and dest.itemsize == 2 and len(dest) == nb:
+            # copy the bytes at once, then fix the byte order of the whole array in place
+            memoryview(dest).cast("B")[:] = data[1:]
+            if sys.byteorder == "little":
+                dest.byteswap()
+        else:
+            for i, value in enumerate(struct.unpack_from(f">{nb}H", data, 1)):
+                dest[i] = value
+        return nb
+    return decode
+
+
+def _decode_none(data: bytes) -> None:
+    return None
+
+
+def _read_bits(function: int, addr: int, nb: int):
+    return function, struct.pack(">HH", addr, nb), _decode_bits(nb)
+
+
+def _read_registers(function: int, addr: int, nb: int):
+    return function, struct.pack(">HH", addr, nb), _decode_registers(nb)
+
+
+def _read_bits_into(function: int, addr: int, nb: int, dest):
+    return function, struct.pack(">HH", addr, nb), _decode_bits_into(nb, dest)
+
+
+def _read_registers_into(function: int, addr: int, nb: int, dest):
+    return function, struct.pack(">HH", addr, nb), _decode_registers_into(nb, dest)
+
+
+def _write_bits(addr, nb, data):
+    packed = pack_bits(data)
+    return WRITE_MULTIPLE_COILS, struct.pack(">HHB", addr, len(data), len(packed)) + packed, _decode_none
+
+
+def _write_registers(addr, data):
+    nb = len(data)
+    return WRITE_MULTIPLE_REGISTERS, struct.pack(f">HHB{nb}H", addr, nb, nb * 2, *data), _decode_none
+
+
+def _write_and_read_registers(write_addr, data, read_addr, read_nb):
+    nb = len(data)
+    payload = struct.pack(f">HHHHB{nb}H", read_addr, read_nb, write_addr, nb, nb * 2, *data)
+    return WRITE_AND_READ_REGISTERS, payload, _decode_registers(read_nb)
+
+
+# request encoders by the name of the ModbusCore method,
+# each returns the function code, the request payload and the decoder of the response payload
+REQUESTS: dict[str, Callable[..., tuple[int, bytes, Callable[[bytes], Any]]]] = {
+    "read_bits": lambda addr, nb: _read_bits(READ_COILS, addr, nb),
+    "read_input_bits": lambda addr, nb: _read_bits(READ_DISCRETE_INPUTS, addr, nb),
+    "read_registers": lambda addr, nb: _read_registers(READ_HOLDING_REGISTERS, addr, nb),
+    "read_input_registers": lambda addr, nb: _read_registers(READ_INPUT_REGISTERS, addr, nb),
+    "read_bits_into": lambda addr, nb, dest: _read_bits_into(READ_COILS, addr, nb, dest),
+    "read_input_bits_into": lambda addr, nb, dest: _read_bits_into(READ_DISCRETE_INPUTS, addr, nb, dest),
+    "read_registers_into": lambda addr, nb, dest: _read_registers_into(READ_HOLDING_REGISTERS, addr, nb, dest),
+    "read_input_registers_into": lambda addr, nb, dest: _read_registers_into(READ_INPUT_REGISTERS, addr, nb, dest),
+    "write_bit": lambda addr, status: (
+        WRITE_SINGLE_COIL, struct.pack(">HH", addr, 0xFF00 if status else 0), _decode_none),
+    "write_register": lambda addr, value: (
+        WRITE_SINGLE_REGISTER, struct.pack(">HH", addr, value), _decode_none),
+    "write_bits": _write_bits,
+    "write_registers": _write_registers,
+    "write_and_read_registers": _write_and_read_registers,
+}
+
+
+# sizes of the request and the normal response PDU by the name of the ModbusCore method,
+# without the framing (slave address and crc, or the MBAP header)
+PDU_SIZES: dict[str, Callable[..., tuple[int, int]]] = {
+    "read_bits": lambda addr, nb, *_: (5, 2 + (nb + 7) // 8),
+    "read_input_bits": lambda addr, nb, *_: (5, 2 + (nb + 7) // 8),
+    "read_registers": lambda addr, nb, *_: (5, 2 + nb * 2),
+    "read_input_registers": lambda addr, nb, *_: (5, 2 + nb * 2),
+    "read_bits_into": lambda addr, nb, *_: (5, 2 + (nb + 7) // 8),
+    "read_input_bits_into": lambda addr, nb, *_: (5, 2 + (nb + 7) // 8),
+    "read_registers_into": lambda addr, nb, *_: (5, 2 + nb * 2),
+    "read_input_registers_into": lambda addr, nb, *_: (5, 2 + nb * 2),
+    "write_bit": lambda addr, status: (5, 5),
+    "write_register": lambda addr, value: (5, 5),
+    "write_bits": lambda addr, nb, data: (6 + (len(data) + 7) // 8, 5),
+    "write_registers": lambda addr, data: (6 + len(data) * 2, 5),
+    "write_and_read_registers": lambda write_addr, data, read_addr, read_nb: (10 + len(data) * 2, 2 + read_nb * 2),
+}
+
+
+def check_response(function: int, response: bytes) -> bytes:
+    """Check the function code of a response PDU and return its payload"""
+    if response[0] == function | 0x80:
+        raise ModbusExceptionResponse(response[1])
+    if response[0] != function:
+        raise ModbusException(f"Unexpected function code {response[0]}")
+    return response[1:]
+
+
+class ModbusPduClient:
+    """Base of the pure python drivers: implements the interface of ModbusCore on top of the
+    _transaction method of the driver. Every wait of a driver has a deadline and a running
+    transaction can be aborted from another thread."""
+
+    # count of requests the driver can have in flight at once, see execute_many
+    pipeline_depth = 1
+
+    def __init__(self):
+        self.slave = MODBUS_BROADCAST_ADDRESS
+        self.response_timeout = 0.5
+        # pipe to wake up a waiting transaction from another thread, see abort
+        self._abort_read, self._abort_write = os.pipe()
+        os.set_blocking(self._abort_read, False)
+        os.set_blocking(self._abort_write, False)
+
+    def __del__(self):
+        for fd in (self._abort_read, self._abort_write):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    def _transaction(self, function: int, payload: bytes) -> bytes:
+        """Send a request to the current slave and return the payload of the response."""
+        raise NotImplementedError
+
+    def set_slave(self, slave):
+        self.slave = slave
+
+    def get_response_timeout(self):
+        return self.response_timeout
+
+    def set_response_timeout(self, seconds):
+        self.response_timeout = seconds
+
+    def flush(self):
+        """Drop the unread input, e.g. the late response of a timed out request."""
+
+    def abort(self):
+        """Abort the running transaction. Can be called from any thread."""
+        try:
+            os.write(self._abort_write, b"\0")
+        except BlockingIOError:
+            pass
+
+    def _clear_abort(self):
+        try:
+            while os.read(self._abort_read, 64):
+                pass
+        except BlockingIOError:
+            pass
+
+    def _wait(self, read_fds: list, write_fds: list, deadline: float) -> tuple[list, list]:
+        """Wait until one of the files is ready or raise if the deadline passed or aborted."""
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise ModbusTimeoutError("Connection timed out")
+        readable, writable, _ = select.select(read_fds + [self._abort_read], write_fds, [], remaining)
+        if self._abort_read in readable:
+            self._clear_abort()
+            raise ModbusAborted("Transaction aborted")
+        if not readable and not writable:
+            raise ModbusTimeoutError("Connection timed out")
+        return readable, writable
+
+    def _call(self, name: str, *args: Any) -> Any:
+        function, payload, decode = REQUESTS[name](*args)
+        return decode(self._transaction(function, payload))
+
+    def execute_many(self, requests: list[tuple[int, str, tuple]]) -> list[Any]:
+        """Run a batch of (slave, method name, args) requests and return their results, or the
+        raised exceptions, in order. Drivers with pipelining send the requests at once."""
+        results = []
+        for slave, name, args in requests:
+            self.set_slave(slave)
+            try:
+                results.append(self._call(name, *args))
+            except ModbusException as err:
+                results.append(err)
+        return results
+
+    def read_bits(self, addr, nb):
+        return self._call("read_bits", addr, nb)
+
+    def read_input_bits(self, addr, nb):
+        return self._call("read_input_bits", addr, nb)
+
+    def read_registers(self, addr, nb):
+        return self._call("read_registers", addr, nb)
+
+    def read_input_registers(self, addr, nb):
+        return self._call("read_input_registers", addr, nb)
+
+    def read_bits_into(self, addr, nb, dest):
+        return self._call("read_bits_into", addr, nb, dest)
+
+    def read_input_bits_into(self, addr, nb, dest):
+        return self._call("read_input_bits_into", addr, nb, dest)
+
+    def read_registers_into(self, addr, nb, dest):
+        return self._call("read_registers_into", addr, nb, dest)
+
+    def read_input_registers_into(self, addr, nb, dest):
+        return self._call("read_input_registers_into", addr, nb, dest)
+
+    def write_bit(self, addr, status):
+        self._call("write_bit", addr, status)
+
+    def write_register(self, addr, value):
+        self._call("write_register", addr, value)
+
+    def write_bits(self, addr, nb, data):
+        self._call("write_bits", addr, nb, data)
+
+    def write_registers(self, addr, data):
+        self._call("write_registers", addr, data)
+
+    def write_and_read_registers(self, write_addr, data, read_addr, read_nb):
+        return self._call("write_and_read_registers", write_addr, data, read_addr, read_nb)
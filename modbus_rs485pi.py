@@ -1,4 +1,4 @@
-from .modbus_core import ModbusCore
+from .modbus_core import LazyLibrary, ModbusCore
 from .modbus_core import ffi as ffiModbusCore
 from cffi import FFI
 
@@ -12,7 +12,7 @@ ffi.cdef(
 """
 )
 
-libmodbus_rs485 = ffi.dlopen("modbus-rs485pi")
+libmodbus_rs485 = LazyLibrary(ffi, "modbus-rs485pi")
 
 
 class ModbusRtu(ModbusCore):
@@ -0,0 +1,181 @@
+"""Pure python modbus RTU driver. Implements the interface of ModbusCore without libmodbus: the
+frames are built and checked here and the serial line is used through a non-blocking file
+descriptor, so every wait has a real deadline and a running transaction can be aborted."""
+from __future__ import annotations
+
+import errno
+import os
+import struct
+import termios
+import time
+
+from .exceptions import ModbusConnectionError, ModbusCrcError, ModbusException
+from .modbus_pdu import (
+    MODBUS_BROADCAST_ADDRESS,
+    WRITE_MULTIPLE_COILS,
+    WRITE_MULTIPLE_REGISTERS,
+    WRITE_SINGLE_COIL,
+    WRITE_SINGLE_REGISTER,
+    ModbusPduClient,
+    check_response,
+)
+
+
+def _crc16_table() -> list[int]:
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+        table.append(crc)
+    return table
+
+
+_CRC16_TABLE = _crc16_table()
+
+
+def crc16(data: bytes) -> int:
+    """Modbus CRC16 of the data"""
+    crc = 0xFFFF
+    for byte in data:
+        crc = (crc >> 8) ^ _CRC16_TABLE[(crc ^ byte) & 0xFF]
+    return crc
+
+
+def build_frame(slave: int, function: int, payload: bytes) -> bytes:
+    """RTU frame of a request or a response, with the CRC appended (low byte first)"""
+    frame = bytes((slave, function)) + payload
+    return frame + struct.pack("<H", crc16(frame))
+
+
+def response_length(header: bytes) -> int:
+    """Full length of a RTU response frame from its first three bytes"""
+    function = header[1]
+    if function & 0x80:
+        return 5
+    if function in (WRITE_SINGLE_COIL, WRITE_SINGLE_REGISTER, WRITE_MULTIPLE_COILS, WRITE_MULTIPLE_REGISTERS):
+        return 8
+    return 3 + header[2] + 2
+
+
+# baud rates supported by termios
+_BAUDRATES = {
+    int(name[1:]): getattr(termios, name)
+    for name in dir(termios) if name.startswith("B") and name[1:].isdigit()
+}
+
+_BYTESIZES = {5: termios.CS5, 6: termios.CS6, 7: termios.CS7, 8: termios.CS8}
+
+
+class ModbusSerialRtu(ModbusPduClient):
+    """Modbus RTU master on a serial line (or on a pseudo-terminal).
+    The direction of a RS485 line is expected to be handled by the UART or the transceiver."""
+
+    def __init__(self, device, baud, parity, data_bit, stop_bit):
+        super().__init__()
+        self.device = device
+        self.baud = baud
+        self.parity = parity
+        self.data_bit = data_bit
+        self.stop_bit = stop_bit
+        self._fd = None
+
+    def __del__(self):
+        self.close()
+        super().__del__()
+
+    def connect(self):
+        fd = os.open(self.device, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+        try:
+            attrs = termios.tcgetattr(fd)
+            speed = _BAUDRATES.get(self.baud)
+            if speed is None:
+                raise ModbusConnectionError(f"Unsupported baud rate: {self.baud}")
+            cflag = termios.CREAD | termios.CLOCAL | _BYTESIZES[self.data_bit]
+            if self.parity != "N":
+                cflag |= termios.PARENB | (termios.PARODD if self.parity == "O" else 0)
+            if self.stop_bit == 2:
+                cflag |= termios.CSTOPB
+            attrs[0] = termios.INPCK if self.parity != "N" else 0  # iflag
+            attrs[1] = 0  # oflag
+            attrs[2] = cflag
+            attrs[3] = 0  # lflag
+            attrs[4] = attrs[5] = speed
+            attrs[6][termios.VMIN] = 0
+            attrs[6][termios.VTIME] = 0
+            termios.tcsetattr(fd, termios.TCSANOW, attrs)
+            termios.tcflush(fd, termios.TCIOFLUSH)
+        except (termios.error, ModbusException):
+            os.close(fd)
+            raise
+        self._fd = fd
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def flush(self):
+        if self._fd is not None:
+            termios.tcflush(self._fd, termios.TCIFLUSH)
+
+    def _send(self, frame: bytes, deadline: float) -> None:
+        if self._fd is None:
+            raise ModbusConnectionError("Not connected")
+        try:
+            termios.tcflush(self._fd, termios.TCIFLUSH)
+        except termios.error as err:
+            raise ModbusConnectionError(f"{self.device} hung up: {err}") from err
+        view = memoryview(frame)
+        while view:
+            try:
+                written = os.write(self._fd, view)
+            except BlockingIOError:
+                self._wait([], [self._fd], deadline)
+                continue
+            except OSError as err:
+                raise ModbusConnectionError(f"{self.device} hung up: {err}") from err
+            view = view[written:]
+
+    def _receive(self, size: int, deadline: float, into: bytearray) -> None:
+        # a hung up line, e.g. a closed pty or an unplugged USB adapter, reads EIO or nothing while
+        # the descriptor stays readable, so waiting for it again would spin until the deadline
+        readable = False
+        while len(into) < size:
+            try:
+                data = os.read(self._fd, size - len(into))
+            except BlockingIOError:
+                data = None
+            except OSError as err:
+                if err.errno == errno.EIO:
+                    raise ModbusConnectionError(f"{self.device} hung up: {err}") from err
+                raise
+            if data:
+                into += data
+                readable = False
+            elif data is not None and readable:
+                raise ModbusConnectionError(f"{self.device} hung up")
+            else:
+                self._wait([self._fd], [], deadline)
+                readable = True
+
+    def _transaction(self, function: int, payload: bytes) -> bytes:
+        self._clear_abort()
+        request = build_frame(self.slave, function, payload)
+        # the response has to arrive within the response timeout after the request is sent
+        send_deadline = time.monotonic() + self.response_timeout + len(request) * 11 / self.baud
+        self._send(request, send_deadline)
+        if self.slave == MODBUS_BROADCAST_ADDRESS:
+            # no response, the turnaround delay of the bus starts when the frame left the line
+            termios.tcdrain(self._fd)
+            return b""
+        deadline = time.monotonic() + self.response_timeout
+        response = bytearray()
+        self._receive(3, deadline, response)
+        length = response_length(response)
+        self._receive(length, deadline + length * 11 / self.baud, response)
+        if crc16(response[:-2]) != struct.unpack_from("<H", response, length - 2)[0]:
+            raise ModbusCrcError("Invalid CRC")
+        if response[0] != self.slave:
+            raise ModbusException(f"Response from unexpected slave {response[0]}")
+        return check_response(function, bytes(response[1:-2]))
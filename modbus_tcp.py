@@ -0,0 +1,233 @@
+"""Pure python modbus TCP driver. Supports MBAP framing (modbus TCP) and RTU frames over TCP for
+serial gateways. The driver keeps a pool of persistent connections which are reopened on demand
+after an error, and with MBAP framing it pipelines the requests of a batch: all of them are sent
+at once and the responses are matched by their transaction id."""
+from __future__ import annotations
+
+import itertools
+import socket
+import struct
+import time
+from typing import Any
+
+from .exceptions import ModbusConnectionError, ModbusCrcError, ModbusException
+from .modbus_pdu import MODBUS_BROADCAST_ADDRESS, REQUESTS, ModbusPduClient, check_response
+from .modbus_serial import build_frame, crc16, response_length
+
+MODBUS_TCP_PORT = 502
+
+# bytes of the MBAP header: transaction id, protocol id, length, unit id
+MBAP_BYTES = 7
+
+
+class _Connection:
+    """A connection of the pool with its receive buffer"""
+
+    def __init__(self, address: tuple[str, int]):
+        self.address = address
+        self.sock = None
+        self.buffer = bytearray()
+
+    def open(self, timeout: float) -> socket.socket:
+        if self.sock is None:
+            try:
+                sock = socket.create_connection(self.address, timeout=timeout)
+            except OSError as err:
+                raise ModbusConnectionError(f"Connection to {self.address[0]}:{self.address[1]} failed: {err}") from err
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.setblocking(False)
+            self.sock = sock
+            self.buffer = bytearray()
+        return self.sock
+
+    def close(self) -> None:
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+
+class ModbusTcp(ModbusPduClient):
+    """Modbus master over TCP with a pool of persistent connections."""
+
+    def __init__(self, host, port=MODBUS_TCP_PORT, connections=1, rtu_framing=False, pipeline=8):
+        super().__init__()
+        self.host = host
+        self.port = port
+        self.rtu_framing = rtu_framing
+        self._connections = [_Connection((host, port)) for _ in range(connections)]
+        # RTU frames have no transaction id, so only one request per connection can be in flight
+        self._depth = 1 if rtu_framing else pipeline
+        self.pipeline_depth = self._depth * connections
+        self._transaction_ids = itertools.count(1)
+
+    def __del__(self):
+        self.close()
+        super().__del__()
+
+    def connect(self):
+        for connection in self._connections:
+            connection.open(self.response_timeout)
+
+    def close(self):
+        for connection in self._connections:
+            connection.close()
+
+    def _send(self, connection: _Connection, data: bytes, deadline: float) -> None:
+        sock = connection.open(self.response_timeout)
+        view = memoryview(data)
+        while view:
+            try:
+                sent = sock.send(view)
+            except BlockingIOError:
+                self._wait([], [sock], deadline)
+                continue
+            view = view[sent:]
+
+    def _fill(self, connection: _Connection) -> None:
+        """Move the received bytes of the connection into its buffer"""
+        while True:
+            try:
+                data = connection.sock.recv(4096)
+            except BlockingIOError:
+                return
+            if not data:
+                raise ModbusConnectionError("Connection closed by the server")
+            connection.buffer += data
+
+    def _pop_mbap(self, connection: _Connection) -> tuple[int, int, bytes] | None:
+        """Take a complete MBAP frame from the buffer: transaction id, unit id and PDU. An invalid
+        header means the stream is out of sync, the connection has to be reopened."""
+        buffer = connection.buffer
+        if len(buffer) < MBAP_BYTES:
+            return None
+        transaction_id, protocol, length, unit = struct.unpack_from(">HHHB", buffer)
+        # the length counts the unit id and the PDU, which has a function code at least
+        if protocol != 0 or length < 2:
+            raise ModbusException(f"Invalid MBAP header: protocol {protocol}, length {length}")
+        if len(buffer) < 6 + length:
+            return None
+        pdu = bytes(buffer[MBAP_BYTES:6 + length])
+        del buffer[:6 + length]
+        return transaction_id, unit, pdu
+
+    def _pop_rtu(self, connection: _Connection) -> bytes | None:
+        """Take a complete RTU frame from the buffer"""
+        buffer = connection.buffer
+        if len(buffer) < 3:
+            return None
+        length = response_length(buffer)
+        if len(buffer) < length:
+            return None
+        frame = bytes(buffer[:length])
+        del buffer[:length]
+        if crc16(frame[:-2]) != struct.unpack_from("<H", frame, length - 2)[0]:
+            raise ModbusCrcError("Invalid CRC")
+        return frame
+
+    def _fail(self, connection: _Connection, pending: dict, results: list, err: Exception) -> None:
+        """Close a broken connection and fail its pending requests. It is reopened by the next request."""
+        connection.close()
+        error = err if isinstance(err, ModbusException) else ModbusConnectionError(str(err))
+        for index, _, _ in pending.values():
+            results[index] = error
+        pending.clear()
+
+    def _send_requests(self, connection: _Connection, requests: list[tuple[int, int, bytes]],
+                       indexes: list[int], results: list, deadline: float) -> dict:
+        """Send the requests on a connection at once, returns the pending requests by their key."""
+        pending = {}
+        data = bytearray()
+        for index in indexes:
+            slave, function, payload = requests[index]
+            if self.rtu_framing:
+                data += build_frame(slave, function, payload)
+                key = index
+            else:
+                key = next(self._transaction_ids) & 0xFFFF
+                data += struct.pack(">HHHB", key, 0, len(payload) + 2, slave) + bytes((function,)) + payload
+            if slave == MODBUS_BROADCAST_ADDRESS:
+                results[index] = b""
+            else:
+                pending[key] = (index, slave, function)
+        try:
+            self._send(connection, data, deadline)
+        except (ModbusException, OSError) as err:
+            self._fail(connection, pending, results, err)
+        return pending
+
+    def _receive_responses(self, connection: _Connection, pending: dict, results: list) -> None:
+        """Match the complete responses in the buffer of a connection to the pending requests."""
+        while pending:
+            frame = self._pop_rtu(connection) if self.rtu_framing else self._pop_mbap(connection)
+            if frame is None:
+                return
+            if self.rtu_framing:
+                key, unit, pdu = next(iter(pending)), frame[0], frame[1:-2]
+            else:
+                key, unit, pdu = frame
+            if key not in pending:
+                # late response of an abandoned request
+                continue
+            index, slave, function = pending.pop(key)
+            if unit != slave:
+                results[index] = ModbusException(f"Response from unexpected slave {unit}")
+                continue
+            try:
+                results[index] = check_response(function, pdu)
+            except ModbusException as err:
+                results[index] = err
+
+    def _run_batch(self, requests: list[tuple[int, int, bytes]]) -> list:
+        """Run raw (slave, function, payload) requests, spread over the pooled connections. The
+        requests are sent on every connection first, then the responses are read as they arrive."""
+        self._clear_abort()
+        results = [None] * len(requests)
+        count = len(self._connections)
+        for chunk_start in range(0, len(requests), self.pipeline_depth):
+            chunk = range(chunk_start, min(chunk_start + self.pipeline_depth, len(requests)))
+            deadline = time.monotonic() + self.response_timeout * ((len(chunk) + count - 1) // count)
+            pendings = {}
+            for number, connection in enumerate(self._connections):
+                indexes = [index for index in chunk if index % count == number]
+                if indexes:
+                    pendings[connection] = self._send_requests(connection, requests, indexes, results, deadline)
+            while True:
+                waiting = [connection for connection, pending in pendings.items() if pending]
+                if not waiting:
+                    break
+                try:
+                    readable, _ = self._wait([connection.sock for connection in waiting], [], deadline)
+                except ModbusException as err:
+                    for connection in waiting:
+                        self._fail(connection, pendings[connection], results, err)
+                    break
+                for connection in waiting:
+                    if connection.sock not in readable:
+                        continue
+                    try:
+                        self._fill(connection)
+                        self._receive_responses(connection, pendings[connection], results)
+                    except (ModbusException, OSError) as err:
+                        self._fail(connection, pendings[connection], results, err)
+        return results
+
+    def _transaction(self, function: int, payload: bytes) -> bytes:
+        result = self._run_batch([(self.slave, function, payload)])[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def execute_many(self, requests: list[tuple[int, str, tuple]]) -> list[Any]:
+        encoded = [REQUESTS[name](*args) for _, name, args in requests]
+        raw = self._run_batch([(slave, function, payload)
+                               for (slave, _, _), (function, payload, _) in zip(requests, encoded)])
+        results = []
+        for result, (_, _, decode) in zip(raw, encoded):
+            if isinstance(result, Exception):
+                results.append(result)
+                continue
+            try:
+                results.append(decode(result))
+            except ModbusException as err:
+                results.append(err)
+        return results
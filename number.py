@@ -0,0 +1,30 @@
+from __future__ import annotations
+
+import logging
+
+from .const import DATA_ADD_ENTITIES, DOMAIN
+
+_LOGGER = logging.getLogger(__name__)
+
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers.entity_platform import AddEntitiesCallback
+from homeassistant.helpers.typing import ConfigType, DiscoveryInfoType
+
+
+async def async_setup_platform(hass: HomeAssistant, config: ConfigType,
+                               async_add_entities: AddEntitiesCallback,
+                               discovery_info: DiscoveryInfoType = None) -> None:
+
+    if not discovery_info:
+        return
+    # entities added by a reload of the config are added with the callback of the platform
+    hass.data.setdefault(DATA_ADD_ENTITIES, {})["number"] = async_add_entities
+
+    holdings = []
+    for port in hass.data[DOMAIN]:
+        for device in port.devices:
+            holdings.extend(holding for holding in device.holdings.values() if holding.writable)
+
+    if len(holdings) > 0:
+        async_add_entities(holdings)
+        _LOGGER.info(f"Holding register numbers added: {holdings}")
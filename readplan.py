@@ -0,0 +1,241 @@
+"""Read plan of the modbus devices. The configured addresses of a device table are grouped into
+the fewest read transactions, within the size limits of the protocol."""
+from __future__ import annotations
+
+from array import array
+from dataclasses import dataclass
+import struct
+from typing import Any, Final
+
+from .const import CONF_COILS, CONF_DISCRETE_INPUTS, CONF_HOLDINGS, CONF_INPUTS
+from .decoder import DATA_TYPES, BlockDecoder
+from .modbus_pdu import pack_bits, unpack_bits
+
+
+@dataclass
+class _TableAttributes:
+    """Attributes of a modbus table"""
+    function: str
+    max_count: int
+    bits: bool
+    gap: int
+
+
+# Table attributes by the config key of the points
+TABLES: Final = {
+    # coils (FC1), one bit per address
+    CONF_COILS: _TableAttributes(function="read_bits_into", max_count=2000, bits=True, gap=128),
+    # discrete inputs (FC2), one bit per address
+    CONF_DISCRETE_INPUTS: _TableAttributes(function="read_input_bits_into", max_count=2000, bits=True, gap=128),
+    # input registers (FC4), two bytes per address
+    CONF_INPUTS: _TableAttributes(function="read_input_registers_into", max_count=125, bits=False, gap=8),
+    # holding registers (FC3), two bytes per address
+    CONF_HOLDINGS: _TableAttributes(function="read_registers_into", max_count=125, bits=False, gap=8),
+}
+
+# bytes of a read request: slave, function, address, count, crc
+REQUEST_BYTES: Final = 8
+# bytes of a read response without the data: slave, function, byte count, crc
+RESPONSE_BYTES: Final = 5
+
+
+class ReadBlock:
+    """A range of a device table read with one modbus transaction. Holds the configured points
+    of the range, its poll schedule and the buffer the driver reads into. The buffer is reused
+    by every read of the block, so it is valid until the next read. The register points are
+    decoded from the buffer by the decoder of the block.
+
+    The points are compiled into a table: the entities in address order, their offsets in the
+    block and the index of the point at each offset, so the changed addresses of a read map to
+    the changed points without a lookup per address."""
+
+    def __init__(self, device: Any, table: str, interval: int, start: int, count: int,
+                 points: dict[int, Any]):
+        self.device = device
+        self.table = table
+        self.interval = interval
+        self.start = start
+        self.count = count
+        addresses = sorted(points)
+        self.entities = tuple(points[addr] for addr in addresses)
+        self.offsets = array("H", [addr - start for addr in addresses])
+        # index of the point at each offset, -1 for the unused addresses
+        self._point_at = array("h", [-1]) * count
+        self._overlapping = False
+        for index, (offset, point) in enumerate(zip(self.offsets, self.entities)):
+            for at in range(offset, offset + point_size(table, point)):
+                if self._point_at[at] >= 0:
+                    self._overlapping = True
+                else:
+                    self._point_at[at] = index
+        if TABLES[table].bits:
+            self.buffer = bytearray(count)
+            self.decoder = None
+        else:
+            self.buffer = array("H", bytes(count * 2))
+            self.decoder = BlockDecoder(start, count, points)
+        # copy of the buffer at the last applied read, see changed
+        self._previous = self.buffer[:]
+        self._previous_valid = False
+        # the buffer holds a read or a restored state, and the state is restored, not read yet
+        self.valid = False
+        self.restored = False
+        self.next_due = 0.0
+        self.polling = False
+        # indices of the points decoded on every read, not only on change, see sampled_values
+        self.sampled = ()
+
+    def __str__(self):
+        return (f"<ReadBlock {self.device.port.name}:{self.device.slave_id} {self.table} "
+                f"from:{self.start} count:{self.count} every {self.interval}s>")
+
+    @property
+    def function(self) -> str:
+        """Name of the driver method reading into a buffer"""
+        return TABLES[self.table].function
+
+    @property
+    def request(self) -> tuple[int, str, tuple]:
+        """Modbus request reading the block into its buffer"""
+        return self.device.slave_id, TABLES[self.table].function, (self.start, self.count, self.buffer)
+
+    def changes(self, force: bool = False) -> list[tuple[Any, Any]]:
+        """(point, value) pairs of the points changed since the last applied read, all of them if
+        forced or there is no applied read. The buffer is remembered as the last applied read."""
+        if not force and self._previous_valid:
+            if self._previous == self.buffer:
+                return []
+            indices = None if self._overlapping else self._changed_indices()
+        else:
+            indices = None
+        self._previous[:] = self.buffer
+        self._previous_valid = True
+        if self.decoder is not None:
+            return self.decoder.decode(self.buffer, indices)
+        entities = self.entities
+        offsets = self.offsets
+        buffer = self.buffer
+        if indices is None:
+            indices = range(len(entities))
+        return [(entities[i], bool(buffer[offsets[i]])) for i in indices]
+
+    def _changed_indices(self) -> list[int]:
+        """Indices of the points with a changed address since the last applied read. The buffers
+        are compared as one integer, its set bits give the changed addresses."""
+        # bits per address in the buffers: a byte per coil, a word per register
+        width = 8 if self.decoder is None else 16
+        diff = (int.from_bytes(memoryview(self.buffer).cast("B"), "little")
+                ^ int.from_bytes(memoryview(self._previous).cast("B"), "little"))
+        point_at = self._point_at
+        indices = []
+        while diff:
+            offset = ((diff & -diff).bit_length() - 1) // width
+            index = point_at[offset]
+            if index >= 0 and (not indices or indices[-1] != index):
+                indices.append(index)
+            diff &= -1 << ((offset + 1) * width)
+        return indices
+
+    def invalidate(self) -> None:
+        """Apply the next read, even if it is the same as the last one"""
+        self._previous_valid = False
+
+    @property
+    def key(self) -> str:
+        """Key of the block in the snapshot, a block of another range doesn't match it"""
+        return f"{self.device.slave_id}/{self.table}/{self.start}/{self.count}"
+
+    def snapshot(self) -> str:
+        """The buffer as hex string: packed bits or big endian registers"""
+        if self.decoder is None:
+            return pack_bits(self.buffer).hex()
+        return struct.pack(f">{self.count}H", *self.buffer).hex()
+
+    def restore(self, data: str) -> bool:
+        """Fill the buffer from a snapshot, returns False if the snapshot doesn't fit the block."""
+        try:
+            raw = bytes.fromhex(data)
+        except (TypeError, ValueError):
+            return False
+        if self.decoder is None:
+            if len(raw) != (self.count + 7) // 8:
+                return False
+            self.buffer[:] = bytes(unpack_bits(raw, self.count))
+        else:
+            if len(raw) != self.count * 2:
+                return False
+            self.buffer[:] = array("H", struct.unpack(f">{self.count}H", raw))
+        self.valid = True
+        self.restored = True
+        return True
+
+    def values(self) -> list[tuple[Any, Any]]:
+        """(point, value) pairs of the points from the last read of the block"""
+        if self.decoder is None:
+            buffer = self.buffer
+            return [(point, bool(buffer[offset])) for point, offset in zip(self.entities, self.offsets)]
+        return self.decoder.decode(self.buffer)
+
+    def sampled_values(self) -> list[tuple[Any, Any]]:
+        """(point, value) pairs of the sampled points from the last read of the block"""
+        if self.decoder is None:
+            buffer = self.buffer
+            return [(self.entities[i], bool(buffer[self.offsets[i]])) for i in self.sampled]
+        return self.decoder.decode(self.buffer, self.sampled)
+
+    @property
+    def frame_bytes(self) -> int:
+        """Bytes of the request and the response on the wire"""
+        if TABLES[self.table].bits:
+            data = (self.count + 7) // 8
+        else:
+            data = self.count * 2
+        return REQUEST_BYTES + RESPONSE_BYTES + data
+
+
+def point_size(table: str, point: Any) -> int:
+    """Count of addresses used by a point, a register point can span more registers"""
+    return 1 if TABLES[table].bits else DATA_TYPES[point.data_type].size
+
+
+def plan_table(device: Any, table: str, interval: int, points: dict[int, Any],
+               gap: int | None = None) -> list[ReadBlock]:
+    """Split the points of a table into read blocks. Neighbouring addresses are read together
+    if at most gap unused addresses are between them and the block fits in one frame."""
+    attrs = TABLES[table]
+    if gap is None:
+        gap = attrs.gap
+    blocks = []
+    block_points = {}
+    start = end = None
+    for addr in sorted(points):
+        last = addr + point_size(table, points[addr]) - 1
+        if start is not None and addr - end - 1 <= gap and last + 1 - start <= attrs.max_count:
+            end = max(end, last)
+        else:
+            if start is not None:
+                blocks.append(ReadBlock(device, table, interval, start, end + 1 - start, block_points))
+            block_points = {}
+            start, end = addr, last
+        block_points[addr] = points[addr]
+    if start is not None:
+        blocks.append(ReadBlock(device, table, interval, start, end + 1 - start, block_points))
+    return blocks
+
+
+def plan_device(device: Any, tables: dict[str, dict[int, Any]], gap: int | None = None) -> list[ReadBlock]:
+    """Build the read blocks of a device. The points of a table are planned separately for each
+    poll interval, the interval of a point is given by its autoupdate attribute."""
+    blocks = []
+    for table, points in tables.items():
+        by_interval = {}
+        for addr, point in points.items():
+            by_interval.setdefault(point.autoupdate, {})[addr] = point
+        for interval, interval_points in sorted(by_interval.items()):
+            blocks.extend(plan_table(device, table, interval, interval_points, gap))
+    return blocks
+
+
+def plan_cost(blocks: list[ReadBlock]) -> tuple[int, int]:
+    """Frame count and byte count on the wire of reading all blocks once."""
+    return len(blocks), sum(block.frame_bytes for block in blocks)
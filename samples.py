@@ -0,0 +1,66 @@
+"""Recent samples of the register points polled at a high rate. The samples of a point are kept
+in a fixed size ring buffer, and only an aggregate of them is published as the entity state, so
+the fast polling doesn't write every sample into the recorder of Home Assistant."""
+from __future__ import annotations
+
+from array import array
+from typing import Final
+
+# aggregates of the samples within the aggregation interval
+AGGREGATES: Final = ("mean", "min", "max")
+
+
+class SampleBuffer:
+    """Ring buffer of (time, value) samples in two arrays of doubles. When full, a new sample
+    overwrites the oldest one."""
+
+    __slots__ = ("times", "values", "count", "_next")
+
+    def __init__(self, size: int):
+        self.times = array("d", bytes(8 * size))
+        self.values = array("d", bytes(8 * size))
+        self.count = 0
+        # index of the next sample
+        self._next = 0
+
+    def __len__(self):
+        return self.count
+
+    def add(self, timestamp: float, value: float) -> None:
+        index = self._next
+        self.times[index] = timestamp
+        self.values[index] = value
+        self._next = (index + 1) % len(self.times)
+        if self.count < len(self.times):
+            self.count += 1
+
+    def _indices(self) -> range:
+        """Indices of the samples from the oldest to the newest, modulo the size"""
+        return range(self._next - self.count, self._next)
+
+    def window(self, since: float) -> list[float]:
+        """Values of the samples taken at or after since, from the newest one back"""
+        size = len(self.times)
+        values = []
+        for index in reversed(self._indices()):
+            index %= size
+            if self.times[index] < since:
+                break
+            values.append(self.values[index])
+        return values
+
+    def aggregate(self, kind: str, since: float) -> float | None:
+        """Aggregate of the samples taken at or after since, None if there is none"""
+        values = self.window(since)
+        if not values:
+            return None
+        if kind == "min":
+            return min(values)
+        if kind == "max":
+            return max(values)
+        return sum(values) / len(values)
+
+    def as_list(self) -> list[tuple[float, float]]:
+        """The samples from the oldest to the newest"""
+        size = len(self.times)
+        return [(self.times[index % size], self.values[index % size]) for index in self._indices()]
@@ -0,0 +1,146 @@
+"""Discovery of the slaves on the bus of a port. A sweep probes the slave ids with a short response
+timeout, then the coil, discrete input, input register and holding register ranges of the
+responding slaves are measured. The found topology is cached in the storage of Home Assistant,
+so a later start only verifies the known slaves instead of sweeping the bus again."""
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import Any
+
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers.storage import Store
+
+from .bus import ModbusBus
+from .const import *
+from .exceptions import ModbusException, ModbusExceptionResponse
+from .readplan import TABLES
+
+_LOGGER = logging.getLogger(__name__)
+
+STORAGE_KEY: Final = f"{DOMAIN}.topology"
+STORAGE_VERSION: Final = 1
+
+# any response to the probe, even an exception response, tells that the slave is there
+_PROBE: Final = ("read_bits", 0, 1)
+
+# the tables measured by the scan and the reads used for them, the ranges start at address 0
+_TABLE_READS: Final = {
+    CONF_COILS: "read_bits",
+    CONF_DISCRETE_INPUTS: "read_input_bits",
+    CONF_INPUTS: "read_input_registers",
+    CONF_HOLDINGS: "read_registers",
+}
+
+
+class Topology:
+    """Cached topology of the ports: the found slaves with the sizes of their tables"""
+
+    def __init__(self, hass: HomeAssistant):
+        self._store = Store(hass, STORAGE_VERSION, STORAGE_KEY)
+        self.data: dict[str, dict[str, Any]] = {}
+
+    async def async_load(self) -> None:
+        self.data = await self._store.async_load() or {}
+
+    def slaves(self, port_name: str) -> dict[int, dict[str, Any]] | None:
+        """The cached slaves of a port by slave id, None if the port was not scanned"""
+        if port_name not in self.data:
+            return None
+        return {int(slave_id): slave for slave_id, slave in self.data[port_name]["slaves"].items()}
+
+    async def async_save(self, port_name: str, slaves: dict[int, dict[str, Any]]) -> None:
+        self.data[port_name] = {
+            "time": time.time(),
+            "slaves": {str(slave_id): slave for slave_id, slave in sorted(slaves.items())},
+        }
+        await self._store.async_save(self.data)
+
+
+class BusScanner:
+    """Probes the slaves of a bus with scan priority, so the polls and writes of the port go first.
+    The unconfigured slaves are probed with the probe timeout, the configured ones with their own.
+    A missing slave is no failure: the requests to the unconfigured slaves are left out of the
+    metrics and of the slave health, so their backoff can't hide a new slave."""
+
+    def __init__(self, bus: ModbusBus, configured: set[int], probe_timeout: float):
+        self._bus = bus
+        self._configured = configured
+        self._probe_timeout = probe_timeout
+
+    async def _async_probe(self, slave_ids: list[int]) -> list[int]:
+        """The responding slaves of the given ones. The probes are queued together, so a driver
+        with pipelining has several of them in flight."""
+        results = await self._bus.async_cycle(
+            [(slave_id, _PROBE[0], _PROBE[1:]) for slave_id in slave_ids], PRIORITY_SCAN,
+            untracked=self._unconfigured(slave_ids))
+        return [
+            slave_id for slave_id, result in zip(slave_ids, results)
+            if not isinstance(result, Exception) or isinstance(result, ModbusExceptionResponse)
+        ]
+
+    def _unconfigured(self, slave_ids: list[int]) -> set[int]:
+        return {slave_id for slave_id in slave_ids if slave_id not in self._configured}
+
+    def _set_probe_timeouts(self, slave_ids: list[int]) -> None:
+        for slave_id in self._unconfigured(slave_ids):
+            self._bus.response_timeouts[slave_id] = self._probe_timeout
+
+    def _clear_probe_timeouts(self, slave_ids: list[int]) -> None:
+        for slave_id in self._unconfigured(slave_ids):
+            self._bus.response_timeouts.pop(slave_id, None)
+
+    async def _async_table_size(self, slave_id: int, table: str) -> int:
+        """Count of the readable addresses of a table from address 0, by binary search"""
+        function = _TABLE_READS[table]
+        tracked = slave_id in self._configured
+        # most slaves have no table of one of the kinds, these are found with one request
+        try:
+            await self._bus.async_request(slave_id, function, 0, 1, priority=PRIORITY_SCAN, tracked=tracked)
+        except ModbusException:
+            return 0
+        low, high = 1, TABLES[table].max_count
+        while low < high:
+            count = (low + high + 1) // 2
+            try:
+                await self._bus.async_request(slave_id, function, 0, count, priority=PRIORITY_SCAN,
+                                              tracked=tracked)
+            except ModbusExceptionResponse:
+                high = count - 1
+            except ModbusException as err:
+                _LOGGER.warning(f"Scan of the {table} of slave {slave_id} stopped at {low}: {err}")
+                break
+            else:
+                low = count
+        return low
+
+    async def _async_describe(self, slave_id: int) -> dict[str, Any]:
+        sizes = await asyncio.gather(*(self._async_table_size(slave_id, table) for table in _TABLE_READS))
+        return {"present": True, **dict(zip(_TABLE_READS, sizes))}
+
+    async def async_scan(self, slave_ids: list[int]) -> dict[int, dict[str, Any]]:
+        """Sweep the slave ids and measure the tables of the responding slaves"""
+        start = time.monotonic()
+        self._set_probe_timeouts(slave_ids)
+        try:
+            found = await self._async_probe(slave_ids)
+            descriptions = await asyncio.gather(*(self._async_describe(slave_id) for slave_id in found))
+        finally:
+            self._clear_probe_timeouts(slave_ids)
+        _LOGGER.info(f"{self._bus} scan of {len(slave_ids)} slave ids found {len(found)} slaves "
+                     f"in {time.monotonic() - start:.1f} s")
+        return dict(zip(found, descriptions))
+
+    async def async_verify(self, slaves: dict[int, dict[str, Any]]) -> dict[int, dict[str, Any]]:
+        """Probe the known slaves only and update their presence"""
+        self._set_probe_timeouts(list(slaves))
+        try:
+            found = set(await self._async_probe(sorted(slaves)))
+        finally:
+            self._clear_probe_timeouts(list(slaves))
+        for slave_id, slave in slaves.items():
+            slave["present"] = slave_id in found
+            if not slave["present"]:
+                _LOGGER.warning(f"{self._bus} slave {slave_id} of the cached topology doesn't respond")
+        return slaves
@@ -2,7 +2,7 @@ from __future__ import annotations
 
 import logging
 
-from .const import DOMAIN
+from .const import DATA_ADD_ENTITIES, DOMAIN
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -17,12 +17,20 @@ async def async_setup_platform(hass: HomeAssistant, config: ConfigType,
 
     if not discovery_info:
         return
+    # entities added by a reload of the config are added with the callback of the platform
+    hass.data.setdefault(DATA_ADD_ENTITIES, {})["sensor"] = async_add_entities
 
     inputs = []
+    metrics = []
     for port in hass.data[DOMAIN]:
         for device in port.devices:
             inputs.extend(device.inputs.values())
+            inputs.extend(holding for holding in device.holdings.values() if not holding.writable)
+        metrics.extend(port.metric_entities)
 
     if len(inputs) > 0:
         async_add_entities(inputs)
         _LOGGER.info(f"Input sensors added: {inputs}")
+    if len(metrics) > 0:
+        async_add_entities(metrics)
+        _LOGGER.info(f"Diagnostic sensors added: {len(metrics)}")
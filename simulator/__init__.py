@@ -0,0 +1,21 @@
+"""Modbus slave simulator to run the integration without hardware. The slaves are configured
+like the devices of a port in modbus_sw.yaml, see slave.py for the simulation keys."""
+from __future__ import annotations
+
+from typing import Any
+
+import yaml
+
+from .rtu import PtySimulator
+from .slave import SimulatedSlave
+from .tcp import TcpSimulator
+
+
+def load_devices(path: str, port_name: str) -> list[dict[str, Any]]:
+    """Device configs of a port from a modbus_sw.yaml file"""
+    with open(path, encoding="utf-8") as file:
+        ports = yaml.safe_load(file)
+    for port in ports:
+        if port["name"] == port_name:
+            return port.get("devices") or []
+    raise KeyError(f"No port {port_name} in {path}")
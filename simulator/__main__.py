@@ -0,0 +1,35 @@
+"""Run the simulated slaves of a port from modbus_sw.yaml until interrupted. Point the port of the
+integration to the printed pty path with driver: serial (or to the TCP address with driver: tcp)."""
+from __future__ import annotations
+
+import argparse
+import signal
+
+from . import PtySimulator, TcpSimulator, load_devices
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("config", help="modbus_sw.yaml file")
+    parser.add_argument("port", help="name of the port to simulate")
+    parser.add_argument("--baudrate", type=int, help="simulate the transmission time at this baud rate")
+    parser.add_argument("--tcp", type=int, metavar="PORT", help="serve modbus TCP on this port instead of a pty")
+    args = parser.parse_args()
+
+    devices = load_devices(args.config, args.port)
+    if args.tcp is not None:
+        simulator = TcpSimulator(devices, port=args.tcp)
+        address = f"{simulator.host}:{simulator.port}"
+    else:
+        simulator = PtySimulator(devices, args.baudrate)
+        address = simulator.port
+    with simulator:
+        print(f"{len(devices)} slaves of {args.port} on {address}", flush=True)
+        try:
+            signal.pause()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""Modbus RTU bus simulated over a pseudo-terminal. The integration opens the slave side of the
+pty like a serial port (driver: serial), the simulated slaves answer on the master side."""
+from __future__ import annotations
+
+import errno
+import logging
+import os
+import select
+import struct
+import threading
+import time
+import tty
+from typing import Any
+
+from ..modbus_pdu import (
+    MODBUS_BROADCAST_ADDRESS,
+    WRITE_AND_READ_REGISTERS,
+    WRITE_MULTIPLE_COILS,
+    WRITE_MULTIPLE_REGISTERS,
+)
+from ..modbus_serial import build_frame, crc16
+from .slave import SimulatedSlave
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def request_length(buffer: bytes) -> int | None:
+    """Full length of a RTU request frame from its beginning, None if more bytes are needed"""
+    if len(buffer) < 2:
+        return None
+    function = buffer[1]
+    if function in (WRITE_MULTIPLE_COILS, WRITE_MULTIPLE_REGISTERS):
+        return 7 + buffer[6] + 2 if len(buffer) > 6 else None
+    if function == WRITE_AND_READ_REGISTERS:
+        return 11 + buffer[10] + 2 if len(buffer) > 10 else None
+    return 8
+
+
+class PtySimulator:
+    """RTU bus with simulated slaves on a pseudo-terminal. The slave side of the pty is given by
+    the port attribute. With a baud rate the transmission time of the frames is simulated too."""
+
+    def __init__(self, devices: list[dict[str, Any]], baudrate: int | None = None, seed: int | None = None):
+        self.slaves = {config["slave_id"]: SimulatedSlave(config, seed) for config in devices}
+        self.baudrate = baudrate
+        self.frames = 0
+        self.crc_errors = 0
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._master)
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        self._stop_read, self._stop_write = os.pipe()
+        self._thread = None
+
+    def __str__(self):
+        return f"<PtySimulator {self.port}>"
+
+    def __enter__(self) -> PtySimulator:
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=f"simulator-{self.port}", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            os.write(self._stop_write, b"\0")
+            self._thread.join()
+            self._thread = None
+            for fd in (self._master, self._slave, self._stop_read, self._stop_write):
+                os.close(fd)
+
+    def _wire_time(self, size: int) -> float:
+        # 11 bits per character: start, 8 data, parity or second stop, stop
+        return size * 11 / self.baudrate if self.baudrate else 0
+
+    def _run(self) -> None:
+        buffer = bytearray()
+        while True:
+            # a partial frame is dropped after a silence, like by a real slave
+            timeout = 0.05 if buffer else None
+            ready, _, _ = select.select([self._master, self._stop_read], [], [], timeout)
+            if self._stop_read in ready:
+                return
+            if not ready:
+                buffer.clear()
+                continue
+            try:
+                buffer += os.read(self._master, 512)
+            except OSError as err:
+                if err.errno != errno.EIO:
+                    raise
+                time.sleep(0.01)
+                continue
+            while True:
+                length = request_length(buffer)
+                if length is None or len(buffer) < length:
+                    break
+                frame = bytes(buffer[:length])
+                del buffer[:length]
+                self._handle_frame(frame)
+
+    def _handle_frame(self, frame: bytes) -> None:
+        self.frames += 1
+        if crc16(frame[:-2]) != struct.unpack_from("<H", frame, len(frame) - 2)[0]:
+            self.crc_errors += 1
+            return
+        slave_id, function = frame[0], frame[1]
+        targets = list(self.slaves.values()) if slave_id == MODBUS_BROADCAST_ADDRESS else [self.slaves.get(slave_id)]
+        for slave in targets:
+            if slave is None or slave.drop():
+                continue
+            response = slave.handle(function, frame[2:-2])
+            if slave_id == MODBUS_BROADCAST_ADDRESS:
+                continue
+            time.sleep(self._wire_time(len(frame)) + slave.latency)
+            response = build_frame(slave_id, response[0], response[1:])
+            if slave.corrupt():
+                response = response[:-1] + bytes((response[-1] ^ 0xFF,))
+            time.sleep(self._wire_time(len(response)))
+            os.write(self._master, response)
@@ -0,0 +1,157 @@
+"""Simulated modbus slave. The slave is described like a device of modbus_sw.yaml, with some
+extra keys for the simulation:
+
+    - device_id: modbus_sw_2
+      slave_id: 2
+      coils:
+        - name: szoba2_jobb
+          id: 0
+      inputs:
+        - name: modbus_sw_2_temp
+          id: 1
+          mode: temperature
+          value: 215        # raw register value, optional
+      latency: 5            # response latency in ms, optional
+      drop_rate: 0.0        # probability of not answering a request, optional
+      crc_error_rate: 0.0   # probability of answering with a bad CRC, optional
+"""
+from __future__ import annotations
+
+import random
+import struct
+from array import array
+from typing import Any
+
+from ..modbus_pdu import (
+    READ_COILS,
+    READ_DISCRETE_INPUTS,
+    READ_HOLDING_REGISTERS,
+    READ_INPUT_REGISTERS,
+    WRITE_AND_READ_REGISTERS,
+    WRITE_MULTIPLE_COILS,
+    WRITE_MULTIPLE_REGISTERS,
+    WRITE_SINGLE_COIL,
+    WRITE_SINGLE_REGISTER,
+    pack_bits,
+    unpack_bits,
+)
+
+# exception codes
+ILLEGAL_FUNCTION = 0x01
+ILLEGAL_DATA_ADDRESS = 0x02
+ILLEGAL_DATA_VALUE = 0x03
+
+
+class _Exception(Exception):
+    """Raised by a handler to answer with an exception response"""
+
+    def __init__(self, code: int):
+        super().__init__(code)
+        self.code = code
+
+
+def _table_size(entries: list[dict] | None, minimum: int) -> int:
+    ids = [entry["id"] for entry in entries or []]
+    return max(ids + [minimum - 1]) + 1
+
+
+class SimulatedSlave:
+    """Memory and behaviour of a simulated slave. The tables are sized to the configured points,
+    reading past them gives an illegal data address exception like a real device."""
+
+    def __init__(self, config: dict[str, Any], seed: int | None = None):
+        self.slave_id = config["slave_id"]
+        self.latency = config.get("latency", 0) / 1000
+        self.drop_rate = config.get("drop_rate", 0.0)
+        self.crc_error_rate = config.get("crc_error_rate", 0.0)
+        self.coils = bytearray(_table_size(config.get("coils"), 8))
+        self.discrete_inputs = bytearray(_table_size(config.get("discrete_inputs"), 8))
+        self.holding_registers = array("H", bytes(2 * _table_size(config.get("holdings"), 8)))
+        self.input_registers = array("H", bytes(2 * _table_size(config.get("inputs"), 8)))
+        for entry in config.get("inputs") or []:
+            self.input_registers[entry["id"]] = entry.get("value", 0) & 0xFFFF
+        for entry in config.get("holdings") or []:
+            self.holding_registers[entry["id"]] = entry.get("value", 0) & 0xFFFF
+        for entry in config.get("discrete_inputs") or []:
+            self.discrete_inputs[entry["id"]] = 1 if entry.get("value") else 0
+        self.requests = 0
+        self._random = random.Random(seed)
+
+    def __str__(self):
+        return f"<SimulatedSlave {self.slave_id}>"
+
+    def drop(self) -> bool:
+        """Whether the current request is left without answer"""
+        return self.drop_rate > 0 and self._random.random() < self.drop_rate
+
+    def corrupt(self) -> bool:
+        """Whether the answer of the current request gets a bad CRC"""
+        return self.crc_error_rate > 0 and self._random.random() < self.crc_error_rate
+
+    @staticmethod
+    def _check_range(table, addr: int, count: int, maximum: int) -> None:
+        if not 1 <= count <= maximum:
+            raise _Exception(ILLEGAL_DATA_VALUE)
+        if addr + count > len(table):
+            raise _Exception(ILLEGAL_DATA_ADDRESS)
+
+    def _read_bits(self, table: bytearray, data: bytes) -> bytes:
+        addr, count = struct.unpack_from(">HH", data)
+        self._check_range(table, addr, count, 2000)
+        packed = pack_bits(table[addr:addr + count])
+        return bytes((len(packed),)) + packed
+
+    def _read_registers(self, table: array, data: bytes) -> bytes:
+        addr, count = struct.unpack_from(">HH", data)
+        self._check_range(table, addr, count, 125)
+        return struct.pack(f">B{count}H", count * 2, *table[addr:addr + count])
+
+    def _write_registers(self, addr: int, count: int, data: bytes, offset: int) -> None:
+        self._check_range(self.holding_registers, addr, count, 123)
+        self.holding_registers[addr:addr + count] = array("H", struct.unpack_from(f">{count}H", data, offset))
+
+    def handle(self, function: int, data: bytes) -> bytes:
+        """Answer a request PDU, returns the response PDU"""
+        self.requests += 1
+        try:
+            return bytes((function,)) + self._handle(function, data)
+        except _Exception as err:
+            return bytes((function | 0x80, err.code))
+        except (struct.error, IndexError):
+            return bytes((function | 0x80, ILLEGAL_DATA_VALUE))
+
+    def _handle(self, function: int, data: bytes) -> bytes:
+        if function == READ_COILS:
+            return self._read_bits(self.coils, data)
+        if function == READ_DISCRETE_INPUTS:
+            return self._read_bits(self.discrete_inputs, data)
+        if function == READ_HOLDING_REGISTERS:
+            return self._read_registers(self.holding_registers, data)
+        if function == READ_INPUT_REGISTERS:
+            return self._read_registers(self.input_registers, data)
+        if function == WRITE_SINGLE_COIL:
+            addr, value = struct.unpack_from(">HH", data)
+            self._check_range(self.coils, addr, 1, 1)
+            if value not in (0, 0xFF00):
+                raise _Exception(ILLEGAL_DATA_VALUE)
+            self.coils[addr] = 1 if value else 0
+            return data[:4]
+        if function == WRITE_SINGLE_REGISTER:
+            addr, value = struct.unpack_from(">HH", data)
+            self._check_range(self.holding_registers, addr, 1, 1)
+            self.holding_registers[addr] = value
+            return data[:4]
+        if function == WRITE_MULTIPLE_COILS:
+            addr, count = struct.unpack_from(">HH", data)
+            self._check_range(self.coils, addr, count, 1968)
+            self.coils[addr:addr + count] = bytes(unpack_bits(data[5:], count))
+            return data[:4]
+        if function == WRITE_MULTIPLE_REGISTERS:
+            addr, count = struct.unpack_from(">HH", data)
+            self._write_registers(addr, count, data, 5)
+            return data[:4]
+        if function == WRITE_AND_READ_REGISTERS:
+            read_addr, read_count, write_addr, write_count = struct.unpack_from(">HHHH", data)
+            self._write_registers(write_addr, write_count, data, 9)
+            return self._read_registers(self.holding_registers, struct.pack(">HH", read_addr, read_count))
+        raise _Exception(ILLEGAL_FUNCTION)
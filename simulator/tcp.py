@@ -0,0 +1,89 @@
+"""Modbus TCP server with simulated slaves, addressed by the unit id of the requests."""
+from __future__ import annotations
+
+import socket
+import socketserver
+import struct
+import threading
+import time
+from typing import Any
+
+from ..modbus_pdu import MODBUS_BROADCAST_ADDRESS
+from .slave import SimulatedSlave
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self) -> None:
+        simulator: TcpSimulator = self.server.simulator
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        buffer = bytearray()
+        while True:
+            data = self.request.recv(4096)
+            if not data:
+                return
+            buffer += data
+            while len(buffer) >= 7:
+                transaction_id, _, length, unit = struct.unpack_from(">HHHB", buffer)
+                if len(buffer) < 6 + length:
+                    break
+                pdu = bytes(buffer[7:6 + length])
+                del buffer[:6 + length]
+                response = simulator.handle(unit, pdu)
+                if response is not None:
+                    self.request.sendall(struct.pack(">HHHB", transaction_id, 0, len(response) + 1, unit) + response)
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class TcpSimulator:
+    """Modbus TCP server on localhost with simulated slaves. The listening address is given by
+    the host and port attributes."""
+
+    def __init__(self, devices: list[dict[str, Any]], host: str = "127.0.0.1", port: int = 0,
+                 seed: int | None = None):
+        self.slaves = {config["slave_id"]: SimulatedSlave(config, seed) for config in devices}
+        self._server = _Server((host, port), _Handler)
+        self._server.simulator = self
+        self.host, self.port = self._server.server_address[:2]
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def __str__(self):
+        return f"<TcpSimulator {self.host}:{self.port}>"
+
+    def __enter__(self) -> TcpSimulator:
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._server.serve_forever, name=f"simulator-{self.port}",
+                                            daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+            self._thread = None
+
+    def handle(self, unit: int, pdu: bytes) -> bytes | None:
+        """Answer a request PDU, None if no answer is sent"""
+        slave = self.slaves.get(unit)
+        if unit == MODBUS_BROADCAST_ADDRESS:
+            with self._lock:
+                for target in self.slaves.values():
+                    target.handle(pdu[0], pdu[1:])
+            return None
+        if slave is None or slave.drop():
+            return None
+        time.sleep(slave.latency)
+        with self._lock:
+            return slave.handle(pdu[0], pdu[1:])
@@ -0,0 +1,46 @@
+"""Snapshot of the last known state of the ports, so the entities have their state right after a
+restart instead of waiting for the first poll. The buffers of the read blocks are saved in the
+storage of Home Assistant, which writes the file atomically."""
+from __future__ import annotations
+
+import logging
+from typing import Any
+
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.storage import Store
+
+from .const import *
+
+_LOGGER = logging.getLogger(__name__)
+
+STORAGE_KEY: Final = f"{DOMAIN}.snapshot"
+STORAGE_VERSION: Final = 1
+
+
+class Snapshot:
+    """Last known buffers of the read blocks of the ports by port name. Saved with a delay after
+    a change, a save pending at shutdown is written by the store on the final write of ha."""
+
+    def __init__(self, hass: HomeAssistant):
+        self._store = Store(hass, STORAGE_VERSION, STORAGE_KEY)
+        self.ports = []
+        self.data: dict[str, dict[str, str]] = {}
+
+    async def async_load(self) -> None:
+        self.data = await self._store.async_load() or {}
+        _LOGGER.debug(f"Snapshot of {len(self.data)} ports loaded")
+
+    @callback
+    def remove(self, port: Any) -> None:
+        """Forget a port removed by a reload, a port of the same name replacing it restores the saved state"""
+        self.ports.remove(port)
+
+    @callback
+    def schedule_save(self) -> None:
+        self._store.async_delay_save(self._collect, SNAPSHOT_DELAY)
+
+    @callback
+    def _collect(self) -> dict[str, Any]:
+        for port in self.ports:
+            self.data[port.name] = port.snapshot()
+        return self.data
@@ -2,7 +2,7 @@ from __future__ import annotations
 
 import logging
 
-from .const import DOMAIN
+from .const import DATA_ADD_ENTITIES, DOMAIN
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -17,6 +17,8 @@ async def async_setup_platform(hass: HomeAssistant, config: ConfigType,
 
     if not discovery_info:
         return
+    # entities added by a reload of the config are added with the callback of the platform
+    hass.data.setdefault(DATA_ADD_ENTITIES, {})["switch"] = async_add_entities
 
     coils = []
     for port in hass.data[DOMAIN]:
@@ -0,0 +1,33 @@
+"""Configs of the ports and devices of the tests, as given by the config schemas with the defaults
+filled in"""
+from __future__ import annotations
+
+from typing import Any
+
+from modbus_sw.const import SAMPLE_BUFFER
+
+
+def register_config(id: int, name: str, mode: str = "temperature", **options) -> dict[str, Any]:
+    return {
+        "id": id, "name": name, "mode": mode, "word_order": "big", "offset": 0, "deadband": 0,
+        "relative_deadband": 0, "aggregate_interval": 60, "samples": SAMPLE_BUFFER, **options,
+    }
+
+
+def device_config(slave_id: int, coils: int = 0, temperature: bool = False, **tables) -> dict[str, Any]:
+    inputs = [register_config(1, f"temperature_{slave_id}")] if temperature else []
+    return {
+        "device_id": f"modbus_sw_{slave_id}",
+        "slave_id": slave_id,
+        "coils": [{"id": id, "name": f"coil_{slave_id}_{id}"} for id in range(coils)],
+        "inputs": inputs,
+        **tables,
+    }
+
+
+def port_config(port: str, devices: list[dict[str, Any]], **options) -> dict[str, Any]:
+    return {
+        "name": "port1", "port": port, "driver": "serial", "connections": 1, "baudrate": 9600, "stopbits": 1,
+        "bytesize": 8, "parity": "N", "rtsmode": "U", "rtsdelay": 100, "write_window": 20, "autoupdate": 30,
+        "discovery": False, "broadcast": False, "broadcast_delay": 5, "devices": devices, **options,
+    }
@@ -0,0 +1,111 @@
+"""Test setup. The integration is imported as the modbus_sw package from this repository, without
+running its __init__ (the config schemas need Home Assistant). If Home Assistant is not installed,
+its modules used by the port are replaced by minimal stand-ins, enough to run the drivers, the bus
+and ModbusPort against the simulators."""
+from __future__ import annotations
+
+import asyncio
+import importlib.util
+import os
+import sys
+import types
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DOMAIN = "modbus_sw"
+
+
+def _module(name: str, **attributes) -> types.ModuleType:
+    module = sys.modules.get(name)
+    if module is None:
+        module = sys.modules[name] = types.ModuleType(name)
+        parent, _, child = name.rpartition(".")
+        if parent:
+            setattr(_module(parent), child, module)
+    module.__dict__.update(attributes)
+    return module
+
+
+class _Entity:
+    """Stand-in of the Home Assistant entity, the state writes are counted"""
+
+    hass = None
+    entity_id = None
+    writes = 0
+
+    @property
+    def unique_id(self):
+        return self._attr_unique_id
+
+    @property
+    def is_on(self):
+        return self._attr_is_on
+
+    def async_write_ha_state(self) -> None:
+        self.writes += 1
+
+    def async_on_remove(self, func) -> None:
+        pass
+
+
+class _Store:
+    def __init__(self, *args):
+        self.data = None
+
+    async def async_load(self):
+        return self.data
+
+    async def async_save(self, data) -> None:
+        self.data = data
+
+    def async_delay_save(self, data_func, delay) -> None:
+        self.data = data_func()
+
+
+def _stub_homeassistant() -> None:
+    _module("homeassistant.core", HomeAssistant=object, callback=lambda func: func)
+    _module("homeassistant.components.sensor", SensorEntity=_Entity,
+            STATE_CLASS_MEASUREMENT="measurement", STATE_CLASS_TOTAL_INCREASING="total_increasing",
+            DEVICE_CLASS_TEMPERATURE="temperature", DEVICE_CLASS_TIMESTAMP="timestamp",
+            DEVICE_CLASS_VOLTAGE="voltage")
+    _module("homeassistant.components.switch", SwitchEntity=_Entity)
+    _module("homeassistant.components.binary_sensor", BinarySensorEntity=_Entity)
+    _module("homeassistant.components.number", NumberEntity=_Entity)
+    _module("homeassistant.const", CONF_DEVICES="devices", CONF_ID="id", CONF_MODE="mode", CONF_NAME="name",
+            CONF_PORT="port", ELECTRIC_POTENTIAL_VOLT="V", ENTITY_CATEGORY_DIAGNOSTIC="diagnostic",
+            EVENT_HOMEASSISTANT_STOP="homeassistant_stop", PERCENTAGE="%", TEMP_CELSIUS="°C",
+            TIME_MILLISECONDS="ms")
+    _module("homeassistant.helpers.event", async_track_time_interval=lambda *args: lambda: None)
+    _module("homeassistant.helpers.storage", Store=_Store)
+    _module("homeassistant.helpers.typing", ConfigType=dict, StateType=object)
+    _module("homeassistant.util.dt", utc_from_timestamp=lambda timestamp: timestamp)
+
+
+def _load_package() -> None:
+    spec = importlib.util.spec_from_loader(DOMAIN, loader=None, is_package=True)
+    package = importlib.util.module_from_spec(spec)
+    package.__path__ = [ROOT]
+    sys.modules[DOMAIN] = package
+
+
+if importlib.util.find_spec("homeassistant") is None:
+    _stub_homeassistant()
+_load_package()
+
+
+class FakeHass:
+    """The parts of Home Assistant used by a port: its event loop and task creation"""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.bus = types.SimpleNamespace(async_listen_once=lambda event, func: None)
+
+    def async_create_task(self, coro):
+        return self.loop.create_task(coro)
+
+
+@pytest.fixture
+def fake_hass():
+    """Factory of the hass stand-in, called within the event loop of the test"""
+    return lambda: FakeHass(asyncio.get_running_loop())
@@ -0,0 +1,148 @@
+"""Scheduling of the I/O thread of a port: priorities, deadlines, pipelining and aborts"""
+from __future__ import annotations
+
+import asyncio
+import time
+
+import pytest
+
+from modbus_sw.bus import ModbusBus
+from modbus_sw.const import PRIORITY_POLL, PRIORITY_WRITE
+from modbus_sw.exceptions import ModbusAborted
+from modbus_sw.modbus_serial import ModbusSerialRtu
+from modbus_sw.modbus_tcp import ModbusTcp
+from modbus_sw.simulator import PtySimulator, TcpSimulator
+
+DEVICES = [
+    {"slave_id": 2, "coils": [{"id": id} for id in range(4)], "inputs": [{"id": 1, "value": 215}]},
+    {"slave_id": 3, "inputs": [{"id": 0, "value": 300}]},
+]
+
+
+@pytest.fixture
+def simulator():
+    with PtySimulator(DEVICES) as simulator:
+        yield simulator
+
+
+async def _connected_bus(hass, driver) -> ModbusBus:
+    bus = ModbusBus(hass, "port1", driver)
+    bus.start()
+    await bus.async_call(bus.connect, None)
+    return bus
+
+
+async def _busy(bus: ModbusBus, seconds: float) -> asyncio.Future:
+    """Keep the bus busy, the requests made meanwhile are queued behind the running call"""
+    busy = asyncio.ensure_future(bus.async_call(time.sleep, seconds))
+    await asyncio.sleep(0)
+    return busy
+
+
+async def _close(bus: ModbusBus) -> None:
+    await bus.async_call(bus.disconnect)
+    bus.stop()
+
+
+def _serial(simulator, response_timeout: float = 0.2) -> ModbusSerialRtu:
+    driver = ModbusSerialRtu(simulator.port, 9600, "N", 8, 1)
+    driver.set_response_timeout(response_timeout)
+    return driver
+
+
+def test_write_preempts_queued_polls(simulator, fake_hass):
+    async def run() -> list[str]:
+        bus = await _connected_bus(fake_hass(), _serial(simulator))
+        order = []
+
+        async def request(name: str, slave: int, priority: int) -> None:
+            await bus.async_request(slave, "read_input_registers", 0, 1, priority=priority)
+            order.append(name)
+
+        busy = await _busy(bus, 0.05)
+        await asyncio.gather(busy, request("poll 2", 2, PRIORITY_POLL), request("poll 3", 3, PRIORITY_POLL),
+                             request("write", 2, PRIORITY_WRITE))
+        await _close(bus)
+        return order
+
+    assert asyncio.run(run()) == ["write", "poll 2", "poll 3"]
+
+
+def test_deadline_expires_before_start(simulator, fake_hass):
+    async def run() -> None:
+        bus = await _connected_bus(fake_hass(), _serial(simulator))
+        busy = await _busy(bus, 0.1)
+        with pytest.raises(TimeoutError):
+            await bus.async_request(2, "read_input_registers", 1, 1, priority=PRIORITY_POLL, timeout=0.02)
+        await busy
+        assert bus.metrics.total.expired == 1
+        assert bus.metrics.slave(2).expired == 1
+        # the expired request was not sent, the slave is healthy
+        assert simulator.slaves[2].requests == 0
+        assert await bus.async_request(2, "read_input_registers", 1, 1, timeout=0.5) == [215]
+        await _close(bus)
+
+    asyncio.run(run())
+
+
+def test_pipelined_batch(fake_hass):
+    async def run() -> None:
+        with TcpSimulator(DEVICES) as simulator:
+            driver = ModbusTcp(simulator.host, simulator.port)
+            driver.set_response_timeout(0.2)
+            batches = []
+            execute_many = driver.execute_many
+
+            def record_batch(requests):
+                batches.append(len(requests))
+                return execute_many(requests)
+
+            driver.execute_many = record_batch
+            bus = await _connected_bus(fake_hass(), driver)
+            busy = await _busy(bus, 0.05)
+            requests = [
+                (2, "read_input_registers", (1, 1)),
+                (3, "read_input_registers", (0, 1)),
+                (2, "write_bit", (3, 1)),
+                (2, "read_bits", (0, 4)),
+            ]
+            results = await bus.async_cycle(requests, PRIORITY_POLL)
+            await busy
+            await _close(bus)
+        # the queued requests are sent together, and answered in the order of the requests
+        assert batches == [4]
+        assert results == [[215], [300], None, [0, 0, 0, 1]]
+        assert bus.metrics.total.transactions == 4
+
+    asyncio.run(run())
+
+
+def test_cancelled_request_is_aborted(simulator, fake_hass):
+    async def run() -> None:
+        # slave 9 is missing, its request would wait for the whole response timeout
+        bus = await _connected_bus(fake_hass(), _serial(simulator, 2))
+        start = time.monotonic()
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(bus.async_request(9, "read_bits", 0, 1), 0.1)
+        assert await bus.async_request(2, "read_input_registers", 1, 1) == [215]
+        assert time.monotonic() - start < 1
+        # the aborted transaction tells nothing about the slave
+        assert bus.health[9].failures == 0
+        await _close(bus)
+
+    asyncio.run(run())
+
+
+def test_abort_running_request(simulator, fake_hass):
+    async def run() -> None:
+        bus = await _connected_bus(fake_hass(), _serial(simulator, 2))
+        request = asyncio.ensure_future(bus.async_request(9, "read_bits", 0, 1))
+        await asyncio.sleep(0.05)
+        start = time.monotonic()
+        bus.abort()
+        with pytest.raises(ModbusAborted):
+            await request
+        assert time.monotonic() - start < 0.5
+        await _close(bus)
+
+    asyncio.run(run())
@@ -0,0 +1,62 @@
+"""Group coil writes of a port: broadcast frames or one frame per slave"""
+from __future__ import annotations
+
+import asyncio
+
+import pytest
+
+from configs import device_config, port_config
+from modbus_sw.device import ModbusPort
+from modbus_sw.modbus_serial import ModbusSerialRtu
+from modbus_sw.simulator import PtySimulator
+
+# slave 9 is on the bus, but left out of the config
+SLAVES = [{"slave_id": slave_id, "coils": [{"id": id} for id in range(4)]} for slave_id in (2, 3, 9)]
+
+
+@pytest.fixture
+def simulator():
+    with PtySimulator(SLAVES) as simulator:
+        yield simulator
+
+
+def _write_all(simulator, fake_hass, topology=None, **options) -> int:
+    """Switch on the coils of the configured slaves, returns the count of frames sent"""
+    async def run() -> int:
+        config = port_config(simulator.port, [device_config(2, 4), device_config(3, 4)], **options)
+        port = ModbusPort(fake_hass(), config, ModbusSerialRtu(simulator.port, 9600, "N", 8, 1))
+        port.topology = topology
+        await port.async_connect()
+        frames = simulator.frames
+        coils = [coil for device in port.devices for coil in device.coils.values()]
+        await port.async_write_coils(coils, True)
+        assert all(coil.is_on for coil in coils)
+        await port.async_close()
+        return simulator.frames - frames
+
+    return asyncio.run(run())
+
+
+def test_no_topology_writes_each_slave(simulator, fake_hass):
+    assert _write_all(simulator, fake_hass) == 2
+    assert list(simulator.slaves[2].coils[:4]) == [1] * 4
+    assert list(simulator.slaves[3].coils[:4]) == [1] * 4
+    assert not any(simulator.slaves[9].coils)
+
+
+def test_broadcast_option(simulator, fake_hass):
+    assert _write_all(simulator, fake_hass, broadcast=True) == 1
+    # the broadcast reaches the unconfigured slave too, the option tells there is none like it
+    assert list(simulator.slaves[9].coils[:4]) == [1] * 4
+
+
+def test_topology_with_other_slave(simulator, fake_hass):
+    topology = {slave_id: {"present": True, "coils": 4} for slave_id in (2, 3, 9)}
+    assert _write_all(simulator, fake_hass, topology, broadcast=True) == 2
+    assert not any(simulator.slaves[9].coils)
+
+
+def test_topology_of_the_configured_slaves(simulator, fake_hass):
+    topology = {2: {"present": True, "coils": 4}, 3: {"present": True, "coils": 4}, 9: {"present": False, "coils": 4}}
+    assert _write_all(simulator, fake_hass, topology) == 1
+    assert list(simulator.slaves[3].coils[:4]) == [1] * 4
@@ -0,0 +1,100 @@
+"""Backoff of the failing slaves"""
+from __future__ import annotations
+
+import asyncio
+
+import pytest
+
+from configs import device_config, port_config
+from modbus_sw.const import BACKOFF_INITIAL, FAILURE_THRESHOLD
+from modbus_sw.device import ModbusPort
+from modbus_sw.exceptions import (
+    ModbusAborted,
+    ModbusConnectionError,
+    ModbusCrcError,
+    ModbusException,
+    ModbusExceptionResponse,
+    ModbusTimeoutError,
+)
+from modbus_sw.health import SlaveHealth
+from modbus_sw.modbus_serial import ModbusSerialRtu
+from modbus_sw.simulator import PtySimulator
+
+
+def _failing(err: Exception) -> SlaveHealth:
+    health = SlaveHealth(2)
+    for _ in range(FAILURE_THRESHOLD):
+        assert health.allow()
+        health.record(err)
+    return health
+
+
+@pytest.mark.parametrize("err", [
+    ModbusTimeoutError("Connection timed out"),
+    ModbusCrcError("Invalid CRC"),
+    ModbusException("Response from unexpected slave 3"),
+    ModbusConnectionError("Connection closed by the server"),
+])
+def test_failures_start_backoff(err):
+    health = _failing(err)
+    assert not health.available
+    assert health.backoff == BACKOFF_INITIAL
+    assert not health.allow()
+
+
+@pytest.mark.parametrize("result", [None, ModbusExceptionResponse(2)])
+def test_response_ends_backoff(result):
+    health = _failing(ModbusTimeoutError())
+    health.record(result)
+    assert health.available
+    assert health.failures == 0
+
+
+def test_abort_tells_nothing():
+    health = _failing(ModbusTimeoutError())
+    health.record(ModbusAborted("Transaction aborted"))
+    assert not health.available
+    health = SlaveHealth(2)
+    for _ in range(FAILURE_THRESHOLD):
+        health.record(ModbusAborted("Transaction aborted"))
+    assert health.available
+
+
+def test_device_unavailable_in_backoff(fake_hass):
+    slaves = [{"slave_id": slave_id, "inputs": [{"id": 1, "value": 215}]} for slave_id in (2, 5)]
+
+    async def run(simulator) -> None:
+        config = port_config(simulator.port, [device_config(2, temperature=True), device_config(5, temperature=True)],
+                             response_timeout=50)
+        port = ModbusPort(fake_hass(), config, ModbusSerialRtu(simulator.port, 9600, "N", 8, 1))
+        await port.async_connect()
+        await port._async_update_state()
+        device = port.devices[1]
+        assert device.available
+
+        # the slave stops answering, it is unavailable after the failure threshold
+        simulator.slaves[5].drop_rate = 1.0
+        for _ in range(FAILURE_THRESHOLD - 1):
+            await port._async_update_state()
+            assert device.available
+        await port._async_update_state()
+        assert not device.available
+        assert port.devices[0].available
+
+        # the polls skip the slave in backoff until its probe is due
+        frames = simulator.frames
+        await port._async_update_state()
+        assert simulator.frames - frames == 1
+        assert not device.available
+
+        # the probe gets a response, the device is available again
+        simulator.slaves[5].drop_rate = 0.0
+        port._bus.health[5].next_probe = 0
+        frames = simulator.frames
+        await port._async_update_state()
+        assert simulator.frames - frames == 2
+        assert device.available
+        await port.async_close()
+
+    with PtySimulator(slaves) as simulator:
+        asyncio.run(run(simulator))
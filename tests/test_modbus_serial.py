@@ -0,0 +1,121 @@
+"""Serial RTU driver against the pty simulator"""
+from __future__ import annotations
+
+import os
+import threading
+import time
+import tty
+
+import pytest
+
+from modbus_sw.exceptions import ModbusConnectionError, ModbusCrcError, ModbusExceptionResponse, ModbusTimeoutError
+from modbus_sw.modbus_pdu import READ_HOLDING_REGISTERS, WRITE_SINGLE_COIL
+from modbus_sw.modbus_serial import ModbusSerialRtu, build_frame, crc16, response_length
+from modbus_sw.simulator import PtySimulator
+
+DEVICES = [
+    {"slave_id": 2, "coils": [{"id": id} for id in range(4)], "inputs": [{"id": 1, "value": 215}],
+     "holdings": [{"id": 0, "value": 7}]},
+    {"slave_id": 3, "coils": [{"id": 0}]},
+    {"slave_id": 4, "coils": [{"id": 0}], "crc_error_rate": 1.0},
+]
+
+
+@pytest.fixture
+def simulator():
+    with PtySimulator(DEVICES) as simulator:
+        yield simulator
+
+
+@pytest.fixture
+def driver(simulator):
+    driver = ModbusSerialRtu(simulator.port, 9600, "N", 8, 1)
+    driver.connect()
+    driver.set_response_timeout(0.2)
+    yield driver
+    driver.close()
+
+
+def test_crc16():
+    # read holding registers 0-9 of slave 1, the CRC is sent low byte first
+    assert build_frame(1, READ_HOLDING_REGISTERS, bytes.fromhex("0000000a")) == bytes.fromhex("01030000000ac5cd")
+    frame = build_frame(17, WRITE_SINGLE_COIL, bytes.fromhex("00acff00"))
+    assert crc16(frame) == 0
+
+
+def test_response_length():
+    assert response_length(bytes.fromhex("028302")) == 5
+    assert response_length(bytes.fromhex("020500")) == 8
+    assert response_length(bytes.fromhex("020306")) == 11
+
+
+def test_read_and_write(driver, simulator):
+    driver.set_slave(2)
+    assert driver.read_input_registers(0, 2) == [0, 215]
+    assert driver.read_registers(0, 1) == [7]
+    driver.write_bit(2, 1)
+    driver.write_bits(0, 2, [1, 1])
+    assert driver.read_bits(0, 4) == [1, 1, 1, 0]
+    driver.write_registers(0, [1, 2])
+    assert list(simulator.slaves[2].holding_registers[:2]) == [1, 2]
+
+
+def test_exception_response(driver):
+    driver.set_slave(2)
+    with pytest.raises(ModbusExceptionResponse) as info:
+        driver.read_input_registers(0, 100)
+    assert info.value.code == 2
+
+
+def test_timeout(driver):
+    driver.set_slave(9)
+    with pytest.raises(ModbusTimeoutError):
+        driver.read_bits(0, 1)
+
+
+def test_crc_error(driver):
+    driver.set_slave(4)
+    with pytest.raises(ModbusCrcError):
+        driver.read_bits(0, 1)
+    # the corrupted response is flushed, the next transaction is clean
+    driver.flush()
+    driver.set_slave(2)
+    assert driver.read_bits(0, 1) == [0]
+
+
+def test_broadcast(driver, simulator):
+    driver.set_slave(0)
+    driver.write_bit(0, 1)
+    driver.set_slave(3)
+    assert driver.read_bits(0, 1) == [1]
+    assert simulator.slaves[2].coils[0] == 1
+
+
+def test_hang_up(driver, simulator):
+    driver.set_slave(2)
+    driver.set_response_timeout(2)
+    # the master side of the pty is closed, the line hangs up
+    simulator.stop()
+    start = time.monotonic()
+    with pytest.raises(ModbusConnectionError):
+        driver.read_bits(0, 1)
+    assert time.monotonic() - start < 0.5
+
+
+def test_hang_up_while_waiting():
+    master, slave = os.openpty()
+    tty.setraw(master)
+    driver = ModbusSerialRtu(os.ttyname(slave), 9600, "N", 8, 1)
+    driver.connect()
+    driver.set_response_timeout(2)
+    driver.set_slave(2)
+    closer = threading.Timer(0.05, lambda: (os.close(master), os.close(slave)))
+    closer.start()
+    start = time.monotonic()
+    try:
+        with pytest.raises(ModbusConnectionError):
+            driver.read_bits(0, 1)
+        assert time.monotonic() - start < 0.5
+    finally:
+        closer.join()
+        driver.close()
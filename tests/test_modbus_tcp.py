@@ -0,0 +1,128 @@
+"""TCP driver against the TCP simulator"""
+from __future__ import annotations
+
+import struct
+
+import pytest
+
+from modbus_sw.exceptions import ModbusException, ModbusExceptionResponse, ModbusTimeoutError
+from modbus_sw.modbus_pdu import READ_HOLDING_REGISTERS
+from modbus_sw.modbus_tcp import ModbusTcp, _Connection
+from modbus_sw.simulator import TcpSimulator
+
+DEVICES = [
+    {"slave_id": 2, "coils": [{"id": id} for id in range(4)], "inputs": [{"id": 1, "value": 215}]},
+    {"slave_id": 3, "inputs": [{"id": 0, "value": 300}]},
+    {"slave_id": 4, "coils": [{"id": 0}], "drop_rate": 1.0},
+]
+
+
+@pytest.fixture
+def simulator():
+    with TcpSimulator(DEVICES) as simulator:
+        yield simulator
+
+
+@pytest.fixture
+def driver(simulator):
+    driver = ModbusTcp(simulator.host, simulator.port)
+    driver.set_response_timeout(0.2)
+    driver.connect()
+    yield driver
+    driver.close()
+
+
+def _mbap(transaction_id: int, unit: int, pdu: bytes) -> bytes:
+    return struct.pack(">HHHB", transaction_id, 0, len(pdu) + 1, unit) + pdu
+
+
+def test_read_and_write(driver):
+    driver.set_slave(2)
+    assert driver.read_input_registers(0, 2) == [0, 215]
+    driver.write_bit(1, 1)
+    assert driver.read_bits(0, 2) == [0, 1]
+
+
+def test_pipelined_batch(driver, simulator):
+    requests = [
+        (2, "read_input_registers", (1, 1)),
+        (3, "read_input_registers", (0, 1)),
+        (2, "read_input_registers", (0, 100)),
+        (2, "write_bit", (3, 1)),
+        (3, "read_input_registers", (0, 1)),
+    ]
+    results = driver.execute_many(requests)
+    assert results[0] == [215]
+    assert results[1] == [300]
+    assert isinstance(results[2], ModbusExceptionResponse)
+    assert results[3] is None
+    assert results[4] == [300]
+    assert simulator.slaves[2].coils[3] == 1
+
+
+def test_lost_response_fails_its_request_only(driver):
+    results = driver.execute_many([(2, "read_bits", (0, 1)), (4, "read_bits", (0, 1)),
+                                   (3, "read_input_registers", (0, 1))])
+    assert results[0] == [0]
+    assert isinstance(results[1], ModbusTimeoutError)
+    assert results[2] == [300]
+    # the connection is reopened by the next request
+    driver.set_slave(3)
+    assert driver.read_input_registers(0, 1) == [300]
+
+
+def test_transaction_id_matching():
+    driver = ModbusTcp("localhost")
+    connection = _Connection(("localhost", 502))
+    # the responses arrive out of order, with a late response of an abandoned request before them
+    connection.buffer += _mbap(7, 2, bytes((READ_HOLDING_REGISTERS, 2, 0, 9)))
+    connection.buffer += _mbap(11, 3, bytes((READ_HOLDING_REGISTERS, 2, 0, 33)))
+    connection.buffer += _mbap(10, 2, bytes((READ_HOLDING_REGISTERS, 2, 0, 22)))
+    connection.buffer += _mbap(12, 5, bytes((READ_HOLDING_REGISTERS, 2, 0, 44)))
+    pending = {
+        10: (0, 2, READ_HOLDING_REGISTERS),
+        11: (1, 3, READ_HOLDING_REGISTERS),
+        12: (2, 4, READ_HOLDING_REGISTERS),
+    }
+    results = [None] * 3
+    driver._receive_responses(connection, pending, results)
+    assert not pending
+    assert results[0] == bytes((2, 0, 22))
+    assert results[1] == bytes((2, 0, 33))
+    assert isinstance(results[2], ModbusException)
+    assert not connection.buffer
+
+
+def test_partial_frame_waits_for_the_rest():
+    driver = ModbusTcp("localhost")
+    connection = _Connection(("localhost", 502))
+    frame = _mbap(1, 2, bytes((READ_HOLDING_REGISTERS, 2, 0, 5)))
+    connection.buffer += frame[:8]
+    assert driver._pop_mbap(connection) is None
+    connection.buffer += frame[8:]
+    assert driver._pop_mbap(connection) == (1, 2, bytes((READ_HOLDING_REGISTERS, 2, 0, 5)))
+
+
+@pytest.mark.parametrize("header", ["000100000000", "000100000001", "000100010003"])
+def test_invalid_mbap_header(header):
+    driver = ModbusTcp("localhost")
+    connection = _Connection(("localhost", 502))
+    connection.buffer += bytes.fromhex(header) + bytes.fromhex("02030200050000")
+    with pytest.raises(ModbusException):
+        driver._pop_mbap(connection)
+
+
+def test_invalid_response_reopens_the_connection(driver, simulator, monkeypatch):
+    handle = simulator.handle
+    calls = []
+
+    def handle_once_invalid(unit, pdu):
+        calls.append(unit)
+        # an empty PDU is answered with a MBAP length of 1
+        return b"" if len(calls) == 1 else handle(unit, pdu)
+
+    monkeypatch.setattr(simulator, "handle", handle_once_invalid)
+    driver.set_slave(2)
+    with pytest.raises(ModbusException):
+        driver.read_input_registers(1, 1)
+    assert driver.read_input_registers(1, 1) == [215]
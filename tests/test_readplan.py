@@ -0,0 +1,94 @@
+"""Read blocks and the typed decoding of their registers"""
+from __future__ import annotations
+
+from array import array
+from types import SimpleNamespace
+
+import pytest
+
+from modbus_sw.const import CONF_COILS, CONF_INPUTS
+from modbus_sw.decoder import BlockDecoder, encode
+from modbus_sw.readplan import ReadBlock, plan_table
+
+DEVICE = SimpleNamespace(slave_id=2, port=SimpleNamespace(name="port"))
+
+
+def _register(data_type: str = "int16", word_order: str = "big", scale: float = 1, offset: float = 0):
+    return SimpleNamespace(data_type=data_type, word_order=word_order, scale=scale, offset=offset, autoupdate=30)
+
+
+def test_changed_coils():
+    points = {addr: SimpleNamespace(name=f"coil{addr}") for addr in (0, 3, 9, 15)}
+    block = ReadBlock(DEVICE, CONF_COILS, 30, 0, 16, points)
+    assert [value for _, value in block.changes()] == [False] * 4
+    assert block.changes() == []
+    block.buffer[9] = 1
+    block.buffer[15] = 1
+    # an unused address of the block is no change of a point
+    block.buffer[4] = 1
+    assert block._changed_indices() == [2, 3]
+    assert block.changes() == [(points[9], True), (points[15], True)]
+    assert block.changes() == []
+
+
+def test_changed_registers():
+    points = {0: _register(), 1: _register("int32"), 4: _register("float32", "little"), 7: _register()}
+    block = ReadBlock(DEVICE, CONF_INPUTS, 30, 0, 8, points)
+    block.changes()
+    # a change of the second word of a 32 bit point changes that point only
+    block.buffer[2] = 1
+    block.buffer[5] = 0x4000
+    block.buffer[7] = 0xFFFF
+    assert block._changed_indices() == [1, 2, 3]
+    assert block.changes() == [(points[1], 1), (points[4], 2.0), (points[7], -1)]
+
+
+def test_forced_changes():
+    points = {0: _register(), 1: _register()}
+    block = ReadBlock(DEVICE, CONF_INPUTS, 30, 0, 2, points)
+    block.changes()
+    assert block.changes(force=True) == [(points[0], 0), (points[1], 0)]
+    block.invalidate()
+    assert len(block.changes()) == 2
+
+
+@pytest.mark.parametrize("word_order, registers", [("big", [0x0001, 0x0002]), ("little", [0x0002, 0x0001])])
+def test_word_order(word_order, registers):
+    points = {0: _register("uint32", word_order), 2: _register("int32", word_order),
+              4: _register("float32", word_order)}
+    decoder = BlockDecoder(0, 6, points)
+    words = {"big": [0xFFFF, 0xFFFE, 0x3FC0, 0x0000], "little": [0xFFFE, 0xFFFF, 0x0000, 0x3FC0]}[word_order]
+    block = array("H", registers + words)
+    expected = [(points[0], 0x10002), (points[2], -2), (points[4], 1.5)]
+    assert decoder.decode(block) == expected
+    assert decoder.decode(block, [2, 0]) == [expected[2], expected[0]]
+    assert encode(points[0], 0x10002) == registers
+
+
+def test_scale_and_offset():
+    point = _register("int16", scale=0.1, offset=-40)
+    decoder = BlockDecoder(10, 1, {10: point})
+    assert decoder.decode(array("H", [615])) == [(point, 21.5)]
+    assert encode(point, 21.5) == [615]
+
+
+@pytest.mark.parametrize("scale, offset, raw, value", [
+    (0.25, 0, 3, 0.75),
+    (1, -40.5, 100, 59.5),
+    (0.1, 0.05, 7, 0.75),
+    (0.001, 0, 1234, 1.234),
+])
+def test_decimals_of_scale_and_offset(scale, offset, raw, value):
+    point = _register("int16", scale=scale, offset=offset)
+    decoder = BlockDecoder(0, 1, {0: point})
+    registers = array("H", [raw])
+    assert decoder.decode(registers) == [(point, value)]
+    assert decoder.decode(registers, [0]) == [(point, value)]
+    # the read back of a written value gives the same value
+    assert encode(point, value) == [raw]
+
+
+def test_plan_table():
+    points = {addr: _register() for addr in (0, 1, 5, 30, 31)}
+    blocks = plan_table(DEVICE, CONF_INPUTS, 30, points)
+    assert [(block.start, block.count) for block in blocks] == [(0, 6), (30, 2)]
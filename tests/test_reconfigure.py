@@ -0,0 +1,88 @@
+"""Reload of a port with a changed config, without a new connection"""
+from __future__ import annotations
+
+import asyncio
+import copy
+
+import pytest
+
+from configs import device_config, port_config
+from modbus_sw.device import ModbusPort, PointEntity
+from modbus_sw.metrics import MetricEntity
+from modbus_sw.modbus_serial import ModbusSerialRtu
+from modbus_sw.simulator import PtySimulator
+
+SLAVES = [
+    {"slave_id": slave_id, "coils": [{"id": id} for id in range(4)], "inputs": [{"id": 1, "value": 215}]}
+    for slave_id in (2, 3, 4, 5)
+]
+
+
+def _config(port: str) -> dict:
+    return port_config(port, [device_config(2, 4, temperature=True), device_config(3, 2, temperature=True),
+                              device_config(4, 1)])
+
+
+@pytest.fixture
+def simulator():
+    with PtySimulator(SLAVES) as simulator:
+        yield simulator
+
+
+def _kinds(entities) -> list[tuple[int, str]]:
+    return sorted((entity.device.slave_id, type(entity).__name__) for entity in entities
+                  if isinstance(entity, PointEntity))
+
+
+def _metric_slaves(entities) -> set[int]:
+    return {entity.slave_id for entity in entities if isinstance(entity, MetricEntity)}
+
+
+def test_reconfigure(simulator, fake_hass):
+    async def run() -> None:
+        config = _config(simulator.port)
+        driver = ModbusSerialRtu(simulator.port, 9600, "N", 8, 1)
+        port = ModbusPort(fake_hass(), config, driver)
+        await port.async_connect()
+        await port._async_update_state()
+        before = {entity.unique_id: entity for entity in port.entities}
+        assert port.devices[1].inputs[1]._attr_native_value == 21.5
+
+        changed = copy.deepcopy(config)
+        # slave 2: renamed coil, slave 3: rescaled input, slave 4: removed, slave 5: added
+        changed["devices"][0]["coils"][1]["name"] = "renamed"
+        changed["devices"][1]["inputs"][0]["scale"] = 0.01
+        del changed["devices"][2]
+        changed["devices"].append(device_config(5, 1))
+        assert port.same_connection(changed)
+        added, removed = port.reconfigure(changed)
+        assert _kinds(added) == [(3, "InputEntity"), (5, "CoilEntity")]
+        assert _kinds(removed) == [(3, "InputEntity"), (4, "CoilEntity")]
+        assert _metric_slaves(added) == {5}
+        assert _metric_slaves(removed) == {4}
+
+        # the entities of the unchanged points are kept, the renamed one too
+        renamed = port.devices[0].coils[1]
+        assert renamed is before[renamed.unique_id]
+        assert renamed.device is port.devices[0]
+        assert port.devices[1].coils[0] is before[port.devices[1].coils[0].unique_id]
+
+        # the bus stays connected with the same driver, the changed devices are polled
+        await port._async_update_state()
+        assert port._bus.driver is driver
+        assert port.devices[1].inputs[1]._attr_native_value == 2.15
+        assert port.devices[2].available
+        await port.async_close()
+
+    asyncio.run(run())
+
+
+def test_connection_change_needs_a_new_port(simulator, fake_hass):
+    async def run() -> None:
+        config = _config(simulator.port)
+        port = ModbusPort(fake_hass(), config, ModbusSerialRtu(simulator.port, 9600, "N", 8, 1))
+        assert port.same_connection(copy.deepcopy(config))
+        assert not port.same_connection({**config, "baudrate": 19200})
+        port.stop()
+
+    asyncio.run(run())
@@ -0,0 +1,24 @@
+"""Sample ring buffer of the fast polled points"""
+from __future__ import annotations
+
+from modbus_sw.samples import SampleBuffer
+
+
+def test_wraparound():
+    samples = SampleBuffer(4)
+    for second in range(6):
+        samples.add(float(second), second * 10.0)
+    assert len(samples) == 4
+    assert samples.as_list() == [(2.0, 20.0), (3.0, 30.0), (4.0, 40.0), (5.0, 50.0)]
+    assert samples.window(3.0) == [50.0, 40.0, 30.0]
+
+
+def test_aggregate():
+    samples = SampleBuffer(3)
+    assert samples.aggregate("mean", 0) is None
+    for second, value in enumerate((5.0, 1.0, 3.0, 7.0)):
+        samples.add(float(second), value)
+    assert samples.aggregate("min", 0) == 1.0
+    assert samples.aggregate("max", 0) == 7.0
+    assert samples.aggregate("mean", 2.0) == 5.0
+    assert samples.aggregate("mean", 10.0) is None
@@ -0,0 +1,54 @@
+"""Bus discovery of a port on the TCP simulator"""
+from __future__ import annotations
+
+import asyncio
+
+import pytest
+
+from configs import device_config, port_config
+from modbus_sw.device import ModbusPort
+from modbus_sw.modbus_tcp import ModbusTcp
+from modbus_sw.scanner import Topology
+from modbus_sw.simulator import TcpSimulator
+
+SLAVES = [
+    {"slave_id": 2, "coils": [{"id": id} for id in range(4)]},
+    {"slave_id": 3, "coils": [{"id": 0}], "inputs": [{"id": 9}]},
+    {"slave_id": 7, "coils": [{"id": id} for id in range(16)]},
+    {"slave_id": 9, "holdings": [{"id": 11}]},
+]
+
+
+@pytest.fixture
+def simulator():
+    with TcpSimulator(SLAVES) as simulator:
+        yield simulator
+
+
+def test_ranged_scans_merge(simulator, fake_hass):
+    async def run() -> None:
+        hass = fake_hass()
+        topology = Topology(hass)
+        config = port_config(f"{simulator.host}:{simulator.port}", [device_config(2, 4)], driver="tcp",
+                             response_timeout=100)
+        port = ModbusPort(hass, config, ModbusTcp(simulator.host, simulator.port), topology=topology)
+        await port.async_connect()
+
+        await port.async_scan(1, 20)
+        assert sorted(port.topology) == [2, 3, 7, 9]
+        assert port.topology[3] == {"present": True, "coils": 8, "discrete_inputs": 8, "inputs": 10, "holdings": 8}
+        assert port.topology[7]["coils"] == 16
+        assert port.topology[9]["holdings"] == 12
+
+        # a rescan of a part of the bus keeps the slaves out of its range
+        del simulator.slaves[3]
+        await port.async_scan(2, 3)
+        assert sorted(port.topology) == [2, 7, 9]
+        assert sorted(topology.slaves("port1")) == [2, 7, 9]
+
+        # the missing and the unconfigured slaves are left out of the metrics and the health
+        assert port.metrics.total.timeouts == 0
+        assert set(port._bus.health) <= {2}
+        await port.async_close()
+
+    asyncio.run(run())
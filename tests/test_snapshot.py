@@ -0,0 +1,112 @@
+"""State of the entities restored from the snapshot before the first poll"""
+from __future__ import annotations
+
+import asyncio
+
+import pytest
+
+from configs import device_config, port_config
+from modbus_sw.device import ModbusPort
+from modbus_sw.modbus_serial import ModbusSerialRtu
+from modbus_sw.simulator import PtySimulator
+from modbus_sw.snapshot import Snapshot
+
+SLAVES = [
+    {"slave_id": 2, "coils": [{"id": id} for id in range(2)], "inputs": [{"id": 1, "value": 215}]},
+    {"slave_id": 3, "coils": [{"id": id} for id in range(2)], "inputs": [{"id": 1, "value": 190}]},
+]
+
+
+@pytest.fixture
+def simulator():
+    with PtySimulator(SLAVES) as simulator:
+        yield simulator
+
+
+def _config(simulator) -> dict:
+    return port_config(simulator.port, [device_config(2, 2, temperature=True), device_config(3, 2, temperature=True)])
+
+
+def _port(simulator, hass, snapshot=None) -> tuple[ModbusPort, list[int]]:
+    """Port on the simulator and the slaves of its requests in the order sent"""
+    driver = ModbusSerialRtu(simulator.port, 9600, "N", 8, 1)
+    slaves = []
+    set_slave = driver.set_slave
+
+    def record_slave(slave):
+        slaves.append(slave)
+        set_slave(slave)
+
+    driver.set_slave = record_slave
+    return ModbusPort(hass, _config(simulator), driver, snapshot), slaves
+
+
+async def _saved_state(simulator, hass) -> dict[str, str]:
+    """Snapshot of the port after a poll"""
+    simulator.slaves[2].coils[1] = 1
+    port, _ = _port(simulator, hass)
+    await port.async_connect()
+    await port._async_update_state()
+    data = port.snapshot()
+    await port.async_close()
+    return data
+
+
+def test_restore_before_the_first_poll(simulator, fake_hass):
+    async def run() -> None:
+        hass = fake_hass()
+        snapshot = Snapshot(hass)
+        snapshot.data = {"port1": await _saved_state(simulator, hass)}
+        port, slaves = _port(simulator, hass, snapshot)
+        device = port.devices[0]
+        # the state is known without a request, and marked as restored
+        assert not slaves
+        assert device.available
+        assert device.coils[1].is_on
+        assert device.inputs[1]._attr_native_value == 21.5
+        assert device.inputs[1].extra_state_attributes == {"restored": True}
+
+        # the first poll confirms the restored state and sets the changes since the snapshot
+        simulator.slaves[2].input_registers[1] = 220
+        await port.async_connect()
+        await port._async_update_state()
+        assert device.inputs[1]._attr_native_value == 22.0
+        assert device.coils[1].is_on
+        assert not any(entity.restored for entity in port.devices[0].entities)
+        await port.async_close()
+
+    asyncio.run(run())
+
+
+def test_restored_blocks_are_read_last(simulator, fake_hass):
+    async def run() -> list[int]:
+        hass = fake_hass()
+        data = await _saved_state(simulator, hass)
+        port, slaves = _port(simulator, hass)
+        # only the state of slave 2 is restored, slave 3 is unknown
+        port.restore({block.key: data[block.key] for block in port.devices[0].blocks})
+        assert port.devices[0].available
+        assert not port.devices[1].available
+        await port.async_connect()
+        await port._async_update_state()
+        assert port.devices[1].available
+        await port.async_close()
+        return slaves
+
+    slaves = asyncio.run(run())
+    # the unknown states are read first, the restored ones have lower priority
+    assert slaves == [3] * slaves.count(3) + [2] * slaves.count(2)
+    assert slaves.count(2) == slaves.count(3) == 2
+
+
+def test_restore_skips_changed_blocks(simulator, fake_hass):
+    async def run() -> None:
+        hass = fake_hass()
+        data = await _saved_state(simulator, hass)
+        # the saved buffers are of another size than the blocks, e.g. of an older version
+        port, _ = _port(simulator, hass)
+        port.restore({key: "ffffff" for key in data})
+        assert not any(device.available for device in port.devices)
+        port.stop()
+
+    asyncio.run(run())
@@ -0,0 +1,135 @@
+"""Coil writes merged by the write window, and holding register writes with read-back"""
+from __future__ import annotations
+
+import asyncio
+
+import pytest
+
+from configs import device_config, port_config, register_config
+from modbus_sw.device import ModbusPort
+from modbus_sw.exceptions import ILLEGAL_FUNCTION, ModbusExceptionResponse
+from modbus_sw.modbus_pdu import WRITE_AND_READ_REGISTERS
+from modbus_sw.modbus_serial import ModbusSerialRtu
+from modbus_sw.simulator import PtySimulator
+from modbus_sw.simulator.slave import ILLEGAL_DATA_VALUE
+
+SLAVES = [
+    {"slave_id": 2, "coils": [{"id": id} for id in range(6)], "holdings": [{"id": id} for id in range(4)]},
+    {"slave_id": 3, "coils": [{"id": id} for id in range(4)]},
+]
+
+HOLDINGS = [register_config(id, f"setpoint_{id}", "generic", writable=True) for id in range(2)]
+
+
+@pytest.fixture
+def simulator():
+    with PtySimulator(SLAVES) as simulator:
+        yield simulator
+
+
+async def _port(simulator, hass) -> ModbusPort:
+    config = port_config(simulator.port, [device_config(2, 6, holdings=HOLDINGS), device_config(3, 4)])
+    port = ModbusPort(hass, config, ModbusSerialRtu(simulator.port, 9600, "N", 8, 1))
+    await port.async_connect()
+    return port
+
+
+def test_coil_writes_within_the_window_share_a_frame(simulator, fake_hass):
+    async def run() -> int:
+        port = await _port(simulator, fake_hass())
+        coils = port.devices[0].coils
+        frames = simulator.frames
+        # coil 3 is switched on, then off again before the frame is sent, the last write wins
+        await asyncio.gather(*(port.async_write_coil(coils[id], True) for id in (1, 0, 3, 2)),
+                             port.async_write_coil(coils[3], False))
+        frames = simulator.frames - frames
+        await port.async_close()
+        return frames
+
+    assert asyncio.run(run()) == 1
+    assert list(simulator.slaves[2].coils[:6]) == [1, 1, 1, 0, 0, 0]
+
+
+def test_coil_writes_are_split_by_slave_and_range(simulator, fake_hass):
+    async def run() -> int:
+        port = await _port(simulator, fake_hass())
+        coils_2, coils_3 = port.devices[0].coils, port.devices[1].coils
+        frames = simulator.frames
+        await asyncio.gather(port.async_write_coil(coils_2[0], True), port.async_write_coil(coils_2[5], True),
+                             port.async_write_coil(coils_3[1], True))
+        frames = simulator.frames - frames
+        await port.async_close()
+        return frames
+
+    assert asyncio.run(run()) == 3
+    assert list(simulator.slaves[2].coils[:6]) == [1, 0, 0, 0, 0, 1]
+    assert list(simulator.slaves[3].coils[:4]) == [0, 1, 0, 0]
+
+
+def test_holding_write_and_read(simulator, fake_hass):
+    async def run() -> None:
+        port = await _port(simulator, fake_hass())
+        device = port.devices[0]
+        # the other register of the block is changed by the device, the read-back gets it too
+        simulator.slaves[2].holding_registers[1] = 12
+        frames = simulator.frames
+        await port.async_write_holding(device.holdings[0], 42)
+        assert simulator.frames - frames == 1
+        assert simulator.slaves[2].holding_registers[0] == 42
+        assert device.holdings[0].value == 42
+        assert device.holdings[1].value == 12
+        assert device.write_and_read
+        await port.async_close()
+
+    asyncio.run(run())
+
+
+def _reject_write_and_read(slave, code: int, monkeypatch) -> None:
+    """Make the simulated slave answer FC23 with an exception response"""
+    handle = slave.handle
+
+    def handle_without_fc23(function, data):
+        if function == WRITE_AND_READ_REGISTERS:
+            return bytes((function | 0x80, code))
+        return handle(function, data)
+
+    monkeypatch.setattr(slave, "handle", handle_without_fc23)
+
+
+def test_holding_write_without_write_and_read(simulator, fake_hass, monkeypatch):
+    _reject_write_and_read(simulator.slaves[2], ILLEGAL_FUNCTION, monkeypatch)
+
+    async def run() -> None:
+        port = await _port(simulator, fake_hass())
+        device = port.devices[0]
+        frames = simulator.frames
+        # the rejected FC23, then FC16 and the read of the block
+        await port.async_write_holding(device.holdings[0], 42)
+        assert simulator.frames - frames == 3
+        assert not device.write_and_read
+        assert device.holdings[0].value == 42
+        # FC23 isn't tried again
+        frames = simulator.frames
+        await port.async_write_holding(device.holdings[1], 7)
+        assert simulator.frames - frames == 2
+        assert list(simulator.slaves[2].holding_registers[:2]) == [42, 7]
+        assert device.holdings[1].value == 7
+        await port.async_close()
+
+    asyncio.run(run())
+
+
+def test_holding_write_fails_on_other_exception_response(simulator, fake_hass, monkeypatch):
+    _reject_write_and_read(simulator.slaves[2], ILLEGAL_DATA_VALUE, monkeypatch)
+
+    async def run() -> None:
+        port = await _port(simulator, fake_hass())
+        device = port.devices[0]
+        with pytest.raises(ModbusExceptionResponse):
+            await port.async_write_holding(device.holdings[0], 42)
+        # only an unsupported function switches the slave to FC16
+        assert device.write_and_read
+        assert simulator.slaves[2].holding_registers[0] == 0
+        await port.async_close()
+
+    asyncio.run(run())